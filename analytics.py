@@ -0,0 +1,279 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import settings
+from logger import logger, init_logger
+from metrics import prepare_net_value
+from offline import iter_net_value_batches
+from store import CALC_FLOAT_FORMAT
+
+
+# 参与同类排名的指标 (calc_year.csv 中以这些名称结尾的列)
+RANK_METRICS = [
+    "total_return",
+    "annual_return_ratio",
+    "annual_volatility",
+    "sharpe",
+    "maximum_drawdown",
+]
+
+# 越小越好的指标 (排名时倒序，百分位越高表示越好)
+RANK_ASCENDING_METRICS = ["annual_volatility", "maximum_drawdown"]
+
+# 未在同类分组文件中的基金所属分组
+DEFAULT_PEER_GROUP = "all"
+
+
+def get_analytics_path(name: str, tmp=False) -> str:
+    """
+    获取跨基金分析结果文件地址
+    :param name: 结果名称
+    :param tmp: 是否为计算中的临时文件 (全部完成后替换正式文件)
+    :return: 文件地址
+    """
+    return settings.ANALYTICS_DIR + "/" + name + (".tmp.npy" if tmp else ".npy")
+
+
+def build_return_matrix(tmp_dir: str):
+    """
+    把已存储的净值数据对齐到共同的交易日历 (全部基金交易日的并集)，写出日对数收益矩阵
+    第一遍逐批计算每个基金的日对数收益并暂存，同时合并交易日历；第二遍按日历位置写入内存映射矩阵，
+    内存占用只与每批基金数量有关
+    :param tmp_dir: 暂存目录
+    :return: (基金代码数组, 交易日数组, 收益矩阵 [基金, 交易日]，没有净值的交易日为 NaN)
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    batch_paths = []
+    fund_code_list = []
+    trading_days = np.array([], dtype="datetime64[D]")
+    for df in iter_net_value_batches():
+        df = prepare_net_value(df)
+        if df.empty:
+            continue
+        fund_idx = df["fund_idx"].to_numpy()
+        day = df["trading_day"].to_numpy().astype("datetime64[D]")
+        nav = df["nav"].to_numpy()
+        # 日对数收益记在当天 (与上一个有净值的交易日相比)，每个基金的第一天没有收益
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ret = np.log(nav[1:] / nav[:-1])
+        keep = (fund_idx[1:] == fund_idx[:-1]) & np.isfinite(ret)
+        codes = df["fund_code"].to_numpy().astype(str)
+        batch_path = tmp_dir + "/batch_" + str(len(batch_paths)) + ".npz"
+        # 按行保存基金代码：fund_idx 是去掉空净值前的基金序号，净值全部为空的基金会让序号不连续
+        np.savez(
+            batch_path,
+            fund_code=codes[1:][keep],
+            day=day[1:][keep],
+            ret=ret[keep].astype("float32"),
+        )
+        batch_paths.append(batch_path)
+        fund_code_list.extend(pd.unique(codes))
+        trading_days = np.union1d(trading_days, day)
+
+    fund_codes = np.array(sorted(set(fund_code_list)), dtype=str)
+    returns = np.lib.format.open_memmap(
+        get_analytics_path("returns", True),
+        mode="w+",
+        dtype="float32",
+        shape=(len(fund_codes), len(trading_days)),
+    )
+    returns[:] = np.nan
+    for batch_path in batch_paths:
+        with np.load(batch_path) as batch:
+            rows = np.searchsorted(fund_codes, batch["fund_code"])
+            cols = np.searchsorted(trading_days, batch["day"])
+            returns[rows, cols] = batch["ret"]
+        os.remove(batch_path)
+    returns.flush()
+    return fund_codes, trading_days, returns
+
+
+def load_return_block(returns: np.ndarray, start: int, end: int, mean: np.ndarray):
+    """
+    读取一块基金的收益，减去各基金的平均收益 (减小求和时的抵消误差)，缺失值记为 0
+    :param returns: 收益矩阵 [基金, 交易日]
+    :param start: 起始基金位置
+    :param end: 结束基金位置 (不含)
+    :param mean: 各基金的平均收益
+    :return: (去均值后的收益, 收益平方, 有收益的标记)，均为 float32 [基金, 交易日]
+    """
+    block = np.array(returns[start:end])
+    mask = ~np.isnan(block)
+    block = np.where(mask, block - mean[start:end, None], 0).astype("float32")
+    return block, block * block, mask.astype("float32")
+
+
+def calc_correlation(returns: np.ndarray):
+    """
+    分块计算两两基金的相关系数与协方差 (只使用两个基金都有收益的交易日)
+    每对基金块用矩阵乘法求共同交易日数、收益和、平方和与乘积和，结果写入内存映射矩阵，
+    内存占用只与 settings.ANALYTICS_BLOCK_FUNDS 有关
+    :param returns: 收益矩阵 [基金, 交易日]
+    :return: (相关系数矩阵, 协方差矩阵)，未开启 settings.ANALYTICS_COVARIANCE 时协方差矩阵为 None
+    """
+    fund_num = returns.shape[0]
+    block_size = settings.ANALYTICS_BLOCK_FUNDS
+    min_overlap = max(settings.ANALYTICS_MIN_OVERLAP, 2)
+    corr = np.lib.format.open_memmap(
+        get_analytics_path("corr", True),
+        mode="w+",
+        dtype="float32",
+        shape=(fund_num, fund_num),
+    )
+    cov = None
+    if settings.ANALYTICS_COVARIANCE:
+        cov = np.lib.format.open_memmap(
+            get_analytics_path("cov", True),
+            mode="w+",
+            dtype="float32",
+            shape=(fund_num, fund_num),
+        )
+
+    mean = np.zeros(fund_num, dtype="float32")
+    for start in range(0, fund_num, block_size):
+        with np.errstate(invalid="ignore"):
+            block = np.array(returns[start : start + block_size])
+            counts = np.sum(~np.isnan(block), axis=1)
+            mean[start : start + block_size] = np.where(
+                counts > 0, np.nansum(block, axis=1) / np.maximum(counts, 1), 0
+            )
+
+    for i_start in range(0, fund_num, block_size):
+        i_end = min(i_start + block_size, fund_num)
+        x, x2, mx = load_return_block(returns, i_start, i_end, mean)
+        for j_start in range(i_start, fund_num, block_size):
+            j_end = min(j_start + block_size, fund_num)
+            if j_start == i_start:
+                y, y2, my = x, x2, mx
+            else:
+                y, y2, my = load_return_block(returns, j_start, j_end, mean)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                n = (mx @ my.T).astype("float64")
+                sx = (x @ my.T).astype("float64")
+                sy = (mx @ y.T).astype("float64")
+                sxx = (x2 @ my.T).astype("float64")
+                syy = (mx @ y2.T).astype("float64")
+                sxy = (x @ y.T).astype("float64")
+                cross = sxy - sx * sy / n
+                var_x = sxx - sx * sx / n
+                var_y = syy - sy * sy / n
+                block_corr = np.clip(cross / np.sqrt(var_x * var_y), -1, 1)
+                block_cov = cross / (n - 1)
+            is_valid = n >= min_overlap
+            # 净值不变的基金 (如货币基金停牌期间) 方差为 0，相关系数为空
+            block_corr[~(is_valid & (var_x > 0) & (var_y > 0))] = np.nan
+            block_cov[~is_valid] = np.nan
+            corr[i_start:i_end, j_start:j_end] = block_corr
+            corr[j_start:j_end, i_start:i_end] = block_corr.T
+            if cov is not None:
+                cov[i_start:i_end, j_start:j_end] = block_cov
+                cov[j_start:j_end, i_start:i_end] = block_cov.T
+        logger.info("计算相关系数矩阵，已完成基金数量：" + str(i_end) + "/" + str(fund_num) + "个")
+    corr.flush()
+    if cov is not None:
+        cov.flush()
+    return corr, cov
+
+
+def load_peer_groups() -> dict:
+    """
+    读取同类分组文件 (settings.PEER_GROUP_FILE)
+    :return: {基金代码: 分组名称}，未配置时为空
+    """
+    if not settings.PEER_GROUP_FILE:
+        return {}
+    from discovery import load_fund_code_file
+
+    return {
+        fund_code: peer_group
+        for fund_code, peer_group in load_fund_code_file(settings.PEER_GROUP_FILE)
+        if peer_group
+    }
+
+
+def calc_peer_ranks(year_df: pd.DataFrame, peer_groups: dict) -> pd.DataFrame:
+    """
+    计算每个基金的各时间段指标在同类基金中的百分位排名 (0~1，越大越好；指标为空的基金不参与排名)
+    :param year_df: 年计算结果 (calc_year.csv)
+    :param peer_groups: {基金代码: 分组名称}，不在其中的基金属于 DEFAULT_PEER_GROUP
+    :return: 每个基金一行的百分位排名，列名与年计算结果相同
+    """
+    rank_df = year_df[["fund_code", "fund_name"]].copy()
+    rank_df["peer_group"] = (
+        rank_df["fund_code"].map(peer_groups).fillna(DEFAULT_PEER_GROUP)
+    )
+    rank_cols = [
+        col
+        for col in year_df.columns
+        if any(col.endswith(metric) for metric in RANK_METRICS)
+    ]
+    grouped = pd.DataFrame(
+        {col: pd.to_numeric(year_df[col], errors="coerce") for col in rank_cols}
+    ).groupby(rank_df["peer_group"])
+    for col in rank_cols:
+        ascending = not any(col.endswith(metric) for metric in RANK_ASCENDING_METRICS)
+        rank_df[col] = grouped[col].rank(pct=True, ascending=ascending)
+    return rank_df
+
+
+def run_analytics():
+    """
+    跨基金分析：对齐全部已存储基金的日对数收益，计算两两相关系数、协方差矩阵，
+    以及年计算结果在同类基金中的百分位排名
+    结果写出到 settings.ANALYTICS_DIR (fund_codes / trading_days / returns / corr / cov .npy)
+    与 settings.CSV_WRITE_DIR/calc_peer_rank.csv；全部计算完成后才替换旧结果
+    :return:
+    """
+    init_logger()
+    logger.info("开始跨基金分析")
+    tmp_dir = settings.ANALYTICS_DIR + "/tmp"
+    fund_codes, trading_days, returns = build_return_matrix(tmp_dir)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(
+        "对齐日收益完成，基金数量："
+        + str(len(fund_codes))
+        + "个，交易日数量："
+        + str(len(trading_days))
+        + "天"
+    )
+    corr, cov = calc_correlation(returns)
+    del returns, corr, cov
+
+    np.save(get_analytics_path("fund_codes", True), fund_codes)
+    np.save(get_analytics_path("trading_days", True), trading_days)
+    names = ["fund_codes", "trading_days", "returns", "corr"]
+    if settings.ANALYTICS_COVARIANCE:
+        names.append("cov")
+    for name in names:
+        os.replace(get_analytics_path(name, True), get_analytics_path(name))
+
+    year_path = settings.CSV_WRITE_DIR + "/calc_year.csv"
+    if os.path.exists(year_path):
+        year_df = pd.read_csv(year_path, dtype={"fund_code": str}, encoding="utf-8-sig")
+        calc_peer_ranks(year_df, load_peer_groups()).to_csv(
+            settings.CSV_WRITE_DIR + "/calc_peer_rank.csv",
+            index=False,
+            encoding="utf-8-sig",
+            float_format=CALC_FLOAT_FORMAT,
+        )
+    logger.info("跨基金分析完成，基金数量：" + str(len(fund_codes)) + "个")
+
+
+def load_correlation(fund_code: str = None, name: str = "corr"):
+    """
+    读取相关系数 (或协方差) 矩阵，以内存映射方式打开，不读入整个矩阵
+    :param fund_code: 基金代码，提供时只返回该基金与其他基金的相关系数
+    :param name: corr 相关系数 / cov 协方差
+    :return: 未提供基金代码时为 (基金代码数组, 矩阵)；否则为以基金代码为索引的 Series，基金不存在时为 None
+    """
+    fund_codes = np.load(get_analytics_path("fund_codes"))
+    matrix = np.load(get_analytics_path(name), mmap_mode="r")
+    if fund_code is None:
+        return fund_codes, matrix
+    position = np.searchsorted(fund_codes, fund_code)
+    if position >= len(fund_codes) or fund_codes[position] != fund_code:
+        return None
+    return pd.Series(np.array(matrix[position]), index=fund_codes, name=fund_code)
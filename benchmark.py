@@ -0,0 +1,553 @@
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+from urllib.parse import parse_qs, urlparse
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import navstore
+import settings
+from logger import logger, init_logger
+from fetcher import HttpNetValueFetcher
+from format import net_values_to_array, net_values_to_frame, net_values_to_rows
+from metrics import calc_batch, calc_trailing
+from model import Database, bulk_upsert, NetValue
+from scheduler import AsyncCrawlScheduler
+from service import CalcService
+from store import ResultSink
+
+
+# 基准测试阶段 (按执行顺序，后面的阶段使用前面阶段的输出)
+STAGES = [
+    "crawl",
+    "parse",
+    "format",
+    "calc",
+    "calc_batch",
+    "store_csv",
+    "store_parquet",
+    "db_upsert",
+]
+
+# 合成净值数据的申购、赎回状态 (均为已知状态)
+PURCHASE_STATUSES = ["开放申购", "限制大额申购", "暂停申购"]
+REDEEM_STATUSES = ["开放赎回", "暂停赎回"]
+
+
+def make_fund_codes(funds: int) -> List[str]:
+    """
+    生成合成基金代码 (9 开头，避免与真实基金混淆)
+    :param funds: 基金数量
+    :return: 基金代码列表
+    """
+    return ["9" + str(i).zfill(5) for i in range(1, funds + 1)]
+
+
+def make_net_value_rows(fund_code: str, years: int) -> List[dict]:
+    """
+    生成单个基金的合成净值数据 (净值接口 LSJZList 格式，按交易日倒序；相同参数结果相同)
+    :param fund_code: 基金代码
+    :param years: 年数 (每年按 250 个交易日)
+    :return: 净值接口行列表
+    """
+    rng = np.random.default_rng(int(fund_code))
+    trading_days = pd.bdate_range(end="2023-12-29", periods=years * 250)
+    growth = rng.normal(0.0003, 0.01, len(trading_days))
+    unit_net_value = np.round(np.cumprod(1 + growth), 4)
+    cumulative_net_value = unit_net_value + 0.5
+    purchase_status = rng.choice(
+        PURCHASE_STATUSES, len(trading_days), p=[0.8, 0.15, 0.05]
+    )
+    redeem_status = rng.choice(REDEEM_STATUSES, len(trading_days), p=[0.95, 0.05])
+    rows = [
+        {
+            "FSRQ": trading_day,
+            "DWJZ": "%.4f" % unit,
+            "LJJZ": "%.4f" % cumulative,
+            "JZZZL": "%.2f" % (rate * 100),
+            "SGZT": purchase,
+            "SHZT": redeem,
+        }
+        for trading_day, unit, cumulative, rate, purchase, redeem in zip(
+            trading_days.strftime("%Y-%m-%d"),
+            unit_net_value,
+            cumulative_net_value,
+            growth,
+            purchase_status,
+            redeem_status,
+        )
+    ]
+    return rows[::-1]
+
+
+def make_fixture_pages(fund_codes: list, years: int, page_size: int) -> dict:
+    """
+    生成净值接口的分页响应夹具
+    :param fund_codes: 基金代码列表
+    :param years: 每个基金的年数
+    :param page_size: 每页条数
+    :return: {基金代码: [每页响应体 (bytes)]}
+    """
+    fixture_pages = {}
+    for fund_code in fund_codes:
+        rows = make_net_value_rows(fund_code, years)
+        fixture_pages[fund_code] = [
+            json.dumps(
+                {
+                    "Data": {"LSJZList": rows[start : start + page_size]},
+                    "ErrCode": 0,
+                    "ErrMsg": None,
+                    "TotalCount": len(rows),
+                    "PageSize": page_size,
+                    "PageIndex": start // page_size + 1,
+                },
+                ensure_ascii=False,
+            ).encode("utf-8")
+            for start in range(0, len(rows), page_size)
+        ]
+    return fixture_pages
+
+
+class FixtureServer(object):
+    """
+    本地净值接口夹具服务 (只监听 127.0.0.1，按 fundCode、pageIndex 返回夹具响应)
+    """
+
+    def __init__(self, fixture_pages: dict):
+        """
+        :param fixture_pages: make_fixture_pages 生成的分页响应
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                pages = fixture_pages.get(params.get("fundCode", [""])[0])
+                page_index = int(params.get("pageIndex", ["1"])[0])
+                if pages is None or not 1 <= page_index <= len(pages):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = pages[page_index - 1]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:" + str(self.server.server_port) + "/f10/lsjz"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextmanager
+def override_settings(**kwargs):
+    """
+    临时修改配置，退出时恢复
+    :param kwargs: {配置名: 配置值}
+    :return:
+    """
+    old_values = {name: getattr(settings, name) for name in kwargs}
+    for name, value in kwargs.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in old_values.items():
+            setattr(settings, name, value)
+
+
+def time_stage(func: Callable, repeat: int, setup: Callable = None) -> tuple:
+    """
+    重复执行阶段函数并计时 (setup 不计入耗时)
+    :param func: 阶段函数，参数为 setup 的返回值
+    :param repeat: 重复次数
+    :param setup: 每次执行前的准备函数
+    :return: (每次耗时列表, 最后一次的返回值)
+    """
+    runs = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        started_at = time.perf_counter()
+        result = func(arg) if setup is not None else func()
+        runs.append(time.perf_counter() - started_at)
+    return runs, result
+
+
+def stage_stats(runs: list, rows: int, extra: dict = None) -> dict:
+    """
+    汇总阶段耗时 (以最短耗时为准，受其他进程干扰最小)
+    :param runs: 每次耗时列表
+    :param rows: 处理的净值行数
+    :param extra: 附加信息
+    :return: 阶段结果
+    """
+    seconds = min(runs)
+    stats = {
+        "seconds": round(seconds, 6),
+        "median_seconds": round(statistics.median(runs), 6),
+        "runs": [round(run, 6) for run in runs],
+        "rows": rows,
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+    }
+    stats.update(extra or {})
+    return stats
+
+
+def bench_crawl(fixture_pages: dict, repeat: int) -> dict:
+    """
+    爬取阶段：asyncio 调度器从本地夹具服务获取全部分页 (不限速、不经过响应缓存，不含格式化与计算)
+    :param fixture_pages: make_fixture_pages 生成的分页响应
+    :param repeat: 重复次数
+    :return: 阶段结果
+    """
+    server = FixtureServer(fixture_pages)
+    stats = {}
+
+    def crawl():
+        scheduler = AsyncCrawlScheduler(
+            None, lambda fund_code, fund_name, raw_list, since, history_df: None
+        )
+        asyncio.run(
+            scheduler.run(
+                [(fund_code, "", None, None) for fund_code in fixture_pages],
+                lambda result: None,
+            )
+        )
+        stats.update(scheduler.stats)
+
+    try:
+        with override_settings(
+            NET_VALUE_API_URL=server.url,
+            DEFAULT_HOST_RATE_LIMIT=None,
+            HTTP_CACHE_ENABLED=False,
+        ):
+            runs, _ = time_stage(crawl, repeat)
+    finally:
+        server.close()
+    rows = sum(json.loads(pages[0])["TotalCount"] for pages in fixture_pages.values())
+    return stage_stats(runs, rows, {"requests": stats.get("requests")})
+
+
+def run_benchmark(
+    funds: int, years: int, repeat: int, stages: list = None, db_url: str = None
+) -> dict:
+    """
+    运行基准测试 (完全离线：合成净值数据、本地夹具服务与临时目录)
+    :param funds: 基金数量
+    :param years: 每个基金的年数
+    :param repeat: 每个阶段重复次数
+    :param stages: 运行的阶段，None 表示全部
+    :param db_url: db_upsert 阶段使用的数据库地址，None 表示临时 SQLite 文件 (MYSQL 替身)
+    :return: 基准测试结果
+    """
+    stages = stages or STAGES
+    fund_codes = make_fund_codes(funds)
+    page_size = settings.NET_VALUE_PAGE_SIZE
+    fixture_pages = make_fixture_pages(fund_codes, years, page_size)
+    total_rows = sum(
+        json.loads(pages[0])["TotalCount"] for pages in fixture_pages.values()
+    )
+    results = {}
+    tmp_dir = tempfile.mkdtemp(prefix="fund_benchmark_")
+
+    try:
+        if "crawl" in stages:
+            results["crawl"] = bench_crawl(fixture_pages, repeat)
+
+        # 解析：JSON 反序列化 + 净值接口行转换
+        def parse():
+            return {
+                fund_code: [
+                    net_value_obj
+                    for body in pages
+                    for net_value_obj in HttpNetValueFetcher.parse_page(
+                        fund_code, json.loads(body)
+                    )[0]
+                ]
+                for fund_code, pages in fixture_pages.items()
+            }
+
+        runs, raw_lists = time_stage(parse, repeat)
+        if "parse" in stages:
+            results["parse"] = stage_stats(runs, total_rows)
+
+        # 格式化：原始字典转换为紧凑结构化数组
+        def format_all():
+            return {
+                fund_code: net_values_to_array(raw_list)
+                for fund_code, raw_list in raw_lists.items()
+            }
+
+        runs, net_value_arrays = time_stage(format_all, repeat)
+        if "format" in stages:
+            results["format"] = stage_stats(runs, total_rows)
+        net_value_dfs = {
+            fund_code: net_values_to_frame(fund_code, net_values)
+            for fund_code, net_values in net_value_arrays.items()
+        }
+
+        # 计算：与工作进程中相同，逐个基金计算年、月、近期区间指标
+        def calc():
+            calc_results = []
+            for fund_code, df in net_value_dfs.items():
+                year_df, month_df = CalcService.calc(df, fund_code, fund_code)
+                rolling_df, rolling_series_df = CalcService.calc_rolling(
+                    df, fund_code, fund_code
+                )
+                calc_results.append(
+                    {
+                        "fund_code": fund_code,
+                        "last_trading_day": str(df["trading_day"].max()),
+                        "year_df": year_df,
+                        "month_df": month_df,
+                        "rolling_df": rolling_df,
+                        "rolling_series_df": rolling_series_df,
+                        "net_value_df": df,
+                    }
+                )
+            return calc_results
+
+        calc_results = None
+        if any(stage in stages for stage in ("calc", "store_csv", "store_parquet")):
+            runs, calc_results = time_stage(calc, repeat if "calc" in stages else 1)
+            if "calc" in stages:
+                results["calc"] = stage_stats(runs, total_rows)
+
+        if "calc_batch" in stages:
+            long_df = pd.concat(net_value_dfs.values(), ignore_index=True)
+            fund_names = {fund_code: fund_code for fund_code in fund_codes}
+
+            def calc_all():
+                calc_batch(long_df, fund_names)
+                calc_trailing(long_df, fund_names)
+
+            runs, _ = time_stage(calc_all, repeat)
+            results["calc_batch"] = stage_stats(runs, total_rows)
+
+        # 存储：经过 ResultSink 写出净值与计算结果 (每次写入新的临时目录)
+        for stage, store_type in (("store_csv", "CSV"), ("store_parquet", "PARQUET")):
+            if stage not in stages:
+                continue
+            if store_type == "PARQUET":
+                try:
+                    import pyarrow  # noqa: F401
+                except ImportError:
+                    logger.warning("未安装 pyarrow，跳过基准测试阶段：" + stage)
+                    continue
+
+            def setup():
+                store_dir = tempfile.mkdtemp(dir=tmp_dir)
+                return store_dir
+
+            def store(store_dir):
+                # 全量写出时 ResultSink 会清空净值存储 (settings.NAV_STORE_DIR)，关闭净值存储并指向临时目录，
+                # 同时丢弃进程内已创建的实例，不删除正式的净值存储
+                with override_settings(
+                    STORE_TYPE=store_type,
+                    CSV_READ_PATH=store_dir + "/net_value.csv",
+                    CSV_WRITE_DIR=store_dir,
+                    PARQUET_DIR=store_dir + "/net_value",
+                    NAV_STORE_ENABLED=False,
+                    NAV_STORE_DIR=store_dir + "/nav_store",
+                ):
+                    navstore._nav_store = None
+                    sink = ResultSink()
+                    for result in calc_results:
+                        sink.write(result)
+                    sink.close()
+
+            runs, _ = time_stage(store, repeat, setup)
+            results[stage] = stage_stats(runs, total_rows)
+
+        # 数据库：净值转换为字典后批量 upsert
+        if "db_upsert" in stages:
+            url = db_url or "sqlite:///" + os.path.join(tmp_dir, "benchmark.db")
+            db = Database(url)
+            db.connect()
+            db.create_tables()
+
+            def clear():
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        NetValue.__table__.delete().where(
+                            NetValue.fund_code.in_(fund_codes)
+                        )
+                    )
+
+            def upsert(_):
+                for fund_code, net_values in net_value_arrays.items():
+                    bulk_upsert(
+                        db.engine,
+                        net_values_to_rows(fund_code, net_values),
+                        settings.MYSQL_BATCH_SIZE,
+                    )
+
+            try:
+                runs, _ = time_stage(upsert, repeat, clear)
+                clear()
+            finally:
+                db.disconnect()
+            results["db_upsert"] = stage_stats(
+                runs, total_rows, {"dialect": db.engine.dialect.name}
+            )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "funds": funds,
+            "years": years,
+            "repeat": repeat,
+            "rows": total_rows,
+            "page_size": page_size,
+        },
+        "stages": results,
+    }
+
+
+def get_git_commit() -> Optional[str]:
+    """
+    获取当前代码的 git 提交 (不是 git 仓库时返回 None)
+    :return: 提交哈希
+    """
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def compare_results(result: dict, baseline: dict, threshold: float) -> list:
+    """
+    与基准结果对比各阶段耗时
+    :param result: 本次结果
+    :param baseline: 基准结果
+    :param threshold: 耗时增幅超过该比例视为性能退化
+    :return: [(阶段, 基准耗时, 本次耗时, 耗时比例, 是否退化)]
+    """
+    if result["params"] != baseline.get("params"):
+        logger.warning("基准结果的测试参数不同，对比结果仅供参考")
+    comparisons = []
+    for stage, stats in result["stages"].items():
+        baseline_stats = baseline.get("stages", {}).get(stage)
+        if baseline_stats is None or not baseline_stats["seconds"]:
+            continue
+        ratio = stats["seconds"] / baseline_stats["seconds"]
+        comparisons.append(
+            (
+                stage,
+                baseline_stats["seconds"],
+                stats["seconds"],
+                ratio,
+                ratio > 1 + threshold,
+            )
+        )
+    return comparisons
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="离线基准测试：爬取、解析、格式化、计算与存储各阶段的吞吐量")
+    parser.add_argument(
+        "--funds", type=int, default=settings.BENCHMARK_FUNDS, help="基金数量"
+    )
+    parser.add_argument(
+        "--years", type=int, default=settings.BENCHMARK_YEARS, help="每个基金的净值年数"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=settings.BENCHMARK_REPEAT, help="每个阶段重复次数"
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, help="只运行指定阶段")
+    parser.add_argument("--db-url", help="db_upsert 阶段的数据库地址 (默认临时 SQLite 文件)")
+    parser.add_argument(
+        "--output", default=settings.BENCHMARK_OUTPUT, help="结果文件 (JSON)"
+    )
+    parser.add_argument("--compare", help="对比的基准结果文件 (JSON)，有阶段退化时返回码为 1")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=settings.BENCHMARK_REGRESSION_THRESHOLD,
+        help="耗时增幅超过该比例视为退化",
+    )
+    args = parser.parse_args(argv)
+    init_logger()
+
+    result = run_benchmark(
+        args.funds, args.years, args.repeat, args.stages, args.db_url
+    )
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    for stage, stats in result["stages"].items():
+        logger.info(
+            "基准测试阶段："
+            + stage
+            + "，耗时："
+            + str(stats["seconds"])
+            + "秒，每秒行数："
+            + str(stats["rows_per_second"])
+        )
+    logger.info("基准测试结果已写入：" + args.output)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressed = False
+        for stage, baseline_seconds, seconds, ratio, is_regressed in compare_results(
+            result, baseline, args.threshold
+        ):
+            regressed = regressed or is_regressed
+            message = (
+                "阶段："
+                + stage
+                + "，基准耗时："
+                + str(baseline_seconds)
+                + "秒，本次耗时："
+                + str(seconds)
+                + "秒，比例："
+                + str(round(ratio, 3))
+            )
+            if is_regressed:
+                logger.warning("性能退化，" + message)
+            else:
+                logger.info(message)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+from typing import Optional
+from urllib.parse import urlencode
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+import settings
+from logger import logger
+
+
+class ResponseCache(object):
+    """
+    本地 HTTP 响应缓存 (SQLite，响应体 zlib 压缩)：
+    以地址和请求参数为键；不可变的响应 (已结束的历史区间) 永久使用，
+    其余响应超过 max_age 后携带 ETag / Last-Modified 条件请求重新验证；
+    总大小超过上限时按最近访问时间淘汰；离线模式下只读缓存，不发送请求
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        max_bytes: int = None,
+        max_age: float = None,
+        offline: bool = None,
+    ):
+        """
+        :param path: 缓存文件地址
+        :param max_bytes: 缓存总大小上限 (压缩后字节数)
+        :param max_age: 可变响应无需重新验证的有效期 (秒)
+        :param offline: 离线模式 (只读缓存，未命中时报错)
+        """
+        self.path = path or settings.HTTP_CACHE_PATH
+        self.max_bytes = max_bytes or settings.HTTP_CACHE_MAX_BYTES
+        self.max_age = settings.HTTP_CACHE_MAX_AGE if max_age is None else max_age
+        self.offline = settings.HTTP_CACHE_OFFLINE if offline is None else offline
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.puts = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self.get_conn()
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response (
+                    key TEXT PRIMARY KEY,
+                    content BLOB NOT NULL,
+                    encoding TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    immutable INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_accessed_at "
+                "ON response (accessed_at)"
+            )
+
+    def get_conn(self) -> sqlite3.Connection:
+        """
+        获取当前线程的数据库连接 (sqlite3 连接不能跨线程、进程使用)
+        :return: 数据库连接
+        """
+        conn = getattr(self.local, "conn", None)
+        # 进程池 fork 出的子进程不能沿用父进程的连接
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(url: str, params: dict = None) -> str:
+        """
+        生成缓存键 (参数按名称排序)
+        :param url: 请求地址
+        :param params: 请求参数
+        :return: 缓存键
+        """
+        if not params:
+            return url
+        return url + "?" + urlencode(sorted(params.items()))
+
+    @staticmethod
+    def make_response(url: str, content: bytes, encoding: str) -> requests.Response:
+        """
+        由缓存内容构造响应对象 (调用方可像普通响应一样使用 json()/text)
+        :param url: 请求地址
+        :param content: 响应体
+        :param encoding: 响应编码
+        :return: 响应对象
+        """
+        response = requests.Response()
+        response._content = content
+        response.status_code = 200
+        response.encoding = encoding
+        response.url = url
+        return response
+
+    def get(
+        self,
+        session: requests.Session,
+        url: str,
+        params: dict = None,
+        immutable: bool = False,
+        timeout=None,
+    ) -> requests.Response:
+        """
+        带缓存的 GET 请求
+        :param session: 会话
+        :param url: 请求地址
+        :param params: 请求参数
+        :param immutable: 响应是否不可变 (不可变的响应命中后不再请求)
+        :param timeout: 请求超时时间 (秒)
+        :return: 响应对象 (非 200/304 的响应原样返回且不缓存)
+        """
+        response = self.lookup(url, params)
+        if response is not None:
+            return response
+        key = self.make_key(url, params)
+        conn = self.get_conn()
+        row = conn.execute(
+            "SELECT content, encoding, etag, last_modified FROM response WHERE key = ?",
+            (key,),
+        ).fetchone()
+        now = time.time()
+        # 离线模式下已缓存的响应都由 lookup 返回
+        if self.offline:
+            raise Exception("离线模式下缓存未命中：" + key)
+
+        headers = {}
+        if row is not None:
+            etag, last_modified = row[2], row[3]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = session.get(url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and row is not None:
+            with conn:
+                conn.execute(
+                    "UPDATE response SET fetched_at = ?, accessed_at = ?, immutable = ? "
+                    "WHERE key = ?",
+                    (now, now, int(immutable), key),
+                )
+            return self.make_response(url, zlib.decompress(row[0]), row[1])
+        if response.status_code == 200:
+            self.put(key, response, immutable, now)
+        return response
+
+    def lookup(self, url: str, params: dict = None) -> Optional[requests.Response]:
+        """
+        查找不需要发送请求即可使用的缓存响应 (离线模式、不可变或缓存时间未超过 settings.HTTP_CACHE_MAX_AGE)
+        :param url: 请求地址
+        :param params: 请求参数
+        :return: 响应对象，未命中或需要重新验证时返回 None
+        """
+        key = self.make_key(url, params)
+        row = (
+            self.get_conn()
+            .execute(
+                "SELECT content, encoding, immutable, fetched_at FROM response "
+                "WHERE key = ?",
+                (key,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        content, encoding, is_immutable, fetched_at = row
+        now = time.time()
+        if self.offline or is_immutable or now - fetched_at <= self.max_age:
+            self.touch(key, now)
+            return self.make_response(url, zlib.decompress(content), encoding)
+        return None
+
+    def delete(self, url: str, params: dict = None):
+        """
+        删除缓存 (响应内容无效时调用，如接口限流返回的错误信息)
+        :param url: 请求地址
+        :param params: 请求参数
+        :return:
+        """
+        with self.get_conn() as conn:
+            conn.execute(
+                "DELETE FROM response WHERE key = ?", (self.make_key(url, params),)
+            )
+
+    def touch(self, key: str, now: float):
+        with self.get_conn() as conn:
+            conn.execute(
+                "UPDATE response SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+
+    def put(self, key: str, response: requests.Response, immutable: bool, now: float):
+        """
+        写入缓存，每写入 settings.HTTP_CACHE_EVICT_INTERVAL 条检查一次总大小
+        :param key: 缓存键
+        :param response: 响应对象
+        :param immutable: 响应是否不可变
+        :param now: 当前时间
+        :return:
+        """
+        content = zlib.compress(response.content)
+        with self.get_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response (key, content, encoding, etag, "
+                "last_modified, immutable, size, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    content,
+                    response.encoding,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    int(immutable),
+                    len(content),
+                    now,
+                    now,
+                ),
+            )
+        with self.lock:
+            self.puts += 1
+            need_evict = self.puts % settings.HTTP_CACHE_EVICT_INTERVAL == 0
+        if need_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        总大小超过上限时，按最近访问时间从旧到新淘汰，直到低于上限的 90%
+        :return:
+        """
+        conn = self.get_conn()
+        total_size = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response"
+        ).fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        target_size = total_size - self.max_bytes * 0.9
+        evict_keys = []
+        evict_size = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM response ORDER BY accessed_at"
+        ):
+            evict_keys.append((key,))
+            evict_size += size
+            if evict_size >= target_size:
+                break
+        with conn:
+            conn.executemany("DELETE FROM response WHERE key = ?", evict_keys)
+        logger.info(
+            "HTTP 缓存超过上限，淘汰" + str(len(evict_keys)) + "条，释放" + str(evict_size) + "字节"
+        )
+
+    def close(self):
+        """
+        关闭当前线程的数据库连接
+        :return:
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.pid == os.getpid():
+            conn.close()
+        self.local.conn = None
+
+
+# 进程内共享的缓存实例
+_response_cache = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    获取进程内共享的响应缓存 (未开启 settings.HTTP_CACHE_ENABLED 时返回 None)
+    :return: 响应缓存
+    """
+    global _response_cache
+    if not settings.HTTP_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
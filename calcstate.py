@@ -0,0 +1,132 @@
+from typing import Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import settings
+from logger import logger
+from metrics import CALC_STATE_VERSION
+
+
+class CalcStateStore(object):
+    """
+    指标累积状态存储 (SQLite，状态为 JSON)：每个基金一行，
+    增量模式下按已存储的最新交易日取出状态，只用新增净值更新年、月指标
+    (工作进程各自打开连接，写入时由 SQLite 加锁)
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: 状态文件地址
+        """
+        self.path = path or settings.CALC_STATE_PATH
+        self.local = threading.local()
+        self.get_conn()
+
+    def get_conn(self) -> sqlite3.Connection:
+        """
+        获取当前线程的数据库连接 (sqlite3 连接不能跨线程、进程使用)
+        :return: 数据库连接
+        """
+        conn = getattr(self.local, "conn", None)
+        # 进程池 fork 出的子进程不能沿用父进程的连接
+        if conn is None or self.local.pid != os.getpid():
+            # 每次新建连接时建表 (长期运行的进程中状态文件可能已被删除重建)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS calc_state (
+                        fund_code TEXT PRIMARY KEY,
+                        last_trading_day TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                    """
+                )
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, fund_code: str, last_trading_day: str) -> Optional[dict]:
+        """
+        获取基金的累积状态
+        :param fund_code: 基金代码
+        :param last_trading_day: 已存储的最新交易日 (与状态不一致时状态失效，
+        如上次运行写出状态后、净值写出前被中断)
+        :return: 累积状态，不存在或已失效时返回 None
+        """
+        row = (
+            self.get_conn()
+            .execute(
+                "SELECT last_trading_day, state FROM calc_state WHERE fund_code = ?",
+                (fund_code,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        if row[0] != last_trading_day:
+            logger.info(
+                "指标累积状态与已存储数据不一致，使用完整历史重新计算，基金代码："
+                + fund_code
+                + "，状态交易日："
+                + row[0]
+                + "，已存储交易日："
+                + str(last_trading_day)
+            )
+            return None
+        state = json.loads(row[1])
+        # 状态版本或计算使用的净值 (settings.CALC_NAV_TYPE) 变化时状态失效
+        if (
+            state.get("version") != CALC_STATE_VERSION
+            or state.get("nav_type") != settings.CALC_NAV_TYPE
+        ):
+            return None
+        return state
+
+    def put(self, fund_code: str, state: dict):
+        """
+        写入基金的累积状态
+        :param fund_code: 基金代码
+        :param state: 累积状态
+        :return:
+        """
+        with self.get_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO calc_state "
+                "(fund_code, last_trading_day, state, updated_at) VALUES (?, ?, ?, ?)",
+                (fund_code, state["last_trading_day"], json.dumps(state), time.time()),
+            )
+
+    def close(self):
+        """
+        关闭当前线程的数据库连接
+        :return:
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.pid == os.getpid():
+            conn.close()
+        self.local.conn = None
+
+
+# 进程内共享的状态存储实例
+_calc_state_store = None
+
+
+def get_calc_state_store() -> Optional[CalcStateStore]:
+    """
+    获取进程内共享的指标累积状态存储 (未开启 settings.CALC_STATE_ENABLED 或使用 Decimal 精确计算时返回 None)
+    :return: 状态存储
+    """
+    global _calc_state_store
+    if not settings.CALC_STATE_ENABLED or settings.CALC_EXACT_DECIMAL:
+        return None
+    if _calc_state_store is None:
+        _calc_state_store = CalcStateStore()
+    return _calc_state_store
@@ -0,0 +1,300 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+import settings
+from logger import logger
+from cache import get_response_cache
+
+
+# 基金列表接口返回中的数据数组与总页数
+DATAS_PATTERN = re.compile(r"datas\s*:\s*\[(.*?)\]", re.S)
+ALL_PAGES_PATTERN = re.compile(r"allPages\s*:\s*(\d+)")
+ROW_PATTERN = re.compile(r'"([^"]*)"')
+
+
+class FundListDiscovery(object):
+    """
+    基金列表发现器：并发翻页获取完整基金列表
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        page_size: int = None,
+        concurrency: int = None,
+        timeout=None,
+    ):
+        """
+        :param base_url: 基金列表接口地址 (测试时可指向本地桩服务)
+        :param page_size: 每页条数
+        :param concurrency: 并发翻页线程数
+        :param timeout: 请求超时时间 (秒)
+        """
+        self.base_url = base_url or settings.FUND_LIST_API_URL
+        self.page_size = page_size or settings.FUND_LIST_PAGE_SIZE
+        self.concurrency = concurrency or settings.FUND_LIST_CONCURRENCY
+        self.timeout = timeout or settings.HTTP_TIMEOUT
+        self.local = threading.local()
+        self.cache = get_response_cache()
+
+    def get_session(self) -> requests.Session:
+        """
+        获取当前线程的会话 (会话在线程内复用)
+        :return: 会话
+        """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(settings.HTTP_HEADERS)
+            session.headers["Referer"] = settings.FUND_LIST_REFERER
+            self.local.session = session
+        return session
+
+    def fetch_page(self, fund_type: str, page_index: int) -> Tuple[list, int]:
+        """
+        获取单页基金列表
+        :param fund_type: 基金类型 (接口 ft 参数)
+        :param page_index: 页码 (从1开始)
+        :return: ([(基金代码, 基金名称)], 总页数)
+        """
+        params = {
+            "op": "ph",
+            "dt": "kf",
+            "ft": fund_type,
+            "rs": "",
+            "gs": 0,
+            "sc": "dm",
+            "st": "asc",
+            "qdii": "",
+            "tabSubtype": ",,,,,",
+            "pi": page_index,
+            "pn": self.page_size,
+            "dx": 1,
+        }
+        if self.cache is not None:
+            response = self.cache.get(
+                self.get_session(), self.base_url, params, timeout=self.timeout
+            )
+        else:
+            response = self.get_session().get(
+                self.base_url, params=params, timeout=self.timeout
+            )
+        response.raise_for_status()
+        return self.parse_page(response.text)
+
+    @staticmethod
+    def parse_page(text: str) -> Tuple[list, int]:
+        """
+        解析单页基金列表接口返回 (var rankData = {datas:["代码,名称,..."],allPages:n,...})
+        :param text: 接口返回文本
+        :return: ([(基金代码, 基金名称)], 总页数)
+        """
+        datas_match = DATAS_PATTERN.search(text)
+        if datas_match is None:
+            raise Exception("基金列表接口返回格式错误：" + text[:200])
+        all_pages_match = ALL_PAGES_PATTERN.search(text)
+        total_pages = int(all_pages_match.group(1)) if all_pages_match else 1
+
+        fund_list = []
+        for row in ROW_PATTERN.findall(datas_match.group(1)):
+            fields = row.split(",")
+            if len(fields) < 2 or fields[0] == "":
+                continue
+            fund_list.append((fields[0], fields[1]))
+        return fund_list, total_pages
+
+    def discover_type(self, fund_type: str) -> List[Tuple[str, str]]:
+        """
+        获取一个基金类型的完整列表 (首页获取总页数后，其余页并发获取)
+        :param fund_type: 基金类型
+        :return: [(基金代码, 基金名称)]
+        """
+        fund_list, total_pages = self.fetch_page(fund_type, 1)
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for page_fund_list, _ in executor.map(
+                    lambda page_index: self.fetch_page(fund_type, page_index),
+                    range(2, total_pages + 1),
+                ):
+                    fund_list.extend(page_fund_list)
+        logger.info(
+            "获取基金列表成功，基金类型："
+            + fund_type
+            + "，页数："
+            + str(total_pages)
+            + "，基金数量："
+            + str(len(fund_list))
+            + "个"
+        )
+        return fund_list
+
+    def discover(self, fund_types: list = None) -> List[Tuple[str, str]]:
+        """
+        获取多个基金类型的完整列表 (按基金代码去重并排序)
+        :param fund_types: 基金类型列表
+        :return: [(基金代码, 基金名称)]
+        """
+        fund_dict = {}
+        for fund_type in fund_types or settings.FUND_TYPES:
+            for fund_code, fund_name in self.discover_type(fund_type):
+                fund_dict.setdefault(fund_code, fund_name)
+        return sorted(fund_dict.items())
+
+    def close(self):
+        """
+        释放会话 (只能释放当前线程的会话，其余线程的会话随线程回收)
+        :return:
+        """
+        session = getattr(self.local, "session", None)
+        if session is not None:
+            session.close()
+
+
+def load_fund_list_cache(path: str, ttl: int, fund_types: list):
+    """
+    读取基金列表缓存
+    :param path: 缓存文件地址
+    :param ttl: 缓存有效期 (秒)
+    :param fund_types: 基金类型列表 (与缓存时不同则缓存失效)
+    :return: [(基金代码, 基金名称)]，缓存不存在或失效时返回 None
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except Exception as e:
+        logger.warning("读取基金列表缓存失败，错误信息：" + str(e))
+        return None
+    if time.time() - cache.get("created_at", 0) > ttl:
+        return None
+    if cache.get("fund_types") != list(fund_types):
+        return None
+    return [tuple(fund) for fund in cache["funds"]]
+
+
+def save_fund_list_cache(path: str, fund_types: list, fund_list: list):
+    """
+    写入基金列表缓存 (先写临时文件再替换，避免中断时留下不完整的缓存)
+    :param path: 缓存文件地址
+    :param fund_types: 基金类型列表
+    :param fund_list: [(基金代码, 基金名称)]
+    :return:
+    """
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created_at": time.time(),
+                "fund_types": list(fund_types),
+                "funds": fund_list,
+            },
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_fund_code_file(path: str) -> List[Tuple[str, str]]:
+    """
+    读取基金代码文件 (每行一个基金代码，可选以逗号分隔的基金名称，# 开头为注释)
+    :param path: 文件地址
+    :return: [(基金代码, 基金名称)]，未提供名称时为空字符串
+    """
+    fund_list = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",", 1)]
+            fund_list.append((fields[0], fields[1] if len(fields) > 1 else ""))
+    return fund_list
+
+
+def filter_fund_list(
+    fund_list: list, code_ranges: list = None, code_file_list: list = None
+) -> List[Tuple[str, str]]:
+    """
+    按基金代码过滤基金列表
+    :param fund_list: [(基金代码, 基金名称)]
+    :param code_ranges: 基金代码区间列表 [(起始代码, 结束代码)]，闭区间
+    :param code_file_list: 基金代码文件中的基金列表，提供时直接使用其中的基金
+    (不在基金列表中的代码同样保留；文件中未提供名称时使用基金列表中的名称)
+    :return: [(基金代码, 基金名称)]
+    """
+    if code_file_list is not None:
+        fund_names = dict(fund_list)
+        if fund_names:
+            missing_codes = [
+                fund_code
+                for fund_code, _ in code_file_list
+                if fund_code not in fund_names
+            ]
+            if missing_codes:
+                logger.warning(
+                    "基金代码文件中有"
+                    + str(len(missing_codes))
+                    + "个基金不在基金列表中："
+                    + ",".join(missing_codes[:20])
+                )
+        fund_list = [
+            (fund_code, fund_name or fund_names.get(fund_code, ""))
+            for fund_code, fund_name in dict(code_file_list).items()
+        ]
+    if code_ranges:
+        fund_list = [
+            (fund_code, fund_name)
+            for fund_code, fund_name in fund_list
+            if any(start <= fund_code <= end for start, end in code_ranges)
+        ]
+    return fund_list
+
+
+def discover_fund_codes(refresh: bool = False) -> List[Tuple[str, str]]:
+    """
+    获取待爬取的基金列表：读取缓存 (失效时并发重新获取)，再按配置过滤、截断；
+    设置了基金代码文件时直接使用文件中的基金，不再获取基金列表 (未提供的名称从未失效的缓存中补充)
+    :param refresh: 忽略缓存，强制重新获取
+    :return: [(基金代码, 基金名称)]
+    """
+    fund_types = settings.FUND_TYPES
+    code_file_list = None
+    fund_list = None
+    if settings.FUND_CODE_FILE:
+        code_file_list = load_fund_code_file(settings.FUND_CODE_FILE)
+        logger.info("使用基金代码文件，基金数量：" + str(len(code_file_list)) + "个")
+        fund_list = (
+            load_fund_list_cache(
+                settings.FUND_LIST_CACHE_PATH, settings.FUND_LIST_CACHE_TTL, fund_types
+            )
+            or []
+        )
+    elif not refresh:
+        fund_list = load_fund_list_cache(
+            settings.FUND_LIST_CACHE_PATH, settings.FUND_LIST_CACHE_TTL, fund_types
+        )
+        if fund_list is not None:
+            logger.info("使用基金列表缓存，基金数量：" + str(len(fund_list)) + "个")
+    if fund_list is None:
+        discovery = FundListDiscovery()
+        try:
+            fund_list = discovery.discover(fund_types)
+        finally:
+            discovery.close()
+        save_fund_list_cache(settings.FUND_LIST_CACHE_PATH, fund_types, fund_list)
+
+    fund_list = filter_fund_list(fund_list, settings.FUND_CODE_RANGES, code_file_list)
+    if settings.MAX_FUND_NUM is not None:
+        fund_list = fund_list[: settings.MAX_FUND_NUM]
+    return fund_list
@@ -0,0 +1,391 @@
+from datetime import date, timedelta
+from typing import Iterator, List, Tuple
+import time
+import traceback
+
+import requests
+
+import settings
+from logger import logger
+from cache import get_response_cache
+
+
+def create_chrome():
+    """
+    创建无头浏览器驱动器
+    :return: 浏览器驱动器
+    """
+    # 浏览器相关依赖只在 SELENIUM 类型下导入，HTTP 类型与离线命令不需要加载
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromiumService
+    from webdriver_manager.chrome import ChromeDriverManager
+    from webdriver_manager.core.utils import ChromeType
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-gpu")
+    return webdriver.Chrome(
+        options=options,
+        service=ChromiumService(
+            ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
+        ),
+    )
+
+
+class NetValueFetcher(object):
+    """
+    净值数据获取器基类
+    (产出的字典可直接交给 format.net_values_to_array 格式化)
+    """
+
+    def __init__(self):
+        # 各页加载耗时 (秒)，由 pop_page_timings 取出
+        self.page_timings = []
+
+    def fetch(self, fund_code: str, since: str = None) -> Iterator[dict]:
+        """
+        获取净值数据 (按交易日倒序)
+        :param fund_code: 基金代码
+        :param since: 已存储的最新交易日 (YYYYMMDD)，到达该日即停止翻页，None 表示全量
+        :return: 净值原始字典迭代器
+        """
+        raise NotImplementedError
+
+    def pop_page_timings(self) -> list:
+        """
+        取出自上次调用以来各页的加载耗时 (秒)
+        :return: 耗时列表
+        """
+        page_timings = self.page_timings
+        self.page_timings = []
+        return page_timings
+
+    def close(self):
+        """
+        释放资源
+        :return:
+        """
+        pass
+
+
+class HttpNetValueFetcher(NetValueFetcher):
+    """
+    基于 HTTP/JSON 接口的净值数据获取器
+    """
+
+    def __init__(self, base_url: str = None, page_size: int = None, timeout=None):
+        """
+        :param base_url: 净值接口地址 (测试时可指向本地桩服务)
+        :param page_size: 每页条数
+        :param timeout: 请求超时时间 (秒)
+        """
+        super().__init__()
+        self.base_url = base_url or settings.NET_VALUE_API_URL
+        self.page_size = page_size or settings.NET_VALUE_PAGE_SIZE
+        self.timeout = timeout or settings.HTTP_TIMEOUT
+        self.session = requests.Session()
+        self.session.headers.update(settings.HTTP_HEADERS)
+        self.cache = get_response_cache()
+
+    def fetch(self, fund_code: str, since: str = None) -> Iterator[dict]:
+        if since is None and self.cache is not None:
+            return self.fetch_windows(fund_code)
+        return self.fetch_pages(fund_code, since)
+
+    def fetch_pages(self, fund_code: str, since: str = None) -> Iterator[dict]:
+        """
+        按页码逐页获取净值数据
+        :param fund_code: 基金代码
+        :param since: 已存储的最新交易日 (YYYYMMDD)，到达该日即停止翻页，None 表示全量
+        :return: 净值原始字典迭代器 (按交易日倒序)
+        """
+        page_index = 1
+        total_pages = 1
+        while page_index <= total_pages:
+            net_value_obj_list, total_pages = self.fetch_page(fund_code, page_index)
+            for net_value_obj in net_value_obj_list:
+                if since is not None and net_value_obj["trading_day"] <= since:
+                    return
+                yield net_value_obj
+            page_index += 1
+
+    def fetch_windows(self, fund_code: str) -> Iterator[dict]:
+        """
+        按自然年区间获取全部净值数据 (开启响应缓存时使用)：
+        按页码分页的结果随每日新增净值整体后移，无法缓存；已结束的年份区间内容不再变化，可以永久缓存
+        :param fund_code: 基金代码
+        :return: 净值原始字典迭代器 (按交易日倒序)
+        """
+        net_value_obj_list, total_pages = self.fetch_page(fund_code, 1)
+        if total_pages <= 1:
+            yield from net_value_obj_list
+            return
+        first_net_value_obj_list, _ = self.fetch_page(fund_code, total_pages)
+        if not net_value_obj_list or not first_net_value_obj_list:
+            # 首页或末页的净值全部为空时无法确定起止交易日，按页码获取
+            yield from self.fetch_pages(fund_code)
+            return
+        for window in year_windows(
+            first_net_value_obj_list[-1]["trading_day"],
+            net_value_obj_list[0]["trading_day"],
+        ):
+            page_index = 1
+            total_pages = 1
+            while page_index <= total_pages:
+                window_net_value_obj_list, total_pages = self.fetch_page(
+                    fund_code, page_index, window
+                )
+                yield from window_net_value_obj_list
+                page_index += 1
+
+    def fetch_page(
+        self, fund_code: str, page_index: int, window: tuple = None
+    ) -> Tuple[list, int]:
+        """
+        获取单页净值数据
+        :param fund_code: 基金代码
+        :param page_index: 页码 (从1开始)
+        :param window: 交易日区间 (起始日, 结束日, 是否不可变)，None 表示不限
+        :return: (净值原始字典列表, 总页数)
+        """
+        params = self.page_params(fund_code, page_index, window)
+        started_at = time.perf_counter()
+        response = self.request(self.base_url, params, window is not None and window[2])
+        self.page_timings.append(time.perf_counter() - started_at)
+        try:
+            response.raise_for_status()
+            return self.parse_page(fund_code, response.json())
+        except Exception:
+            if self.cache is not None:
+                self.cache.delete(self.base_url, params)
+            raise
+
+    def request(self, url: str, params: dict, immutable: bool = False):
+        """
+        发送请求 (开启响应缓存时经过缓存)
+        :param url: 请求地址
+        :param params: 请求参数
+        :param immutable: 响应是否不可变
+        :return: 响应对象
+        """
+        if self.cache is not None:
+            return self.cache.get(self.session, url, params, immutable, self.timeout)
+        return self.session.get(url, params=params, timeout=self.timeout)
+
+    def page_params(
+        self, fund_code: str, page_index: int, window: tuple = None
+    ) -> dict:
+        """
+        单页净值请求参数
+        :param fund_code: 基金代码
+        :param page_index: 页码 (从1开始)
+        :param window: 交易日区间 (起始日, 结束日, 是否不可变)，None 表示不限
+        :return: 请求参数
+        """
+        params = {
+            "fundCode": fund_code,
+            "pageIndex": page_index,
+            "pageSize": self.page_size,
+        }
+        if window is not None:
+            params["startDate"] = window[0]
+            params["endDate"] = window[1]
+        return params
+
+    @staticmethod
+    def parse_page(fund_code: str, data: dict) -> Tuple[list, int]:
+        """
+        解析单页净值接口返回
+        :param fund_code: 基金代码
+        :param data: 接口返回的 JSON
+        :return: (净值原始字典列表, 总页数)
+        """
+        if data.get("ErrCode", 0) != 0:
+            raise Exception(
+                "净值接口返回错误，基金代码：" + fund_code + "，错误信息：" + str(data.get("ErrMsg"))
+            )
+        total_count = data.get("TotalCount") or 0
+        page_size = data.get("PageSize") or 1
+        total_pages = (total_count + page_size - 1) // page_size
+
+        net_value_obj_list = []
+        empty_days = []
+        for row in (data.get("Data") or {}).get("LSJZList") or []:
+            unit_net_value = row.get("DWJZ") or ""
+            cumulative_net_value = row.get("LJJZ") or ""
+            if unit_net_value == "" or cumulative_net_value == "":
+                # 净值为空的交易日不写入，数据质量检查时作为缺失交易日补爬
+                empty_days.append(row.get("FSRQ") or "")
+                continue
+            daily_growth_rate = row.get("JZZZL") or ""
+            net_value_obj_list.append(
+                {
+                    "fund_code": fund_code,
+                    "trading_day": row["FSRQ"].replace("-", ""),
+                    "unit_net_value": unit_net_value,
+                    "cumulative_net_value": cumulative_net_value,
+                    "daily_growth_rate": daily_growth_rate
+                    if daily_growth_rate not in ("", "--")
+                    else "0",
+                    "purchase_status": (row.get("SGZT") or "").strip(),
+                    "redeem_status": (row.get("SHZT") or "").strip(),
+                }
+            )
+        if empty_days:
+            log_empty_days(fund_code, empty_days)
+        return net_value_obj_list, total_pages
+
+    def close(self):
+        self.session.close()
+
+
+def log_empty_days(fund_code: str, trading_days: list):
+    """
+    记录净值为空、已跳过的交易日
+    :param fund_code: 基金代码
+    :param trading_days: 交易日列表
+    :return:
+    """
+    logger.warning(
+        "净值为空的交易日已跳过，基金代码："
+        + fund_code
+        + "，交易日："
+        + ",".join(trading_days)
+        + "，共"
+        + str(len(trading_days))
+        + "天"
+    )
+
+
+def year_windows(first_day: str, last_day: str) -> List[tuple]:
+    """
+    按自然年切分交易日区间 (从新到旧)
+    结束日早于 settings.HTTP_CACHE_IMMUTABLE_DAYS 天前的区间视为不可变 (留出净值延迟公布、更正的时间)
+    :param first_day: 最早交易日 (YYYYMMDD)
+    :param last_day: 最新交易日 (YYYYMMDD)
+    :return: [(起始日, 结束日, 是否不可变)]，日期格式为 YYYY-MM-DD
+    """
+    immutable_before = date.today() - timedelta(days=settings.HTTP_CACHE_IMMUTABLE_DAYS)
+    windows = []
+    for year in range(int(last_day[:4]), int(first_day[:4]) - 1, -1):
+        windows.append(
+            (
+                str(year) + "-01-01",
+                str(year) + "-12-31",
+                date(year, 12, 31) < immutable_before,
+            )
+        )
+    return windows
+
+
+class SeleniumNetValueFetcher(NetValueFetcher):
+    """
+    基于浏览器页面的净值数据获取器 (备用)
+    """
+
+    def __init__(self, chrome):
+        """
+        :param chrome: 浏览器驱动器
+        """
+        super().__init__()
+        self.chrome = chrome
+
+    def fetch(self, fund_code: str, since: str = None) -> Iterator[dict]:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        # 页面加载耗时：从打开页面 / 点击下一页到读取完本页表格
+        started_at = time.perf_counter()
+        self.chrome.get("http://fundf10.eastmoney.com/jjjz_" + fund_code + ".html")
+
+        is_last_page = False
+        empty_days = []
+
+        while not is_last_page:
+            try:
+                WebDriverWait(self.chrome, 10).until(
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, "#jztable > table > tbody > tr")
+                    )
+                )
+            except Exception as e:
+                logger.warning("获取净值数据失败，基金代码：" + fund_code)
+                logger.error(e)
+                logger.error(traceback.format_exc())
+                return
+            net_value_tr_list = self.chrome.find_elements(
+                By.CSS_SELECTOR, "#jztable > table > tbody > tr"
+            )
+
+            for net_value_tr in net_value_tr_list:
+                net_value_obj = {"fund_code": fund_code}
+                trading_day_str = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(1)"
+                ).text
+                net_value_obj["trading_day"] = trading_day_str.strip().replace("-", "")
+                if since is not None and net_value_obj["trading_day"] <= since:
+                    if empty_days:
+                        log_empty_days(fund_code, empty_days)
+                    return
+                net_value_obj["unit_net_value"] = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(2)"
+                ).text
+                net_value_obj["cumulative_net_value"] = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(3)"
+                ).text
+                if (
+                    net_value_obj["unit_net_value"] == ""
+                    or net_value_obj["cumulative_net_value"] == ""
+                ):
+                    empty_days.append(net_value_obj["trading_day"])
+                    continue
+                daily_growth_rate = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(4)"
+                ).text
+                net_value_obj["daily_growth_rate"] = (
+                    daily_growth_rate if daily_growth_rate != "--" else "0"
+                )
+                purchase_status = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(5)"
+                ).text
+                purchase_status = purchase_status.strip()
+
+                net_value_obj["purchase_status"] = purchase_status
+
+                redeem_status = net_value_tr.find_element(
+                    By.CSS_SELECTOR, "td:nth-child(6)"
+                ).text
+                redeem_status = redeem_status.strip()
+
+                net_value_obj["redeem_status"] = redeem_status
+                yield net_value_obj
+            self.page_timings.append(time.perf_counter() - started_at)
+            if empty_days:
+                log_empty_days(fund_code, empty_days)
+                empty_days = []
+
+            page_btns = self.chrome.find_elements(
+                By.CSS_SELECTOR, "#pagebar > div.pagebtns > label"
+            )
+            next_page_btn = page_btns[-1]
+            class_attribute = next_page_btn.get_attribute("class")
+            is_last_page = "end" in class_attribute.split()
+            if not is_last_page:
+                started_at = time.perf_counter()
+                next_page_btn.click()
+
+
+def create_fetcher(chrome=None) -> NetValueFetcher:
+    """
+    按配置创建净值数据获取器
+    :param chrome: 浏览器驱动器 (SELENIUM 类型需要)
+    :return: 净值数据获取器
+    """
+    if settings.FETCHER_TYPE == "HTTP":
+        return HttpNetValueFetcher()
+    elif settings.FETCHER_TYPE == "SELENIUM":
+        return SeleniumNetValueFetcher(chrome)
+    else:
+        raise Exception("FETCHER_TYPE must be HTTP or SELENIUM")
@@ -1,56 +1,213 @@
-from model import NetValue
-from decimal import Decimal
 from logger import logger
+import numpy as np
+import pandas as pd
 
 
-def net_value_formatter(obj):
-    daily_growth_rate = obj["daily_growth_rate"]
-    daily_growth_rate = (
-        None
-        if daily_growth_rate is None
-        else Decimal(obj["daily_growth_rate"].strip("%")) / 100
-    )
-    obj["daily_growth_rate"] = daily_growth_rate
-    obj["unit_net_value"] = (
-        None if obj["unit_net_value"] == "" else obj["unit_net_value"]
-    )
-    obj["cumulative_net_value"] = (
-        None if obj["cumulative_net_value"] == "" else obj["cumulative_net_value"]
+# 净值数据的紧凑行类型 (交易日为 YYYYMMDD 整数，缺失的净值为 NaN；基金代码每批只保存一份，不逐行存储)
+NET_VALUE_DTYPE = np.dtype(
+    [
+        ("trading_day", "i4"),
+        ("unit_net_value", "f8"),
+        ("cumulative_net_value", "f8"),
+        ("daily_growth_rate", "f8"),
+        ("purchase_status", "i1"),
+        ("redeem_status", "i1"),
+    ]
+)
+
+
+# 申购状态代码
+PURCHASE_STATUS_CODES = {
+    "开放申购": 0,
+    "封闭期": 1,
+    "暂停申购": 2,
+    "限制大额申购": 3,
+    "场内买入": 4,
+}
+
+# 赎回状态代码
+REDEEM_STATUS_CODES = {
+    "开放赎回": 0,
+    "封闭期": 1,
+    "暂停赎回": 2,
+    "场内卖出": 3,
+}
+
+# 未知状态的代码
+UNKNOWN_STATUS_CODE = -1
+
+
+def build_status_lookup(status_codes: dict) -> tuple:
+    """
+    预先构造状态查找表 (状态索引 + 代码数组，代码数组末尾为未知状态代码，索引查找失败返回的 -1 正好指向它)
+    :param status_codes: {状态: 代码}
+    :return: (状态索引, 代码数组)
+    """
+    return (
+        pd.Index(list(status_codes.keys())),
+        np.array(list(status_codes.values()) + [UNKNOWN_STATUS_CODE], dtype="int8"),
     )
 
-    purchase_dict = {
-        "开放申购": 0,
-        "封闭期": 1,
-        "暂停申购": 2,
-        "限制大额申购": 3,
-        "场内买入": 4,
-    }
-    if obj["purchase_status"] in purchase_dict:
-        obj["purchase_status"] = purchase_dict.get(obj["purchase_status"])
-    else:
+
+PURCHASE_STATUS_LOOKUP = build_status_lookup(PURCHASE_STATUS_CODES)
+REDEEM_STATUS_LOOKUP = build_status_lookup(REDEEM_STATUS_CODES)
+
+
+def parse_numbers(values) -> np.ndarray:
+    """
+    批量解析数值字符串，空字符串或 None 解析为 NaN
+    :param values: 字符串序列
+    :return: float64 数组
+    """
+    try:
+        return np.fromiter(map(float, values), dtype="float64", count=len(values))
+    except (TypeError, ValueError):
+        # 含有空值或无法解析的值时，逐个容错解析
+        return pd.to_numeric(np.asarray(values, dtype=object), errors="coerce").astype(
+            "float64"
+        )
+
+
+def parse_growth_rates(values) -> np.ndarray:
+    """
+    批量解析日增长率 (百分数，页面上可能带 % 号)
+    :param values: 字符串序列
+    :return: 小数形式的 float64 数组
+    """
+    values = np.asarray(values, dtype=object)
+    rates = parse_numbers(values)
+    # 只有解析失败的非空值需要去掉 % 号重新解析 (HTTP 接口返回的值不带 % 号)
+    retry = np.isnan(rates) & pd.notna(values) & (values != "")
+    if retry.any():
+        rates[retry] = parse_numbers([value.strip("%") for value in values[retry]])
+    # 除以 100 后按 8 位小数取整，与十进制计算结果一致 (避免 0.0123 变成 0.012300000000000002)
+    return np.round(rates / 100, 8)
+
+
+def map_status(values, lookup: tuple, fund_code: str, status_name: str) -> np.ndarray:
+    """
+    批量转换状态文字为代码，未知状态记为 UNKNOWN_STATUS_CODE，并按状态汇总成一条警告
+    :param values: 状态文字序列
+    :param lookup: build_status_lookup 构造的查找表
+    :param fund_code: 基金代码 (用于警告信息)
+    :param status_name: 状态名称 (用于警告信息)
+    :return: int8 数组
+    """
+    status_index, codes = lookup
+    positions = status_index.get_indexer(values)
+    unknown = positions == -1
+    if unknown.any():
+        unknown_counts = (
+            pd.Series(np.asarray(values, dtype=object)[unknown]).value_counts().items()
+        )
         logger.warning(
-            "purchase_status is not in purchase_list: " + obj["purchase_status"]
+            "未知的"
+            + status_name
+            + "，已记为"
+            + str(UNKNOWN_STATUS_CODE)
+            + "，基金代码："
+            + fund_code
+            + "，"
+            + "，".join(
+                str(status) + "：" + str(count) + "条" for status, count in unknown_counts
+            )
         )
-        obj["purchase_status"] = -1
+    return codes[positions]
+
+
+def net_values_to_array(obj_list) -> np.ndarray:
+    """
+    批量格式化一个基金的净值原始字典 (按列一次性解析交易日、数值与状态)，转换为紧凑的结构化数组
+    :param obj_list: 净值原始字典列表 (字段均为字符串，交易日为 YYYYMMDD)
+    :return: NET_VALUE_DTYPE 结构化数组
+    """
+    obj_list = list(obj_list)
+    net_values = np.empty(len(obj_list), dtype=NET_VALUE_DTYPE)
+    if not obj_list:
+        return net_values
+    fund_code = obj_list[0]["fund_code"]
+    columns = {name: [obj[name] for obj in obj_list] for name in NET_VALUE_DTYPE.names}
+    net_values["trading_day"] = np.fromiter(
+        map(int, columns["trading_day"]), dtype="int32", count=len(obj_list)
+    )
+    net_values["unit_net_value"] = parse_numbers(columns["unit_net_value"])
+    net_values["cumulative_net_value"] = parse_numbers(columns["cumulative_net_value"])
+    net_values["daily_growth_rate"] = parse_growth_rates(columns["daily_growth_rate"])
+    net_values["purchase_status"] = map_status(
+        columns["purchase_status"], PURCHASE_STATUS_LOOKUP, fund_code, "申购状态"
+    )
+    net_values["redeem_status"] = map_status(
+        columns["redeem_status"], REDEEM_STATUS_LOOKUP, fund_code, "赎回状态"
+    )
+    return net_values
 
-    redeem_dict = {
-        "开放赎回": 0,
-        "封闭期": 1,
-        "暂停赎回": 2,
-        "场内卖出": 3,
-    }
-    if obj["redeem_status"] in redeem_dict:
-        obj["redeem_status"] = redeem_dict.get(obj["redeem_status"])
-    else:
-        logger.warning("redeem_status is not in redeem_list: " + obj["redeem_status"])
-        obj["redeem_status"] = -1
 
-    net_value = NetValue(**obj)
-    return net_value
+def net_values_to_frame(fund_code: str, net_values: np.ndarray) -> pd.DataFrame:
+    """
+    将结构化数组转换为净值数据表 (各列保持紧凑类型)
+    :param fund_code: 基金代码
+    :param net_values: NET_VALUE_DTYPE 结构化数组
+    :return: 净值数据
+    """
+    df = pd.DataFrame(
+        {name: net_values[name] for name in NET_VALUE_DTYPE.names},
+        columns=list(NET_VALUE_DTYPE.names),
+    )
+    df.insert(0, "fund_code", fund_code)
+    return df
 
 
-def net_value_to_dict(net_value: NetValue):
-    return net_value.__dict__
+def frame_to_net_values(df: pd.DataFrame) -> np.ndarray:
+    """
+    将净值数据表转换为结构化数组 (net_values_to_frame 的逆操作)
+    :param df: 净值数据 (交易日为 YYYYMMDD 字符串或整数)
+    :return: NET_VALUE_DTYPE 结构化数组
+    """
+    net_values = np.empty(len(df), dtype=NET_VALUE_DTYPE)
+    for name in NET_VALUE_DTYPE.names:
+        column = df[name]
+        if name == "trading_day":
+            column = column.astype("int64")
+        net_values[name] = pd.to_numeric(column, errors="coerce").to_numpy()
+    return net_values
+
+
+def net_values_to_rows(fund_code: str, net_values: np.ndarray) -> list:
+    """
+    将结构化数组转换为数据库写入用的字典列表 (只在写入 MYSQL 时使用)
+    :param fund_code: 基金代码
+    :param net_values: NET_VALUE_DTYPE 结构化数组
+    :return: 净值字典列表 (交易日为 YYYYMMDD 字符串，NaN 转换为 None)
+    """
+    rows = []
+    for trading_day, unit, cumulative, rate, purchase, redeem in net_values.tolist():
+        rows.append(
+            {
+                "fund_code": fund_code,
+                "trading_day": str(trading_day),
+                "unit_net_value": None if unit != unit else unit,
+                "cumulative_net_value": None
+                if cumulative != cumulative
+                else cumulative,
+                "daily_growth_rate": None if rate != rate else rate,
+                "purchase_status": purchase,
+                "redeem_status": redeem,
+            }
+        )
+    return rows
+
+
+def parse_trading_days(values) -> np.ndarray:
+    """
+    批量解析 YYYYMMDD 格式的交易日 (字符串或整数)
+    :param values: 交易日序列
+    :return: datetime64[D] 数组
+    """
+    day_int = np.asarray(values).astype("int64")
+    months = (day_int // 10000 - 1970) * 12 + day_int // 100 % 100 - 1
+    return months.astype("datetime64[M]").astype("datetime64[D]") + (
+        day_int % 100 - 1
+    ).astype("timedelta64[D]")
 
 
 def get_calc_year_cols_sequence(cols: list):
@@ -67,6 +224,9 @@ def get_calc_year_cols_sequence(cols: list):
         "annual_volatility",
         "sharpe",
         "maximum_drawdown",
+        "maximum_drawdown_peak_day",
+        "maximum_drawdown_trough_day",
+        "maximum_drawdown_recovery_day",
     ]
     year_cols = sorted(list(set(cols) - set(total_cols)))
     return total_cols + year_cols
@@ -0,0 +1,245 @@
+from typing import List, Optional, Tuple
+import os
+import sqlite3
+import time
+
+import settings
+
+
+class JobLedger(object):
+    """
+    爬取任务台账 (SQLite)：记录每次运行及每个基金的状态、已到达的交易日、尝试次数与错误信息，
+    运行中断后下次启动只需继续未完成或失败的基金
+    (只在主进程中使用，不跨线程、进程共享连接)
+    """
+
+    # 基金任务状态
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    # 运行状态 (运行中沿用 RUNNING，结束为 DONE)
+    ABANDONED = "abandoned"
+
+    def __init__(self, path: str = None):
+        """
+        :param path: 台账文件地址
+        """
+        self.path = path or settings.LEDGER_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_run (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    incremental INTEGER NOT NULL,
+                    store_type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_job (
+                    run_id INTEGER NOT NULL,
+                    fund_code TEXT NOT NULL,
+                    fund_name TEXT,
+                    status TEXT NOT NULL,
+                    last_trading_day TEXT,
+                    has_result INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, fund_code)
+                )
+                """
+            )
+
+    def start_run(self, fund_codes: List[Tuple[str, str]], incremental: bool) -> int:
+        """
+        开始新的运行，登记全部基金为待处理
+        :param fund_codes: [(基金代码, 基金名称)]
+        :param incremental: 是否增量模式
+        :return: 运行编号
+        """
+        now = time.time()
+        with self.conn:
+            # 未完成的旧运行不再继续
+            self.conn.execute(
+                "UPDATE crawl_run SET status = ?, finished_at = ? WHERE status = ?",
+                (self.ABANDONED, now, self.RUNNING),
+            )
+            # 只保留最近 settings.LEDGER_KEEP_RUNS 次运行的基金任务
+            self.conn.execute(
+                "DELETE FROM crawl_job WHERE run_id <= "
+                "(SELECT COALESCE(MAX(run_id), 0) FROM crawl_run) - ?",
+                (settings.LEDGER_KEEP_RUNS - 1,),
+            )
+            cursor = self.conn.execute(
+                "INSERT INTO crawl_run (incremental, store_type, status, started_at) "
+                "VALUES (?, ?, ?, ?)",
+                (int(incremental), settings.STORE_TYPE, self.RUNNING, now),
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO crawl_job "
+                "(run_id, fund_code, fund_name, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (run_id, fund_code, fund_name, self.PENDING, now)
+                    for fund_code, fund_name in fund_codes
+                ],
+            )
+        return run_id
+
+    def get_unfinished_run(self) -> Optional[dict]:
+        """
+        获取最近一次未完成的运行 (与当前存储类型一致)
+        :return: {run_id, incremental}，没有时返回 None
+        """
+        row = self.conn.execute(
+            "SELECT run_id, incremental FROM crawl_run "
+            "WHERE status = ? AND store_type = ? ORDER BY run_id DESC LIMIT 1",
+            (self.RUNNING, settings.STORE_TYPE),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"run_id": row[0], "incremental": bool(row[1])}
+
+    def get_jobs(self, run_id: int, statuses: tuple) -> List[Tuple[str, str]]:
+        """
+        获取指定状态的基金
+        :param run_id: 运行编号
+        :param statuses: 状态元组
+        :return: [(基金代码, 基金名称)]
+        """
+        return self.conn.execute(
+            "SELECT fund_code, fund_name FROM crawl_job WHERE run_id = ? AND status IN ("
+            + ",".join("?" * len(statuses))
+            + ") ORDER BY fund_code",
+            (run_id,) + tuple(statuses),
+        ).fetchall()
+
+    def get_written_fund_codes(self, run_id: int) -> List[str]:
+        """
+        获取已完成且写出了结果的基金代码
+        :param run_id: 运行编号
+        :return: 基金代码列表
+        """
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT fund_code FROM crawl_job WHERE run_id = ? AND status = ? "
+                "AND has_result = 1",
+                (run_id, self.DONE),
+            )
+        ]
+
+    def get_runnable_jobs(
+        self, run_id: int, max_attempts: int
+    ) -> List[Tuple[str, str]]:
+        """
+        获取需要 (重新) 处理的基金：待处理、中断时处理中、失败且尝试次数未达上限
+        :param run_id: 运行编号
+        :param max_attempts: 最大尝试次数
+        :return: [(基金代码, 基金名称)]
+        """
+        return self.conn.execute(
+            "SELECT fund_code, fund_name FROM crawl_job WHERE run_id = ? "
+            "AND (status IN (?, ?) OR (status = ? AND attempts < ?)) ORDER BY fund_code",
+            (run_id, self.PENDING, self.RUNNING, self.FAILED, max_attempts),
+        ).fetchall()
+
+    def mark_running(self, run_id: int, fund_codes: List[str]):
+        """
+        标记基金开始处理，尝试次数加一
+        :param run_id: 运行编号
+        :param fund_codes: 基金代码列表
+        :return:
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE crawl_job SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE run_id = ? AND fund_code = ?",
+                [(self.RUNNING, now, run_id, fund_code) for fund_code in fund_codes],
+            )
+
+    def mark_done(
+        self,
+        run_id: int,
+        fund_code: str,
+        last_trading_day: str = None,
+        has_result: bool = False,
+    ):
+        """
+        标记基金处理完成
+        :param run_id: 运行编号
+        :param fund_code: 基金代码
+        :param last_trading_day: 已存储的最新交易日
+        :param has_result: 是否写出了结果 (增量模式下没有新数据的基金没有结果)
+        :return:
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawl_job SET status = ?, last_trading_day = ?, has_result = ?, "
+                "error = NULL, updated_at = ? WHERE run_id = ? AND fund_code = ?",
+                (
+                    self.DONE,
+                    last_trading_day,
+                    int(has_result),
+                    time.time(),
+                    run_id,
+                    fund_code,
+                ),
+            )
+
+    def mark_failed(self, run_id: int, fund_code: str, error: str):
+        """
+        标记基金处理失败
+        :param run_id: 运行编号
+        :param fund_code: 基金代码
+        :param error: 错误信息
+        :return:
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawl_job SET status = ?, error = ?, updated_at = ? "
+                "WHERE run_id = ? AND fund_code = ?",
+                (self.FAILED, error, time.time(), run_id, fund_code),
+            )
+
+    def finish_run(self, run_id: int):
+        """
+        结束运行 (失败次数达到上限的基金保留失败状态，不再重试)
+        :param run_id: 运行编号
+        :return:
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawl_run SET status = ?, finished_at = ? WHERE run_id = ?",
+                (self.DONE, time.time(), run_id),
+            )
+
+    def count_jobs(self, run_id: int) -> dict:
+        """
+        统计各状态的基金数量
+        :param run_id: 运行编号
+        :return: {状态: 数量}
+        """
+        return dict(
+            self.conn.execute(
+                "SELECT status, COUNT(*) FROM crawl_job WHERE run_id = ? GROUP BY status",
+                (run_id,),
+            ).fetchall()
+        )
+
+    def close(self):
+        self.conn.close()
@@ -2,4 +2,18 @@ from loguru import logger
 from settings import LOG_CONFIG
 
 
-logger.add(**LOG_CONFIG)
+# 是否已添加日志文件输出
+_initialized = False
+
+
+def init_logger():
+    """
+    添加日志文件输出 (由程序入口调用，重复调用无效；进程池子进程沿用父进程的输出)
+    导入本模块时不打开日志文件，只使用日志的模块与离线命令不需要启动日志写入线程
+    :return:
+    """
+    global _initialized
+    if _initialized:
+        return
+    logger.add(**LOG_CONFIG)
+    _initialized = True
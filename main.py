@@ -1,5 +1,74 @@
-from service import CrawlService
+import argparse
+
+
+def main(argv: list = None):
+    """
+    命令行入口：各子命令在分支内导入所需模块，calc / export / serve 不加载浏览器与爬虫依赖
+    :param argv: 命令行参数，None 表示 sys.argv
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="爬取基金产品净值并计算指标")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("crawl", aliases=["run"], help="单机爬取并计算 (默认)")
+    calc_parser = subparsers.add_parser("calc", help="由已存储的净值数据重新计算指标")
+    calc_parser.add_argument("--funds", nargs="+", help="基金代码 (默认全部已存储的基金)")
+    export_parser = subparsers.add_parser("export", help="导出已存储的净值数据")
+    export_parser.add_argument(
+        "--output", required=True, help="导出地址 (CSV 为文件，PARQUET 为目录)"
+    )
+    export_parser.add_argument(
+        "--format", choices=["CSV", "PARQUET"], default="CSV", help="导出格式 (默认 CSV)"
+    )
+    export_parser.add_argument("--funds", nargs="+", help="基金代码 (默认全部已存储的基金)")
+    subparsers.add_parser("analytics", help="跨基金分析：相关系数、协方差矩阵与同类排名")
+    quality_parser = subparsers.add_parser("quality", help="数据质量检查：找出缺失的交易日并补爬")
+    quality_parser.add_argument(
+        "--no-backfill", action="store_true", help="只写出数据质量报告，不补爬"
+    )
+    serve_parser = subparsers.add_parser("serve", help="计算结果查询服务 (HTTP，返回 JSON)")
+    serve_parser.add_argument("--host", help="监听地址 (默认 settings.QUERY_HOST)")
+    serve_parser.add_argument("--port", type=int, help="监听端口 (默认 settings.QUERY_PORT)")
+    coordinator_parser = subparsers.add_parser("coordinator", help="分布式协调进程：登记任务、汇总结果")
+    coordinator_parser.add_argument(
+        "--workers", type=int, help="本机工作进程数量 (默认 settings.MAX_CONCURRENCY，0 表示只协调)"
+    )
+    worker_parser = subparsers.add_parser("worker", help="分布式工作进程：从任务队列租用基金并处理")
+    worker_parser.add_argument("--worker-id", help="工作进程编号 (默认 主机名-进程号-随机串)")
+    args = parser.parse_args(argv)
+
+    if args.command == "calc":
+        from offline import recalc
+
+        recalc(args.funds)
+    elif args.command == "export":
+        from offline import export_net_value
+
+        export_net_value(args.output, args.format, args.funds)
+    elif args.command == "analytics":
+        from analytics import run_analytics
+
+        run_analytics()
+    elif args.command == "quality":
+        from tradingcalendar import run_quality_check
+
+        run_quality_check(False if args.no_backfill else None)
+    elif args.command == "serve":
+        from query import serve
+
+        serve(args.host, args.port)
+    elif args.command == "coordinator":
+        from service import CrawlService
+
+        CrawlService.run_distributed(args.workers)
+    elif args.command == "worker":
+        from service import run_worker
+
+        run_worker(args.worker_id)
+    else:
+        from service import CrawlService
+
+        CrawlService.run()
 
 
 if __name__ == "__main__":
-    CrawlService.run()
+    main()
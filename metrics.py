@@ -0,0 +1,876 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import settings
+from format import get_calc_year_cols_sequence
+
+
+# 各时间段计算的指标列
+YEAR_DATA_COLS = [
+    "total_return",
+    "annual_return_ratio",
+    "annual_volatility",
+    "sharpe",
+    "maximum_drawdown",
+    "maximum_drawdown_peak_day",
+    "maximum_drawdown_trough_day",
+    "maximum_drawdown_recovery_day",
+]
+
+# 近期区间 (名称: 交易日数)
+TRAILING_PERIODS = {
+    "1m": 21,
+    "3m": 63,
+    "6m": 126,
+    "1y": 252,
+    "3y": 756,
+    "5y": 1260,
+}
+
+# 近期区间计算的指标列
+TRAILING_DATA_COLS = ["return", "annual_volatility", "sharpe"]
+
+# 近期区间结果列 (calc_rolling.csv)
+TRAILING_COLS = ["fund_code", "fund_name"] + [
+    period + "_" + col for period in TRAILING_PERIODS for col in TRAILING_DATA_COLS
+]
+
+# 滚动序列结果列
+ROLLING_SERIES_COLS = [
+    "fund_code",
+    "trading_day",
+    "return",
+    "annual_volatility",
+    "sharpe",
+]
+
+# 一年的交易日数
+TRADING_DAYS_PER_YEAR = 252
+
+# 一天的纳秒数
+NS_PER_DAY = 86400 * 10**9
+
+# 指标累积状态版本 (状态结构或口径变化时递增，旧状态失效后由完整历史重建)
+CALC_STATE_VERSION = 2
+
+# 由净值计算的日收益与日增长率相差超过该值时使用日增长率 (拆分、折算等累计净值不连续的交易日；
+# 净值与日增长率分别四舍五入到 4 位小数，正常交易日的差异远小于该值)
+ADJUSTED_RATE_TOLERANCE = 0.001
+
+
+def calc_adjusted_nav(
+    fund_idx: np.ndarray,
+    unit: np.ndarray,
+    cumulative: np.ndarray,
+    rate: np.ndarray,
+    adjusted: np.ndarray = None,
+) -> np.ndarray:
+    """
+    计算复权净值 (总收益指数)：每个基金第一天为累计净值，之后按日收益连乘
+    日收益为累计净值变化 / 前一日单位净值 (分红日累计净值包含分红，相当于分红再投资)，
+    与日增长率相差超过 ADJUSTED_RATE_TOLERANCE 时 (拆分、折算) 使用日增长率；
+    缺少单位净值时使用日增长率，都缺少时使用累计净值之比
+    :param fund_idx: 基金序号 (已按基金、交易日排序)
+    :param unit: 单位净值
+    :param cumulative: 累计净值
+    :param rate: 日增长率 (小数)
+    :param adjusted: 已计算的复权净值 (NaN 为待计算)，非空的值作为锚点，之后的交易日从锚点开始连乘
+    :return: 复权净值
+    """
+    n = len(cumulative)
+    growth = np.ones(n)
+    if n > 1:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = (cumulative[1:] - cumulative[:-1]) / unit[:-1]
+            use_rate = np.isfinite(rate[1:]) & ~(
+                np.abs(returns - rate[1:]) <= ADJUSTED_RATE_TOLERANCE
+            )
+            returns = np.where(use_rate, rate[1:], returns)
+            returns = np.where(
+                np.isfinite(returns), returns, cumulative[1:] / cumulative[:-1] - 1
+            )
+            growth[1:] = 1 + returns
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_growth = np.log(growth)
+    # 无法计算日收益的交易日 (净值缺失、异常) 视为净值不变
+    log_growth[~np.isfinite(log_growth)] = 0
+    starts = segment_starts(fund_idx)
+    log_growth[starts] = 0
+    log_sums = np.cumsum(log_growth)
+
+    is_anchor = np.zeros(n, dtype=bool)
+    is_anchor[starts] = True
+    anchor_nav = cumulative
+    if adjusted is not None:
+        is_known = np.isfinite(adjusted)
+        is_anchor |= is_known
+        anchor_nav = np.where(is_known, adjusted, cumulative)
+    # 每行向前最近的锚点
+    anchor = np.maximum.accumulate(np.where(is_anchor, np.arange(n), 0))
+    return anchor_nav[anchor] * np.exp(log_sums - log_sums[anchor])
+
+
+def add_adjusted_nav(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    为单个基金的净值数据补充复权净值 (已有复权净值的行不重新计算，只计算之后新增的交易日)
+    :param df: 净值数据 (NET_VALUE_COLS，可包含已计算的 adjusted_net_value 列)
+    :return: 按交易日升序、包含 adjusted_net_value 列的净值数据
+    """
+    df = df.sort_values("trading_day", kind="stable").reset_index(drop=True)
+    adjusted = None
+    if "adjusted_net_value" in df:
+        adjusted = df["adjusted_net_value"].to_numpy(dtype="float64")
+    df["adjusted_net_value"] = calc_adjusted_nav(
+        np.zeros(len(df), dtype=np.int64),
+        df["unit_net_value"].to_numpy(dtype="float64"),
+        df["cumulative_net_value"].to_numpy(dtype="float64"),
+        df["daily_growth_rate"].to_numpy(dtype="float64"),
+        adjusted,
+    )
+    return df
+
+
+def calc_period_return(first_nav, last_nav):
+    """
+    计算区间收益：复权净值为复合收益率 (期末 / 期初 - 1)，累计净值为净值差 (与历史结果口径一致)
+    :param first_nav: 期初净值
+    :param last_nav: 期末净值
+    :return: 区间收益
+    """
+    if settings.CALC_NAV_TYPE == "ADJUSTED":
+        return last_nav / first_nav - 1
+    return last_nav - first_nav
+
+
+def prepare_net_value(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    整理长表格式的净值数据：转换为 float64 / datetime64，按基金代码、交易日排序并去重，
+    按 settings.CALC_NAV_TYPE 取得计算使用的净值 (复权净值优先使用已计算的 adjusted_net_value 列)
+    :param df: 净值数据 (至少包含 fund_code, trading_day, cumulative_net_value；
+    复权净值还使用 unit_net_value, daily_growth_rate, adjusted_net_value，缺少时按累计净值之比连乘)
+    :return: 包含 fund_code, fund_idx (基金序号), trading_day, nav 四列的净值数据
+    """
+    trading_day = df["trading_day"]
+    if not pd.api.types.is_datetime64_any_dtype(trading_day):
+        trading_day = pd.to_datetime(trading_day.astype(str), format="%Y%m%d")
+    day = trading_day.to_numpy(dtype="datetime64[ns]")
+
+    def get_column(name: str) -> np.ndarray:
+        if name not in df:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[name], errors="coerce").astype("float64").to_numpy()
+
+    nav = get_column("cumulative_net_value")
+    is_adjusted = settings.CALC_NAV_TYPE == "ADJUSTED"
+    if is_adjusted:
+        unit = get_column("unit_net_value")
+        rate = get_column("daily_growth_rate")
+        adjusted = get_column("adjusted_net_value")
+    fund_idx, fund_codes = pd.factorize(df["fund_code"].astype(str), sort=True)
+
+    # 已按基金、交易日严格递增时跳过排序与去重
+    day_int = day.view("int64")
+    same_fund = fund_idx[1:] == fund_idx[:-1]
+    is_sorted = np.all(fund_idx[1:] >= fund_idx[:-1]) and np.all(
+        day_int[1:][same_fund] > day_int[:-1][same_fund]
+    )
+    keep = ~np.isnan(nav)
+    if not is_sorted:
+        order = np.lexsort((day_int, fund_idx))
+        fund_idx, day, day_int, nav, keep = (
+            fund_idx[order],
+            day[order],
+            day_int[order],
+            nav[order],
+            keep[order],
+        )
+        if is_adjusted:
+            unit, rate, adjusted = unit[order], rate[order], adjusted[order]
+        # 同一基金同一交易日保留最后一条
+        keep[:-1] &= (fund_idx[1:] != fund_idx[:-1]) | (day_int[1:] != day_int[:-1])
+    if not keep.all():
+        fund_idx, day, nav = fund_idx[keep], day[keep], nav[keep]
+        if is_adjusted:
+            unit, rate, adjusted = unit[keep], rate[keep], adjusted[keep]
+    if is_adjusted:
+        nav = calc_adjusted_nav(fund_idx, unit, nav, rate, adjusted)
+
+    return pd.DataFrame(
+        {
+            "fund_code": np.asarray(fund_codes, dtype=object)[fund_idx],
+            "fund_idx": fund_idx,
+            "trading_day": day,
+            "nav": nav,
+        }
+    )
+
+
+def segment_starts(*keys: np.ndarray) -> np.ndarray:
+    """
+    获取已排序数据中各分组的起始下标 (任一分组键变化即为新分组)
+    :param keys: 分组键数组
+    :return: 起始下标数组
+    """
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    changed = np.zeros(n, dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
+
+
+def calc_window_metrics(nav: np.ndarray, day: np.ndarray, starts: np.ndarray) -> dict:
+    """
+    计算各分组时间段内的指标 (与 CalcService.calc_data 的口径一致)
+    :param nav: 净值 (已按分组、交易日排序)
+    :param day: 交易日 (datetime64[ns])
+    :param starts: 各分组的起始下标
+    :return: {指标名: 每个分组的指标值数组}
+    """
+    n = len(nav)
+    ends = np.append(starts[1:], n) - 1
+    count = (ends - starts + 1).astype("float64")
+    first_nav = nav[starts]
+    last_nav = nav[ends]
+
+    # 总收益
+    total_return = calc_period_return(first_nav, last_nav)
+
+    # 年化收益率
+    days = (day[ends] - day[starts]).astype("int64") / NS_PER_DAY
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annual_return_ratio = np.where(
+            days > 0, (last_nav / first_nav) ** (365 / days) - 1, np.nan
+        )
+
+        # 日对数收益率 (每个分组第一天为 0)
+        log_returns = np.zeros(n)
+        log_returns[1:] = np.log(nav[1:] / nav[:-1])
+    log_returns[starts] = 0
+
+    # 年化波动率 (对数收益率的样本标准差 * sqrt(天数))
+    mean = np.add.reduceat(log_returns, starts) / count
+    centered = log_returns - np.repeat(mean, ends - starts + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = np.add.reduceat(centered * centered, starts) / (count - 1)
+    annual_volatility = np.sqrt(variance) * np.sqrt(count)
+
+    return finish_window_metrics(
+        total_return,
+        annual_return_ratio,
+        annual_volatility,
+        calc_drawdown(nav, day, starts),
+    )
+
+
+def finish_window_metrics(
+    total_return: np.ndarray,
+    annual_return_ratio: np.ndarray,
+    annual_volatility: np.ndarray,
+    drawdown: dict,
+) -> dict:
+    """
+    由各时间段的收益、波动与回撤计算夏普比率，并按结果口径保留四位小数
+    :param total_return: 总收益
+    :param annual_return_ratio: 年化收益率
+    :param annual_volatility: 年化波动率
+    :param drawdown: calc_drawdown 格式的最大回撤
+    :return: {指标名: 每个分组的指标值数组}
+    """
+    # 夏普比率 (与 Decimal 口径一致，使用保留四位小数后的收益率与波动率)
+    annual_return_ratio = np.round(annual_return_ratio, 4)
+    annual_volatility = np.round(annual_volatility, 4)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(
+            annual_volatility == 0,
+            0.0,
+            (annual_return_ratio - settings.RISK_FREE_RATE) / annual_volatility,
+        )
+
+    return {
+        "total_return": np.round(total_return, 4),
+        "annual_return_ratio": annual_return_ratio,
+        "annual_volatility": annual_volatility,
+        "sharpe": np.round(sharpe, 4),
+        "maximum_drawdown": np.round(drawdown["maximum_drawdown"], 4),
+        "maximum_drawdown_peak_day": drawdown["peak_day"],
+        "maximum_drawdown_trough_day": drawdown["trough_day"],
+        "maximum_drawdown_recovery_day": drawdown["recovery_day"],
+    }
+
+
+def format_days(day: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    将交易日格式化为 YYYYMMDD 字符串
+    :param day: 交易日 (datetime64[ns])
+    :param mask: 有效标记，无效位置为 None
+    :return: 字符串数组
+    """
+    result = np.full(len(day), None, dtype=object)
+    if mask.any():
+        result[mask] = pd.DatetimeIndex(day[mask]).strftime("%Y%m%d").to_numpy()
+    return result
+
+
+def calc_drawdown(nav: np.ndarray, day: np.ndarray, starts: np.ndarray) -> dict:
+    """
+    按运行峰值一次遍历计算各分组的最大回撤及其峰值日、谷底日、恢复日
+    :param nav: 净值 (已按分组、交易日排序)
+    :param day: 交易日 (datetime64[ns])
+    :param starts: 各分组的起始下标
+    :return: {maximum_drawdown, peak_nav, peak_day, trough_day, recovery_day: 每个分组的数组}
+    """
+    n = len(nav)
+    lengths = np.diff(np.append(starts, n))
+    segment_ids = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(n)
+
+    # 分组内的运行峰值及其出现位置
+    # (每个分组整体抬高一个大于净值极差的偏移量，使一次累积最大值在分组边界处自动重置)
+    offset = np.float64(nav.max() - nav.min() + 1)
+    shifted = nav + segment_ids * offset
+    is_peak = shifted >= np.maximum.accumulate(shifted)
+    running_peak_idx = np.maximum.accumulate(np.where(is_peak, index, 0))
+    running_peak = nav[running_peak_idx]
+    drawdowns = (running_peak - nav) / running_peak
+    maximum_drawdown = np.maximum.reduceat(drawdowns, starts)
+
+    # 谷底：分组内第一次达到最大回撤的位置；峰值：谷底前最后一次达到运行峰值的位置
+    is_trough = drawdowns == np.repeat(maximum_drawdown, lengths)
+    trough_idx = np.minimum.reduceat(np.where(is_trough, index, n), starts)
+    peak_idx = running_peak_idx[trough_idx]
+
+    # 恢复：谷底后第一次回到峰值的位置
+    is_recovered = (index > np.repeat(trough_idx, lengths)) & (
+        nav >= np.repeat(nav[peak_idx], lengths)
+    )
+    recovery_idx = np.minimum.reduceat(np.where(is_recovered, index, n), starts)
+
+    has_drawdown = maximum_drawdown > 0
+    has_recovery = has_drawdown & (recovery_idx < n)
+    return {
+        "maximum_drawdown": maximum_drawdown,
+        "peak_nav": np.where(has_drawdown, nav[peak_idx], np.nan),
+        "peak_day": format_days(day[peak_idx], has_drawdown),
+        "trough_day": format_days(day[trough_idx], has_drawdown),
+        "recovery_day": format_days(day[np.minimum(recovery_idx, n - 1)], has_recovery),
+    }
+
+
+def update_drawdown_state(state: Optional[dict], day: list, nav: list) -> dict:
+    """
+    用新增净值增量更新最大回撤状态，只遍历新增数据
+    :param state: 已存储的回撤状态，None 表示从头开始
+    :param day: 新增交易日 (YYYYMMDD，升序)
+    :param nav: 新增净值
+    :return: 更新后的回撤状态
+        peak / peak_day: 当前运行峰值及其日期
+        maximum_drawdown: 最大回撤
+        mdd_peak / mdd_peak_day / mdd_trough_day / mdd_recovery_day: 最大回撤区间
+    """
+    if state is None:
+        state = {
+            "peak": None,
+            "peak_day": None,
+            "maximum_drawdown": 0.0,
+            "mdd_peak": None,
+            "mdd_peak_day": None,
+            "mdd_trough_day": None,
+            "mdd_recovery_day": None,
+        }
+    else:
+        state = dict(state)
+    for trading_day, value in zip(day, nav):
+        value = float(value)
+        if state["peak"] is None or value >= state["peak"]:
+            state["peak"] = value
+            state["peak_day"] = trading_day
+            # 回到最大回撤区间的峰值即视为恢复
+            if (
+                state["mdd_peak"] is not None
+                and state["mdd_recovery_day"] is None
+                and value >= state["mdd_peak"]
+            ):
+                state["mdd_recovery_day"] = trading_day
+            continue
+        drawdown = (state["peak"] - value) / state["peak"]
+        if drawdown > state["maximum_drawdown"]:
+            state["maximum_drawdown"] = drawdown
+            state["mdd_peak"] = state["peak"]
+            state["mdd_peak_day"] = state["peak_day"]
+            state["mdd_trough_day"] = trading_day
+            state["mdd_recovery_day"] = None
+    return state
+
+
+def calc_batch(
+    df: pd.DataFrame, fund_names: dict = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    批量计算所有基金的总指标、年指标与月收益
+    :param df: 长表格式的净值数据 (fund_code, trading_day, cumulative_net_value)
+    :param fund_names: {基金代码: 基金名称}
+    :return: (年计算结果, 月计算结果)，格式与 CalcService.calc 一致
+    """
+    fund_names = fund_names or {}
+    df = prepare_net_value(df)
+    if df.empty:
+        return (
+            pd.DataFrame(columns=get_calc_year_cols_sequence([])),
+            pd.DataFrame(columns=["fund_code", "fund_name", "year", "month", "return"]),
+        )
+    fund_code = df["fund_code"].to_numpy()
+    fund_idx = df["fund_idx"].to_numpy()
+    day = df["trading_day"].to_numpy()
+    nav = df["nav"].to_numpy()
+    year = day.astype("datetime64[Y]").astype("int64") + 1970
+    month = day.astype("datetime64[M]").astype("int64") % 12 + 1
+
+    # 全部时间段指标
+    fund_starts = segment_starts(fund_idx)
+    total_df = pd.DataFrame(calc_window_metrics(nav, day, fund_starts))
+    total_df.insert(0, "fund_code", fund_code[fund_starts])
+
+    # 年指标
+    year_starts = segment_starts(fund_idx, year)
+    per_year_df = pd.DataFrame(calc_window_metrics(nav, day, year_starts))
+    per_year_df["fund_code"] = fund_code[year_starts]
+    per_year_df["year"] = year[year_starts]
+
+    # 月收益
+    month_starts = segment_starts(fund_idx, year, month)
+    month_ends = np.append(month_starts[1:], len(nav)) - 1
+    month_df = pd.DataFrame(
+        {
+            "fund_code": fund_code[month_starts],
+            "year": year[month_starts],
+            "month": month[month_starts],
+            "return": np.round(
+                calc_period_return(nav[month_starts], nav[month_ends]), 4
+            ),
+        }
+    )
+
+    return build_result_frames(total_df, per_year_df, month_df, fund_names)
+
+
+def build_result_frames(
+    total_df: pd.DataFrame,
+    per_year_df: pd.DataFrame,
+    month_df: pd.DataFrame,
+    fund_names: dict,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    组装年、月计算结果：年指标展开为 {year}_{col} 列并与总指标合并，补充基金名称
+    :param total_df: 每个基金一行的总指标 (fund_code + YEAR_DATA_COLS)
+    :param per_year_df: 每个基金每年一行的年指标 (fund_code, year + YEAR_DATA_COLS)
+    :param month_df: 月收益 (fund_code, year, month, return)
+    :param fund_names: {基金代码: 基金名称}
+    :return: (年计算结果, 月计算结果)
+    """
+    wide_df = per_year_df.pivot(
+        index="fund_code", columns="year", values=YEAR_DATA_COLS
+    )
+    wide_df.columns = [str(y) + "_" + col for col, y in wide_df.columns]
+    # 指标与日期混合透视后为 object 类型，恢复数值列的 float64 类型
+    wide_df = wide_df.infer_objects()
+
+    year_df = total_df.join(wide_df, on="fund_code")
+    year_df.insert(1, "fund_name", year_df["fund_code"].map(fund_names))
+    year_df = year_df.reindex(
+        columns=get_calc_year_cols_sequence(list(year_df.columns))
+    )
+    month_df.insert(1, "fund_name", month_df["fund_code"].map(fund_names))
+    return year_df, month_df
+
+
+def calc_window_sums(nav: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    计算日对数收益率及其累计和、累计平方和 (用于 O(n) 求任意窗口的收益与波动)
+    :param nav: 净值 (已按基金、交易日排序)
+    :param starts: 各基金的起始下标
+    :return: (每行在所属基金内的序号, 累计和, 累计平方和)，累计数组首位补 0
+    """
+    n = len(nav)
+    lengths = np.diff(np.append(starts, n))
+    position = np.arange(n) - np.repeat(starts, lengths)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns = np.zeros(n)
+        log_returns[1:] = np.log(nav[1:] / nav[:-1])
+    log_returns[starts] = 0
+    sums = np.concatenate(([0.0], np.cumsum(log_returns)))
+    squares = np.concatenate(([0.0], np.cumsum(log_returns * log_returns)))
+    return position, sums, squares
+
+
+def calc_window_stats(
+    nav: np.ndarray,
+    end: np.ndarray,
+    window: int,
+    sums: np.ndarray,
+    squares: np.ndarray,
+) -> dict:
+    """
+    计算以 end 为结束位置、包含 window 个日收益的窗口指标
+    (窗口收益与 calc_year.csv 的 total_return 口径一致，见 calc_period_return)
+    :param nav: 净值 (已按基金、交易日排序)
+    :param end: 窗口结束行下标数组
+    :param window: 窗口内日收益个数
+    :param sums: 日对数收益累计和 (首位补 0)
+    :param squares: 日对数收益累计平方和 (首位补 0)
+    :return: {return, annual_volatility, sharpe: 数组}
+    """
+    log_sum = sums[end + 1] - sums[end + 1 - window]
+    square_sum = squares[end + 1] - squares[end + 1 - window]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (square_sum - log_sum * log_sum / window) / (window - 1)
+        annual_volatility = np.sqrt(np.maximum(variance, 0)) * np.sqrt(
+            TRADING_DAYS_PER_YEAR
+        )
+        annual_return = np.exp(log_sum * TRADING_DAYS_PER_YEAR / window) - 1
+        sharpe = np.where(
+            annual_volatility == 0,
+            0.0,
+            (annual_return - settings.RISK_FREE_RATE) / annual_volatility,
+        )
+    return {
+        "return": np.round(calc_period_return(nav[end - window], nav[end]), 4),
+        "annual_volatility": np.round(annual_volatility, 4),
+        "sharpe": np.round(sharpe, 4),
+    }
+
+
+def calc_trailing(df: pd.DataFrame, fund_names: dict = None) -> pd.DataFrame:
+    """
+    批量计算所有基金截至最新交易日的近期区间 (1m/3m/6m/1y/3y/5y) 收益、年化波动率与夏普比率
+    (历史不足一个区间的基金该区间为空)
+    :param df: 长表格式的净值数据 (fund_code, trading_day, cumulative_net_value)
+    :param fund_names: {基金代码: 基金名称}
+    :return: 每个基金一行的近期区间指标
+    """
+    fund_names = fund_names or {}
+    df = prepare_net_value(df)
+    if df.empty:
+        return pd.DataFrame(columns=TRAILING_COLS)
+    fund_code = df["fund_code"].to_numpy()
+    nav = df["nav"].to_numpy()
+    starts = segment_starts(df["fund_idx"].to_numpy())
+    ends = np.append(starts[1:], len(nav)) - 1
+    position, sums, squares = calc_window_sums(nav, starts)
+
+    trailing_df = pd.DataFrame(
+        {"fund_code": fund_code[starts], "fund_name": None}, columns=TRAILING_COLS
+    )
+    trailing_df["fund_name"] = trailing_df["fund_code"].map(fund_names)
+    for period, window in TRAILING_PERIODS.items():
+        is_valid = position[ends] >= window
+        stats = calc_window_stats(nav, ends[is_valid], window, sums, squares)
+        for col in TRAILING_DATA_COLS:
+            values = np.full(len(ends), np.nan)
+            values[is_valid] = stats[col]
+            trailing_df[period + "_" + col] = values
+    return trailing_df
+
+
+def calc_rolling_series(
+    df: pd.DataFrame, window: int = TRADING_DAYS_PER_YEAR
+) -> pd.DataFrame:
+    """
+    批量计算所有基金每个交易日的滚动窗口收益、年化波动率与夏普比率
+    :param df: 长表格式的净值数据 (fund_code, trading_day, cumulative_net_value)
+    :param window: 窗口内日收益个数 (默认 252 个交易日)
+    :return: 长表格式的滚动指标 (历史不足一个窗口的交易日不输出)
+    """
+    df = prepare_net_value(df)
+    if df.empty:
+        return pd.DataFrame(columns=ROLLING_SERIES_COLS)
+    nav = df["nav"].to_numpy()
+    starts = segment_starts(df["fund_idx"].to_numpy())
+    position, sums, squares = calc_window_sums(nav, starts)
+
+    end = np.flatnonzero(position >= window)
+    stats = calc_window_stats(nav, end, window, sums, squares)
+    rolling_df = pd.DataFrame(
+        {
+            "fund_code": df["fund_code"].to_numpy()[end],
+            "trading_day": pd.DatetimeIndex(df["trading_day"].to_numpy()[end])
+            .strftime("%Y%m%d")
+            .to_numpy(),
+        }
+    )
+    for col in TRAILING_DATA_COLS:
+        rolling_df[col] = stats[col]
+    return rolling_df
+
+
+def calc_window_state(nav: np.ndarray, day: np.ndarray, starts: np.ndarray) -> list:
+    """
+    计算各分组时间段的累积状态 (首末净值、日对数收益累计和与平方和、运行峰值与最大回撤)，
+    之后追加的净值可由 update_window_state 在此基础上增量更新
+    :param nav: 净值 (已按分组、交易日排序)
+    :param day: 交易日 (datetime64[ns])
+    :param starts: 各分组的起始下标
+    :return: 每个分组的累积状态列表
+    """
+    n = len(nav)
+    ends = np.append(starts[1:], n) - 1
+    lengths = ends - starts + 1
+    index = np.arange(n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns = np.zeros(n)
+        log_returns[1:] = np.log(nav[1:] / nav[:-1])
+    log_returns[starts] = 0
+    log_sum = np.add.reduceat(log_returns, starts)
+    log_square_sum = np.add.reduceat(log_returns * log_returns, starts)
+
+    # 当前运行峰值：分组内最大净值最后一次出现的位置
+    peak = np.maximum.reduceat(nav, starts)
+    peak_idx = np.maximum.reduceat(
+        np.where(nav == np.repeat(peak, lengths), index, -1), starts
+    )
+    drawdown = calc_drawdown(nav, day, starts)
+    all_days = np.ones(len(starts), dtype=bool)
+    first_day = format_days(day[starts], all_days)
+    last_day = format_days(day[ends], all_days)
+    peak_day = format_days(day[peak_idx], all_days)
+
+    window_states = []
+    for i in range(len(starts)):
+        has_drawdown = drawdown["peak_day"][i] is not None
+        window_states.append(
+            {
+                "first_day": first_day[i],
+                "first_nav": float(nav[starts[i]]),
+                "last_day": last_day[i],
+                "last_nav": float(nav[ends[i]]),
+                "count": int(lengths[i]),
+                "log_sum": float(log_sum[i]),
+                "log_square_sum": float(log_square_sum[i]),
+                "drawdown": {
+                    "peak": float(peak[i]),
+                    "peak_day": peak_day[i],
+                    "maximum_drawdown": float(drawdown["maximum_drawdown"][i]),
+                    "mdd_peak": float(drawdown["peak_nav"][i])
+                    if has_drawdown
+                    else None,
+                    "mdd_peak_day": drawdown["peak_day"][i],
+                    "mdd_trough_day": drawdown["trough_day"][i],
+                    "mdd_recovery_day": drawdown["recovery_day"][i],
+                },
+            }
+        )
+    return window_states
+
+
+def update_window_state(state: Optional[dict], day: list, nav: np.ndarray) -> dict:
+    """
+    用新增净值增量更新时间段的累积状态，只遍历新增数据
+    :param state: 已有的累积状态，None 表示新的时间段
+    :param day: 新增交易日 (YYYYMMDD，升序，均晚于已有状态的最后交易日)
+    :param nav: 新增净值
+    :return: 更新后的累积状态
+    """
+    if state is None:
+        state = {
+            "first_day": day[0],
+            "first_nav": float(nav[0]),
+            "last_day": None,
+            "last_nav": float(nav[0]),
+            "count": 0,
+            "log_sum": 0.0,
+            "log_square_sum": 0.0,
+            "drawdown": None,
+        }
+    else:
+        state = dict(state)
+    # 时间段第一天的日收益为 0 (与 calc_window_metrics 口径一致)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns = np.log(nav / np.append(state["last_nav"], nav[:-1]))
+    state["last_day"] = day[-1]
+    state["last_nav"] = float(nav[-1])
+    state["count"] += len(nav)
+    state["log_sum"] += float(log_returns.sum())
+    state["log_square_sum"] += float((log_returns * log_returns).sum())
+    state["drawdown"] = update_drawdown_state(state["drawdown"], day, nav.tolist())
+    return state
+
+
+def calc_state_metrics(window_states: list) -> dict:
+    """
+    由累积状态计算各时间段的指标 (与 calc_window_metrics 的口径一致)
+    :param window_states: 累积状态列表
+    :return: {指标名: 每个时间段的指标值数组}
+    """
+    first_nav = np.array([state["first_nav"] for state in window_states])
+    last_nav = np.array([state["last_nav"] for state in window_states])
+    count = np.array([state["count"] for state in window_states], dtype="float64")
+    log_sum = np.array([state["log_sum"] for state in window_states])
+    log_square_sum = np.array([state["log_square_sum"] for state in window_states])
+    days = (
+        pd.to_datetime([state["last_day"] for state in window_states], format="%Y%m%d")
+        - pd.to_datetime(
+            [state["first_day"] for state in window_states], format="%Y%m%d"
+        )
+    ).days.to_numpy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annual_return_ratio = np.where(
+            days > 0, (last_nav / first_nav) ** (365 / days) - 1, np.nan
+        )
+        variance = (log_square_sum - log_sum * log_sum / count) / (count - 1)
+    annual_volatility = np.sqrt(np.maximum(variance, 0)) * np.sqrt(count)
+
+    drawdowns = [state["drawdown"] for state in window_states]
+    return finish_window_metrics(
+        calc_period_return(first_nav, last_nav),
+        annual_return_ratio,
+        annual_volatility,
+        {
+            "maximum_drawdown": np.array(
+                [drawdown["maximum_drawdown"] for drawdown in drawdowns]
+            ),
+            "peak_day": np.array(
+                [drawdown["mdd_peak_day"] for drawdown in drawdowns], dtype=object
+            ),
+            "trough_day": np.array(
+                [drawdown["mdd_trough_day"] for drawdown in drawdowns], dtype=object
+            ),
+            "recovery_day": np.array(
+                [drawdown["mdd_recovery_day"] for drawdown in drawdowns], dtype=object
+            ),
+        },
+    )
+
+
+def build_calc_state(df: pd.DataFrame) -> dict:
+    """
+    由完整净值数据批量建立每个基金的指标累积状态 (全部时间段、各年、各月)
+    :param df: 长表格式的净值数据 (fund_code, trading_day, cumulative_net_value)
+    :return: {基金代码: 累积状态}
+        version: 状态版本; nav_type: 计算使用的净值; last_trading_day: 已累积的最新交易日;
+        total / years: 全部时间段、各年的 calc_window_state 状态;
+        months: {YYYYMM: [月初净值, 月末净值]}
+    """
+    df = prepare_net_value(df)
+    if df.empty:
+        return {}
+    fund_code = df["fund_code"].to_numpy()
+    fund_idx = df["fund_idx"].to_numpy()
+    day = df["trading_day"].to_numpy()
+    nav = df["nav"].to_numpy()
+    year = day.astype("datetime64[Y]").astype("int64") + 1970
+    month = day.astype("datetime64[M]").astype("int64") % 12 + 1
+
+    states = {}
+    fund_starts = segment_starts(fund_idx)
+    for start, window_state in zip(
+        fund_starts, calc_window_state(nav, day, fund_starts)
+    ):
+        states[fund_code[start]] = {
+            "version": CALC_STATE_VERSION,
+            "nav_type": settings.CALC_NAV_TYPE,
+            "last_trading_day": window_state["last_day"],
+            "total": window_state,
+            "years": {},
+            "months": {},
+        }
+    year_starts = segment_starts(fund_idx, year)
+    for start, window_state in zip(
+        year_starts, calc_window_state(nav, day, year_starts)
+    ):
+        states[fund_code[start]]["years"][str(year[start])] = window_state
+    month_starts = segment_starts(fund_idx, year, month)
+    month_ends = np.append(month_starts[1:], len(nav)) - 1
+    for start, end in zip(month_starts, month_ends):
+        states[fund_code[start]]["months"]["%04d%02d" % (year[start], month[start])] = [
+            float(nav[start]),
+            float(nav[end]),
+        ]
+    return states
+
+
+def update_calc_state(state: dict, df: pd.DataFrame) -> dict:
+    """
+    用单个基金的新增净值增量更新累积状态 (只处理晚于 last_trading_day 的交易日)
+    :param state: build_calc_state 建立的累积状态
+    :param df: 新增净值数据 (fund_code, trading_day, cumulative_net_value；
+    使用复权净值时需包含由已存储历史接续计算的 adjusted_net_value)
+    :return: 更新后的累积状态
+    """
+    df = prepare_net_value(df)
+    trading_day = pd.DatetimeIndex(df["trading_day"]).strftime("%Y%m%d").to_numpy()
+    is_new = trading_day > state["last_trading_day"]
+    if not is_new.any():
+        return state
+    day = df["trading_day"].to_numpy()[is_new]
+    trading_day = trading_day[is_new].tolist()
+    nav = df["nav"].to_numpy()[is_new]
+    year = day.astype("datetime64[Y]").astype("int64") + 1970
+    month = day.astype("datetime64[M]").astype("int64") % 12 + 1
+
+    state = dict(state, years=dict(state["years"]), months=dict(state["months"]))
+    state["total"] = update_window_state(state["total"], trading_day, nav)
+    year_starts = segment_starts(year)
+    year_ends = np.append(year_starts[1:], len(nav))
+    for start, end in zip(year_starts, year_ends):
+        key = str(year[start])
+        state["years"][key] = update_window_state(
+            state["years"].get(key), trading_day[start:end], nav[start:end]
+        )
+    month_starts = segment_starts(year, month)
+    month_ends = np.append(month_starts[1:], len(nav)) - 1
+    for start, end in zip(month_starts, month_ends):
+        key = "%04d%02d" % (year[start], month[start])
+        first_nav = state["months"].get(key, [float(nav[start])])[0]
+        state["months"][key] = [first_nav, float(nav[end])]
+    state["last_trading_day"] = trading_day[-1]
+    return state
+
+
+def calc_state_results(
+    states: dict, fund_names: dict = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    由累积状态计算年、月结果 (只与时间段数量有关，与净值行数无关)
+    :param states: {基金代码: 累积状态}
+    :param fund_names: {基金代码: 基金名称}
+    :return: (年计算结果, 月计算结果)，格式与 calc_batch 一致
+    """
+    fund_codes = sorted(states)
+    total_df = pd.DataFrame(
+        calc_state_metrics([states[fund_code]["total"] for fund_code in fund_codes])
+    )
+    total_df.insert(0, "fund_code", fund_codes)
+
+    year_keys = [
+        (fund_code, year)
+        for fund_code in fund_codes
+        for year in sorted(states[fund_code]["years"])
+    ]
+    per_year_df = pd.DataFrame(
+        calc_state_metrics(
+            [states[fund_code]["years"][year] for fund_code, year in year_keys]
+        )
+    )
+    per_year_df["fund_code"] = [fund_code for fund_code, _ in year_keys]
+    per_year_df["year"] = np.array([int(year) for _, year in year_keys])
+
+    month_rows = [
+        (
+            fund_code,
+            int(key[:4]),
+            int(key[4:]),
+            calc_period_return(first_nav, last_nav),
+        )
+        for fund_code in fund_codes
+        for key, (first_nav, last_nav) in sorted(states[fund_code]["months"].items())
+    ]
+    month_df = pd.DataFrame(
+        month_rows, columns=["fund_code", "year", "month", "return"]
+    )
+    month_df["return"] = np.round(month_df["return"].to_numpy(dtype="float64"), 4)
+    return build_result_frames(total_df, per_year_df, month_df, fund_names or {})
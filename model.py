@@ -2,11 +2,17 @@ from sqlalchemy import (
     Column,
     DECIMAL,
     DateTime,
+    Index,
     Integer,
+    func,
+    inspect,
     text,
     create_engine,
 )
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.dialects.mysql import VARCHAR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -14,9 +20,15 @@ import logging
 
 Base = declarative_base()
 
+# 净值表 (fund_code, trading_day) 唯一索引名
+UNIQUE_INDEX_NAME = "uk_fund_code_trading_day"
+
 
 class NetValue(Base):
     __tablename__ = "net_value"
+    __table_args__ = (
+        Index(UNIQUE_INDEX_NAME, "fund_code", "trading_day", unique=True),
+    )
     id = Column(Integer, primary_key=True, comment="自增主键")
     trading_day = Column(VARCHAR(9), nullable=False, comment="交易日")
     fund_code = Column(VARCHAR(50), nullable=False, comment="基金代码")
@@ -35,18 +47,76 @@ class NetValue(Base):
     )
 
 
+# 冲突时更新的净值列
+UPSERT_UPDATE_COLS = [
+    "unit_net_value",
+    "cumulative_net_value",
+    "daily_growth_rate",
+    "purchase_status",
+    "redeem_status",
+]
+
+
+@compiles(CreateColumn, "sqlite")
+def compile_sqlite_column(element, compiler, **kw):
+    """
+    SQLite (本地替身数据库) 不支持 ON UPDATE 子句，建表时去掉
+    """
+    return compiler.visit_create_column(element, **kw).replace(
+        " ON UPDATE CURRENT_TIMESTAMP", ""
+    )
+
+
 class Database:
     def __init__(self, db_uri):
         self.db_uri = db_uri
         self.engine = None
         self.Session = None
 
-    def connect(self):
-        self.engine = create_engine(self.db_uri)
+    def connect(self, pool_size=5, pool_recycle=3600):
+        """
+        创建数据库引擎 (每个进程创建一次，进程内复用连接池)
+        :param pool_size: 连接池大小
+        :param pool_recycle: 连接回收时间 (秒)
+        :return:
+        """
+        self.engine = create_engine(
+            self.db_uri,
+            pool_size=pool_size,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=True,
+        )
         self.Session = sessionmaker(bind=self.engine)
 
     def create_tables(self):
         Base.metadata.create_all(self.engine)
+        self.migrate_unique_index()
+
+    def migrate_unique_index(self):
+        """
+        create_all 不会给已存在的旧表补充索引：缺少 (fund_code, trading_day) 唯一索引时，
+        先删除重复行 (保留 id 最大即最后写入的一行)，再创建唯一索引
+        :return:
+        """
+        for index in inspect(self.engine).get_indexes(NetValue.__tablename__):
+            if index["name"] == UNIQUE_INDEX_NAME or (
+                index["unique"]
+                and index["column_names"] == ["fund_code", "trading_day"]
+            ):
+                return
+        with self.engine.begin() as connection:
+            # MYSQL 不允许在子查询中直接读取正在删除的表，外面再包一层派生表
+            result = connection.execute(
+                text(
+                    "DELETE FROM net_value WHERE id NOT IN ("
+                    "SELECT id FROM (SELECT MAX(id) AS id FROM net_value "
+                    "GROUP BY fund_code, trading_day) AS latest)"
+                )
+            )
+            logging.warning("净值表缺少唯一索引，已删除重复行：" + str(result.rowcount) + "行")
+            for index in NetValue.__table__.indexes:
+                if index.name == UNIQUE_INDEX_NAME:
+                    index.create(connection)
 
     def disconnect(self):
         if self.engine:
@@ -72,3 +142,43 @@ def transactional(func):
 def bulk_add(session, obj_list, bulk_size=1000):
     for i in range(0, len(obj_list), bulk_size):
         session.bulk_save_objects(obj_list[i : i + bulk_size])
+
+
+def upsert_statement(dialect_name: str):
+    """
+    构造净值表的批量 upsert 语句
+    (MYSQL: INSERT ... ON DUPLICATE KEY UPDATE；SQLite: INSERT ... ON CONFLICT DO UPDATE)
+    :param dialect_name: 数据库方言名称
+    :return: insert 语句
+    """
+    table = NetValue.__table__
+    if dialect_name == "mysql":
+        stmt = mysql.insert(table)
+        update_dict = {col: stmt.inserted[col] for col in UPSERT_UPDATE_COLS}
+        update_dict["update_at"] = func.current_timestamp()
+        return stmt.on_duplicate_key_update(update_dict)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(table)
+        update_dict = {col: stmt.excluded[col] for col in UPSERT_UPDATE_COLS}
+        update_dict["update_at"] = func.current_timestamp()
+        return stmt.on_conflict_do_update(
+            index_elements=["fund_code", "trading_day"], set_=update_dict
+        )
+    else:
+        raise Exception("不支持的数据库类型：" + dialect_name)
+
+
+def bulk_upsert(engine, row_list: list, batch_size=1000):
+    """
+    批量写入净值数据，(fund_code, trading_day) 已存在时更新，重复执行结果不变
+    :param engine: 数据库引擎
+    :param row_list: 净值字典列表
+    :param batch_size: 每批 executemany 的行数 (每批一个事务)
+    :return:
+    """
+    if not row_list:
+        return
+    stmt = upsert_statement(engine.dialect.name)
+    for i in range(0, len(row_list), batch_size):
+        with engine.begin() as connection:
+            connection.execute(stmt, row_list[i : i + batch_size])
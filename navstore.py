@@ -0,0 +1,494 @@
+from typing import Optional
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import settings
+from format import NET_VALUE_DTYPE, net_values_to_frame
+from metrics import calc_adjusted_nav
+
+
+# 复权净值记录 (与净值记录位置一一对应，存放在单独的数据文件中)
+ADJUSTED_DTYPE = np.dtype("f8")
+
+# 索引记录：基金代码、记录偏移、记录数量、预留容量 (均以记录为单位)
+INDEX_DTYPE = np.dtype(
+    [
+        ("fund_code", "U16"),
+        ("offset", "i8"),
+        ("length", "i8"),
+        ("capacity", "i8"),
+    ]
+)
+
+
+class NavStore(object):
+    """
+    内存映射净值存储：每个基金的净值记录 (NET_VALUE_DTYPE 定长记录，按交易日排序) 连续存放在数据文件中，
+    并预留容量；索引为只追加的 (基金代码, 偏移, 数量, 容量) 记录日志，同一基金以最后一条为准
+    追加新交易日时写入预留容量，容量不足或需要插入旧交易日时把该基金整体写到文件末尾，已有数据不改写；
+    先写数据再追加索引记录，读取方只看到已完整写入的数据。读取时直接切片内存映射，不复制数据，
+    多个进程共享操作系统页缓存 (只能有一个写入进程)
+    每条记录的复权净值存放在位置对应的复权净值文件中，写入时计算：追加新交易日只由已存储的最后一条接续计算新记录，
+    合并旧交易日时重新计算该基金的全部复权净值
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: 存储目录
+        """
+        self.path = path or settings.NAV_STORE_DIR
+        self.index_path = self.path + "/index.bin"
+        # {基金代码: (偏移, 数量, 容量)}
+        self.index = {}
+        # 已读取的索引日志长度 (字节)
+        self.index_size = 0
+        # 索引文件的 inode (压缩或清空后变化，需要重新读取)
+        self.index_inode = None
+        # 数据文件代数 (索引的头记录，压缩时递增，数据文件名带有代数)
+        self.generation = None
+        self.data = None
+        self.adjusted = None
+        self.data_file = None
+        self.adjusted_file = None
+        self.index_file = None
+
+    def get_data_path(self, generation: int = None) -> str:
+        """
+        获取数据文件地址
+        :param generation: 数据文件代数，None 表示当前代数
+        :return: 数据文件地址
+        """
+        if generation is None:
+            generation = self.generation
+        return self.path + "/net_value." + str(generation) + ".bin"
+
+    def get_adjusted_path(self, generation: int = None) -> str:
+        """
+        获取复权净值文件地址
+        :param generation: 数据文件代数，None 表示当前代数
+        :return: 复权净值文件地址
+        """
+        if generation is None:
+            generation = self.generation
+        return self.path + "/adjusted." + str(generation) + ".bin"
+
+    def clear(self):
+        """
+        清空已读取的索引与数据映射
+        :return:
+        """
+        self.index = {}
+        self.index_size = 0
+        self.index_inode = None
+        self.generation = None
+        self.data = None
+        self.adjusted = None
+
+    def refresh(self):
+        """
+        读取其他进程新追加的索引记录 (索引文件被压缩替换或清空时重新读取)
+        :return:
+        """
+        try:
+            f = open(self.index_path, "rb")
+        except FileNotFoundError:
+            self.clear()
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self.index_inode or stat.st_size < self.index_size:
+                self.clear()
+                self.index_inode = stat.st_ino
+            # 忽略写入中断留下的不完整记录
+            size = stat.st_size - stat.st_size % INDEX_DTYPE.itemsize
+            if size <= self.index_size:
+                return
+            f.seek(self.index_size)
+            records = np.frombuffer(f.read(size - self.index_size), dtype=INDEX_DTYPE)
+        for fund_code, offset, length, capacity in records.tolist():
+            if fund_code == "":
+                self.generation = offset
+            else:
+                self.index[fund_code] = (offset, length, capacity)
+        self.index_size = size
+        if self.generation is not None and not os.path.exists(self.get_adjusted_path()):
+            # 没有复权净值文件的旧存储视为空存储，写入时重建
+            self.clear()
+
+    def get_data(self, end: int) -> np.ndarray:
+        """
+        获取数据文件的内存映射 (文件变长后重新映射；只映射完整的记录)
+        :param end: 需要访问的记录位置上限
+        :return: NET_VALUE_DTYPE 内存映射数组
+        """
+        if self.data is None or len(self.data) < end:
+            path = self.get_data_path()
+            self.data = np.memmap(
+                path,
+                dtype=NET_VALUE_DTYPE,
+                mode="r",
+                shape=(os.path.getsize(path) // NET_VALUE_DTYPE.itemsize,),
+            )
+        return self.data
+
+    def get_adjusted_data(self, end: int) -> np.ndarray:
+        """
+        获取复权净值文件的内存映射 (与 get_data 相同)
+        :param end: 需要访问的记录位置上限
+        :return: ADJUSTED_DTYPE 内存映射数组
+        """
+        if self.adjusted is None or len(self.adjusted) < end:
+            path = self.get_adjusted_path()
+            self.adjusted = np.memmap(
+                path,
+                dtype=ADJUSTED_DTYPE,
+                mode="r",
+                shape=(os.path.getsize(path) // ADJUSTED_DTYPE.itemsize,),
+            )
+        return self.adjusted
+
+    def get(self, fund_code: str, start=None, end=None) -> np.ndarray:
+        """
+        读取单个基金的净值记录 (内存映射上的切片，不复制数据；需要修改时先复制)
+        :param fund_code: 基金代码
+        :param start: 起始交易日 (YYYYMMDD，含)，None 表示不限
+        :param end: 结束交易日 (YYYYMMDD，含)，None 表示不限
+        :return: 按交易日排序的 NET_VALUE_DTYPE 数组，基金不存在时为空数组
+        """
+        return self.get_with_adjusted(fund_code, start, end, False)[0]
+
+    def get_adjusted(self, fund_code: str, start=None, end=None) -> np.ndarray:
+        """
+        读取单个基金的复权净值 (内存映射上的切片，与 get 返回的记录一一对应)
+        :param fund_code: 基金代码
+        :param start: 起始交易日 (YYYYMMDD，含)，None 表示不限
+        :param end: 结束交易日 (YYYYMMDD，含)，None 表示不限
+        :return: 按交易日排序的复权净值数组，基金不存在时为空数组
+        """
+        return self.get_with_adjusted(fund_code, start, end)[1]
+
+    def get_with_adjusted(self, fund_code: str, start=None, end=None, adjusted=True):
+        """
+        读取单个基金的净值记录与复权净值
+        :param fund_code: 基金代码
+        :param start: 起始交易日 (YYYYMMDD，含)，None 表示不限
+        :param end: 结束交易日 (YYYYMMDD，含)，None 表示不限
+        :param adjusted: 是否读取复权净值
+        :return: (NET_VALUE_DTYPE 数组, 复权净值数组)，不读取复权净值时后者为 None
+        """
+        for attempt in range(2):
+            self.refresh()
+            entry = self.index.get(fund_code)
+            if entry is None or entry[1] == 0:
+                return (
+                    np.empty(0, dtype=NET_VALUE_DTYPE),
+                    np.empty(0, dtype=ADJUSTED_DTYPE) if adjusted else None,
+                )
+            offset, length, _ = entry
+            try:
+                net_values = self.get_data(offset + length)[offset : offset + length]
+                adjusted_navs = None
+                if adjusted:
+                    adjusted_navs = self.get_adjusted_data(offset + length)[
+                        offset : offset + length
+                    ]
+                break
+            except FileNotFoundError:
+                # 读取索引后存储被压缩，旧数据文件已删除，重新读取索引
+                if attempt > 0:
+                    raise
+        if start is not None or end is not None:
+            trading_day = net_values["trading_day"]
+            left = 0 if start is None else np.searchsorted(trading_day, int(start))
+            right = (
+                len(net_values)
+                if end is None
+                else np.searchsorted(trading_day, int(end), side="right")
+            )
+            net_values = net_values[left:right]
+            if adjusted:
+                adjusted_navs = adjusted_navs[left:right]
+        return net_values, adjusted_navs
+
+    def get_frame(self, fund_code: str, start=None, end=None) -> pd.DataFrame:
+        """
+        读取单个基金的净值数据表
+        :param fund_code: 基金代码
+        :param start: 起始交易日 (YYYYMMDD，含)，None 表示不限
+        :param end: 结束交易日 (YYYYMMDD，含)，None 表示不限
+        :return: 净值数据 (net_values_to_frame 的列与类型，以及复权净值 adjusted_net_value 列)
+        """
+        net_values, adjusted_navs = self.get_with_adjusted(fund_code, start, end)
+        df = net_values_to_frame(fund_code, np.array(net_values))
+        df["adjusted_net_value"] = np.array(adjusted_navs)
+        return df
+
+    def get_last_trading_day(self, fund_code: str) -> Optional[str]:
+        """
+        获取单个基金已存储的最新交易日
+        :param fund_code: 基金代码
+        :return: 最新交易日 (YYYYMMDD)，基金不存在时返回 None
+        """
+        net_values = self.get(fund_code)
+        if len(net_values) == 0:
+            return None
+        return str(net_values["trading_day"][-1])
+
+    def has_history(self, fund_code: str, last_trading_day: Optional[str]) -> bool:
+        """
+        判断是否存储了基金截至指定交易日的完整历史 (与主存储的最新交易日一致时才使用本存储读取历史)
+        :param fund_code: 基金代码
+        :param last_trading_day: 主存储中的最新交易日
+        :return: 是否一致
+        """
+        return last_trading_day is not None and self.get_last_trading_day(
+            fund_code
+        ) == str(last_trading_day)
+
+    def get_latest_trading_days(self) -> dict:
+        """
+        获取每个基金已存储的最新交易日
+        :return: {基金代码: 最新交易日 (YYYYMMDD)}
+        """
+        fund_codes = self.get_fund_codes()
+        if not fund_codes:
+            return {}
+        last = np.array(
+            [sum(self.index[fund_code][:2]) - 1 for fund_code in fund_codes]
+        )
+        trading_day = self.get_data(int(last.max()) + 1)["trading_day"][last]
+        return dict(zip(fund_codes, map(str, trading_day.tolist())))
+
+    def get_fund_codes(self) -> list:
+        """
+        获取已存储的基金代码
+        :return: 基金代码列表
+        """
+        self.refresh()
+        return [fund_code for fund_code, entry in self.index.items() if entry[1] > 0]
+
+    @staticmethod
+    def get_capacity(length: int) -> int:
+        """
+        获取基金记录的预留容量
+        :param length: 记录数量
+        :return: 容量
+        """
+        return length + max(settings.NAV_STORE_RESERVE_ROWS, length // 4)
+
+    @staticmethod
+    def calc_adjusted(
+        net_values: np.ndarray, adjusted: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        计算单个基金净值记录的复权净值 (与 metrics.prepare_net_value 的口径一致)
+        :param net_values: 按交易日排序的 NET_VALUE_DTYPE 数组
+        :param adjusted: 已计算的复权净值 (NaN 为待计算)，None 表示全部计算
+        :return: 复权净值数组
+        """
+        return calc_adjusted_nav(
+            np.zeros(len(net_values), dtype=np.int64),
+            net_values["unit_net_value"].astype("float64"),
+            net_values["cumulative_net_value"].astype("float64"),
+            net_values["daily_growth_rate"].astype("float64"),
+            adjusted,
+        )
+
+    def append(self, fund_code: str, net_values: np.ndarray):
+        """
+        写入单个基金的净值记录 (与已存储的记录合并，同一交易日以新记录为准) 并计算复权净值
+        :param fund_code: 基金代码
+        :param net_values: NET_VALUE_DTYPE 数组
+        :return:
+        """
+        if len(net_values) == 0:
+            return
+        net_values = np.sort(
+            np.asarray(net_values, dtype=NET_VALUE_DTYPE), order="trading_day"
+        )
+        self.open()
+        self.refresh()
+        entry = self.index.get(fund_code)
+        adjusted = None
+        if entry is not None and entry[1] > 0:
+            offset, length, capacity = entry
+            old_values = self.get_data(offset + length)[offset : offset + length]
+            old_adjusted = self.get_adjusted_data(offset + length)[
+                offset : offset + length
+            ]
+            if net_values["trading_day"][0] > old_values["trading_day"][-1]:
+                # 新交易日：由已存储的最后一条接续计算复权净值，已有复权净值不变
+                adjusted = self.calc_adjusted(
+                    np.concatenate([old_values[-1:], net_values]),
+                    np.append(old_adjusted[-1], np.full(len(net_values), np.nan)),
+                )[1:]
+                if length + len(net_values) <= capacity:
+                    # 新交易日写入预留容量，已有记录不动
+                    self.write_data(offset + length, net_values, adjusted)
+                    self.write_index(
+                        fund_code, offset, length + len(net_values), capacity
+                    )
+                    return
+                net_values = np.concatenate([old_values, net_values])
+                adjusted = np.concatenate([old_adjusted, adjusted])
+            else:
+                # 包含已存储的交易日：合并后整体重写 (稳定排序后同一交易日保留最后一条，即新记录)
+                net_values = np.concatenate([old_values, net_values])
+                net_values = net_values[
+                    np.argsort(net_values["trading_day"], kind="stable")
+                ]
+                trading_day = net_values["trading_day"]
+                net_values = net_values[
+                    np.append(trading_day[1:] != trading_day[:-1], True)
+                ]
+        if adjusted is None:
+            adjusted = self.calc_adjusted(net_values)
+        # 写到文件末尾并预留容量 (原位置不再使用，由 compact 回收)
+        length = len(net_values)
+        capacity = self.get_capacity(length)
+        offset = os.path.getsize(self.get_data_path()) // NET_VALUE_DTYPE.itemsize
+        self.write_data(offset, net_values, adjusted)
+        self.adjusted_file.truncate((offset + capacity) * ADJUSTED_DTYPE.itemsize)
+        self.data_file.truncate((offset + capacity) * NET_VALUE_DTYPE.itemsize)
+        self.write_index(fund_code, offset, length, capacity)
+
+    def write_data(self, offset: int, net_values: np.ndarray, adjusted: np.ndarray):
+        """
+        在指定位置写入记录与复权净值
+        :param offset: 记录位置
+        :param net_values: NET_VALUE_DTYPE 数组
+        :param adjusted: 复权净值数组
+        :return:
+        """
+        self.adjusted_file.seek(offset * ADJUSTED_DTYPE.itemsize)
+        self.adjusted_file.write(np.asarray(adjusted, dtype=ADJUSTED_DTYPE).tobytes())
+        self.adjusted_file.flush()
+        self.data_file.seek(offset * NET_VALUE_DTYPE.itemsize)
+        self.data_file.write(net_values.tobytes())
+        self.data_file.flush()
+
+    def write_index(self, fund_code: str, offset: int, length: int, capacity: int):
+        """
+        追加索引记录 (数据写入后才追加，读取方不会看到未写完的数据)
+        :param fund_code: 基金代码
+        :param offset: 记录偏移
+        :param length: 记录数量
+        :param capacity: 预留容量
+        :return:
+        """
+        record = np.array([(fund_code, offset, length, capacity)], dtype=INDEX_DTYPE)
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.index[fund_code] = (offset, length, capacity)
+        self.index_size += INDEX_DTYPE.itemsize
+
+    def open(self):
+        """
+        打开写入用的文件 (只在写入进程中调用；存储不存在时新建)
+        :return:
+        """
+        if self.data_file is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self.refresh()
+        if self.generation is None:
+            # 新建存储时清除目录中的残留文件 (如没有复权净值文件的旧存储)
+            for name in os.listdir(self.path):
+                os.remove(self.path + "/" + name)
+            open(self.get_data_path(0), "wb").close()
+            open(self.get_adjusted_path(0), "wb").close()
+            header = np.array([("", 0, 0, 0)], dtype=INDEX_DTYPE)
+            with open(self.index_path, "wb") as f:
+                f.write(header.tobytes())
+            self.refresh()
+        else:
+            # 截掉写入中断留下的不完整索引记录
+            with open(self.index_path, "ab") as f:
+                f.truncate(self.index_size)
+        self.data_file = open(self.get_data_path(), "r+b")
+        self.adjusted_file = open(self.get_adjusted_path(), "r+b")
+        self.index_file = open(self.index_path, "ab")
+
+    def compact(self):
+        """
+        数据文件超过各基金占用容量之和的 settings.NAV_STORE_COMPACT_RATIO 倍时，
+        把各基金的记录重写到新一代数据文件并替换索引 (只在没有其他写入时调用，如运行结束时)
+        :return:
+        """
+        self.refresh()
+        if self.generation is None:
+            return
+        data_path = self.get_data_path()
+        adjusted_path = self.get_adjusted_path()
+        total = os.path.getsize(data_path) // NET_VALUE_DTYPE.itemsize
+        used = sum(capacity for _, _, capacity in self.index.values())
+        if total <= used * settings.NAV_STORE_COMPACT_RATIO:
+            return
+        self.close()
+        generation = self.generation + 1
+        data = self.get_data(total)
+        adjusted = self.get_adjusted_data(total)
+        records = [("", generation, 0, 0)]
+        new_offset = 0
+        with open(self.get_data_path(generation), "wb") as f, open(
+            self.get_adjusted_path(generation), "wb"
+        ) as adjusted_f:
+            for fund_code, (offset, length, _) in sorted(self.index.items()):
+                capacity = self.get_capacity(length)
+                f.seek(new_offset * NET_VALUE_DTYPE.itemsize)
+                f.write(data[offset : offset + length].tobytes())
+                adjusted_f.seek(new_offset * ADJUSTED_DTYPE.itemsize)
+                adjusted_f.write(adjusted[offset : offset + length].tobytes())
+                records.append((fund_code, new_offset, length, capacity))
+                new_offset += capacity
+            f.truncate(new_offset * NET_VALUE_DTYPE.itemsize)
+            adjusted_f.truncate(new_offset * ADJUSTED_DTYPE.itemsize)
+        # 先替换索引再删除旧数据文件，读取方看到新索引时新数据文件已写完
+        np.array(records, dtype=INDEX_DTYPE).tofile(self.index_path + ".tmp")
+        os.replace(self.index_path + ".tmp", self.index_path)
+        os.remove(data_path)
+        os.remove(adjusted_path)
+        self.clear()
+
+    def reset(self):
+        """
+        清空存储 (全量爬取开始时调用)
+        :return:
+        """
+        self.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self.clear()
+
+    def close(self):
+        """
+        关闭写入用的文件
+        :return:
+        """
+        if self.data_file is not None:
+            self.data_file.close()
+            self.adjusted_file.close()
+            self.index_file.close()
+        self.data_file = None
+        self.adjusted_file = None
+        self.index_file = None
+
+
+# 进程内共享的净值存储实例
+_nav_store = None
+
+
+def get_nav_store() -> Optional[NavStore]:
+    """
+    获取进程内共享的内存映射净值存储 (未开启 settings.NAV_STORE_ENABLED 时返回 None)
+    :return: 净值存储
+    """
+    global _nav_store
+    if not settings.NAV_STORE_ENABLED:
+        return None
+    if _nav_store is None:
+        _nav_store = NavStore()
+    return _nav_store
@@ -0,0 +1,170 @@
+from typing import Iterator
+import os
+
+import numpy as np
+import pandas as pd
+
+import settings
+from logger import logger, init_logger
+from calcstate import get_calc_state_store
+from metrics import (
+    build_calc_state,
+    calc_state_results,
+    calc_trailing,
+    calc_rolling_series,
+)
+from store import (
+    NET_VALUE_COLS,
+    NET_VALUE_FLOAT_FORMAT,
+    append_csv,
+    append_net_value_parquet,
+    load_net_value_csv,
+    load_net_value_mysql,
+    load_net_value_parquet,
+    load_latest_trading_days,
+    ResultSink,
+)
+
+
+def load_fund_names() -> dict:
+    """
+    获取基金名称 (已存储的净值数据中没有名称)：优先使用已有的年计算结果，其次使用基金列表缓存
+    :return: {基金代码: 基金名称}
+    """
+    from discovery import load_fund_list_cache
+
+    fund_names = {}
+    fund_list = load_fund_list_cache(
+        settings.FUND_LIST_CACHE_PATH, float("inf"), settings.FUND_TYPES
+    )
+    if fund_list is not None:
+        fund_names.update(fund_list)
+    path = settings.CSV_WRITE_DIR + "/calc_year.csv"
+    if os.path.exists(path):
+        df = pd.read_csv(
+            path,
+            usecols=["fund_code", "fund_name"],
+            dtype=str,
+            encoding="utf-8-sig",
+        )
+        fund_names.update(df.dropna().itertuples(index=False, name=None))
+    return fund_names
+
+
+def iter_net_value_batches(fund_codes: list = None) -> Iterator[pd.DataFrame]:
+    """
+    按基金分批读取已存储的净值数据 (每批 settings.OFFLINE_BATCH_FUNDS 个基金)
+    :param fund_codes: 基金代码列表，None 表示全部已存储的基金
+    :return: 长表格式的净值数据迭代器
+    """
+    batch_size = settings.OFFLINE_BATCH_FUNDS
+    if settings.STORE_TYPE == "CSV":
+        df = load_net_value_csv()
+        if fund_codes is not None:
+            df = df[df["fund_code"].isin(fund_codes)]
+        df = df.sort_values("fund_code", kind="stable").reset_index(drop=True)
+        codes = df["fund_code"].to_numpy()
+        unique_codes = pd.unique(codes)
+        for i in range(0, len(unique_codes), batch_size):
+            batch_codes = unique_codes[i : i + batch_size]
+            start = np.searchsorted(codes, batch_codes[0], side="left")
+            end = np.searchsorted(codes, batch_codes[-1], side="right")
+            yield df.iloc[start:end]
+        return
+
+    db = None
+    if settings.STORE_TYPE == "MYSQL":
+        from model import Database
+
+        db = Database(settings.MYSQL_URL)
+        db.connect(settings.MYSQL_POOL_SIZE, settings.MYSQL_POOL_RECYCLE)
+    elif settings.STORE_TYPE != "PARQUET":
+        raise Exception("STORE_TYPE must be MYSQL, CSV or PARQUET")
+    try:
+        stored_codes = sorted(load_latest_trading_days(db))
+        if fund_codes is not None:
+            fund_codes = set(fund_codes)
+            stored_codes = [code for code in stored_codes if code in fund_codes]
+        for i in range(0, len(stored_codes), batch_size):
+            batch_codes = stored_codes[i : i + batch_size]
+            if db is None:
+                yield load_net_value_parquet(batch_codes)
+            else:
+                yield pd.concat(
+                    [load_net_value_mysql(db, code) for code in batch_codes],
+                    ignore_index=True,
+                )
+    finally:
+        if db is not None:
+            db.disconnect()
+
+
+def recalc(fund_codes: list = None):
+    """
+    由已存储的净值数据重新计算指标并写出计算结果 (不爬取，不加载浏览器与爬虫依赖)，同时重建指标累积状态；
+    只替换重新计算的基金的结果行，其他基金的结果保持不变
+    :param fund_codes: 基金代码列表，None 表示全部已存储的基金
+    :return:
+    """
+    init_logger()
+    logger.info("开始由已存储数据重新计算指标")
+    fund_names = load_fund_names()
+    state_store = get_calc_state_store()
+    sink = ResultSink(incremental=True)
+    fund_num = 0
+    for df in iter_net_value_batches(fund_codes):
+        if df.empty:
+            continue
+        batch_codes = sorted(df["fund_code"].unique())
+        if settings.CALC_EXACT_DECIMAL:
+            from service import CalcService
+
+            year_df, month_df = CalcService.calc_batch(df, fund_names)
+        else:
+            states = build_calc_state(df)
+            year_df, month_df = calc_state_results(states, fund_names)
+            if state_store is not None:
+                for fund_code, state in states.items():
+                    state_store.put(fund_code, state)
+        rolling_series_df = None
+        if settings.ROLLING_SERIES_OUTPUT:
+            rolling_series_df = calc_rolling_series(df, settings.ROLLING_WINDOW)
+        sink.write(
+            {
+                "fund_codes": batch_codes,
+                "year_df": year_df,
+                "month_df": month_df,
+                "rolling_df": calc_trailing(df, fund_names),
+                "rolling_series_df": rolling_series_df,
+            }
+        )
+        fund_num += len(batch_codes)
+        logger.info("已重新计算基金数量：" + str(fund_num) + "个")
+    sink.close()
+    logger.info("重新计算指标完成，基金数量：" + str(fund_num) + "个")
+
+
+def export_net_value(output: str, output_format: str, fund_codes: list = None):
+    """
+    导出已存储的净值数据 (不爬取，不加载浏览器与爬虫依赖)
+    :param output: 导出地址 (CSV 为文件，PARQUET 为按年分区的数据集目录)
+    :param output_format: 导出格式 CSV / PARQUET
+    :param fund_codes: 基金代码列表，None 表示全部已存储的基金
+    :return:
+    """
+    init_logger()
+    if output_format not in ("CSV", "PARQUET"):
+        raise Exception("导出格式必须为 CSV 或 PARQUET")
+    if os.path.exists(output):
+        raise Exception("导出地址已存在：" + output)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    row_num = 0
+    for df in iter_net_value_batches(fund_codes):
+        if df.empty:
+            continue
+        if output_format == "CSV":
+            append_csv(output, df, NET_VALUE_COLS, float_format=NET_VALUE_FLOAT_FORMAT)
+        else:
+            append_net_value_parquet(df, output)
+        row_num += len(df)
+    logger.info("导出净值数据完成，导出地址：" + output + "，净值数量：" + str(row_num) + "条")
@@ -0,0 +1,563 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+import json
+import operator
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import settings
+from analytics import RANK_ASCENDING_METRICS
+from format import get_calc_year_cols_sequence
+from logger import logger, init_logger
+from store import read_calc_csv
+
+
+# 查询表 {表名: 分区列}；表按分区列与基金代码排序，查询时依次用分区列缩小行范围
+QUERY_TABLES = {
+    "total": [],
+    "year": ["year"],
+    "month": ["year", "month"],
+    "rolling": [],
+}
+
+# 计算结果文件 {文件名: 由该文件加载的查询表}
+RESULT_FILES = {
+    "calc_year.csv": ["total", "year"],
+    "calc_month.csv": ["month"],
+    "calc_rolling.csv": ["rolling"],
+}
+
+# 年计算结果中每年指标的列名 (年份_指标名)
+YEAR_COL_PATTERN = re.compile(r"^(\d{4})_(.+)$")
+
+# 筛选条件的比较运算
+FILTER_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+# HTTP 接口的筛选条件格式 (列名 运算 值，如 sharpe>1)
+FILTER_PATTERN = re.compile(r"^(\w+)(>=|<=|==|!=|>|<|=)(.+)$")
+
+
+def split_year_frame(df: pd.DataFrame) -> dict:
+    """
+    把年计算结果 (每个基金一行，每年的指标为 年份_指标名 列) 拆分为整个区间的指标表与每个基金每年一行的年指标表
+    :param df: 年计算结果 (calc_year.csv)
+    :return: {"total": 整个区间的指标, "year": 每年的指标 (没有该年净值的基金不占行)}
+    """
+    total_cols = get_calc_year_cols_sequence([])
+    metric_cols = total_cols[2:]
+    year_cols = {}
+    for col in df.columns:
+        match = YEAR_COL_PATTERN.match(col)
+        if match is not None:
+            year_cols.setdefault(int(match.group(1)), {})[col] = match.group(2)
+    year_df_list = []
+    for year, cols in sorted(year_cols.items()):
+        year_df = df[["fund_code", "fund_name"] + list(cols)].rename(columns=cols)
+        year_df = year_df.reindex(columns=["fund_code", "fund_name"] + metric_cols)
+        year_df = year_df[year_df[metric_cols].notna().any(axis=1)]
+        year_df.insert(2, "year", year)
+        year_df_list.append(year_df)
+    if year_df_list:
+        year_df = pd.concat(year_df_list, ignore_index=True)
+    else:
+        year_df = pd.DataFrame(columns=["fund_code", "fund_name", "year"] + metric_cols)
+        year_df["year"] = year_df["year"].astype("int64")
+    return {"total": df.reindex(columns=total_cols), "year": year_df}
+
+
+def load_result_file(path: str) -> dict:
+    """
+    读取计算结果文件
+    :param path: 计算结果文件路径
+    :return: {表名: 数据}
+    """
+    df = read_calc_csv(path)
+    name = os.path.basename(path)
+    if name == "calc_year.csv":
+        return split_year_frame(df)
+    return {RESULT_FILES[name][0]: df}
+
+
+class QueryTable(object):
+    """
+    内存中的查询表：按分区列与基金代码排序，分区列用二分查找定位行范围，基金代码用位置索引定位，
+    筛选、排序只在选出的行上进行
+    """
+
+    def __init__(self, name: str, df: pd.DataFrame, partition_cols: list):
+        """
+        :param name: 表名
+        :param df: 数据
+        :param partition_cols: 分区列
+        """
+        self.name = name
+        self.partition_cols = partition_cols
+        self.df = df.sort_values(
+            partition_cols + ["fund_code"], kind="mergesort"
+        ).reset_index(drop=True)
+        self.arrays = {col: self.df[col].to_numpy() for col in self.df.columns}
+        # {基金代码: 行位置数组}
+        self.fund_rows = self.df.groupby("fund_code", sort=False).indices
+
+    def get_array(self, column: str) -> np.ndarray:
+        """
+        获取列的值
+        :param column: 列名
+        :return: 值数组
+        """
+        if column not in self.arrays:
+            raise Exception("查询表" + self.name + "没有该列：" + column)
+        return self.arrays[column]
+
+    def select(self, fund_codes: list = None, keys: dict = None) -> np.ndarray:
+        """
+        选出符合基金代码与分区条件的行
+        :param fund_codes: 基金代码，None 表示全部基金
+        :param keys: 分区条件 {列名: 值}，如 {"year": 2022}
+        :return: 行位置数组 (按分区列与基金代码排序)
+        """
+        keys = dict(keys or {})
+        start, end = 0, len(self.df)
+        for col in self.partition_cols:
+            if keys.get(col) is None:
+                break
+            value = keys.pop(col)
+            values = self.arrays[col][start:end]
+            start, end = (
+                start + np.searchsorted(values, value, "left"),
+                start + np.searchsorted(values, value, "right"),
+            )
+        if fund_codes is None:
+            rows = np.arange(start, end)
+        else:
+            row_list = [
+                self.fund_rows[fund_code]
+                for fund_code in fund_codes
+                if fund_code in self.fund_rows
+            ]
+            rows = np.sort(np.concatenate(row_list)) if row_list else np.arange(0)
+            rows = rows[(rows >= start) & (rows < end)]
+        # 不在分区列前缀上的条件 (如只按月份查询) 逐行比较
+        for col, value in keys.items():
+            if value is not None:
+                rows = rows[self.get_array(col)[rows] == value]
+        return rows
+
+    def filter(self, rows: np.ndarray, column: str, op: str, value) -> np.ndarray:
+        """
+        按比较条件筛选行 (值为空的行不符合任何条件)
+        :param rows: 行位置数组
+        :param column: 列名
+        :param op: 比较运算 (FILTER_OPS)
+        :param value: 比较的值 (数值列的字符串值转换为数值，如 HTTP 接口的参数)
+        :return: 行位置数组
+        """
+        if op not in FILTER_OPS:
+            raise Exception("不支持的比较运算：" + str(op))
+        values = self.get_array(column)[rows]
+        is_valid = pd.notna(values)
+        if values.dtype == object:
+            matched = np.zeros(len(values), dtype=bool)
+            matched[is_valid] = FILTER_OPS[op](values[is_valid].astype(str), str(value))
+        else:
+            if isinstance(value, str):
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise Exception("列" + column + "的比较值不是数值：" + value)
+            with np.errstate(invalid="ignore"):
+                matched = FILTER_OPS[op](values, value) & is_valid
+        return rows[matched]
+
+    def sort(
+        self, rows: np.ndarray, column: str, ascending: bool, limit: int = None
+    ) -> np.ndarray:
+        """
+        按列排序 (空值排在最后，相同的值保持原有顺序)，只取前 N 个时先用部分排序找出候选行
+        :param rows: 行位置数组
+        :param column: 列名
+        :param ascending: 是否升序
+        :param limit: 只取前 N 个，None 表示全部
+        :return: 排序后的行位置数组
+        """
+        values = self.get_array(column)[rows]
+        if values.dtype == object:
+            order = (
+                pd.Series(values)
+                .sort_values(ascending=ascending, na_position="last", kind="mergesort")
+                .index.to_numpy()
+            )
+            return rows[order[:limit]]
+        keys = values.astype("float64")
+        if not ascending:
+            keys = -keys
+        if limit is not None and 0 < limit < len(keys):
+            kth = np.partition(keys, limit - 1)[limit - 1]
+            if not np.isnan(kth):
+                candidates = np.flatnonzero(keys <= kth)
+                order = candidates[np.argsort(keys[candidates], kind="mergesort")]
+                return rows[order[:limit]]
+        return rows[np.argsort(keys, kind="mergesort")[:limit]]
+
+
+class ResultQuery(object):
+    """
+    计算结果查询：把 settings.CSV_WRITE_DIR 下的计算结果读入内存中的查询表，按基金代码、年、月筛选、排序与取前 N 个；
+    查询时按 settings.QUERY_RELOAD_INTERVAL 检查结果文件，只重新加载有变化的文件 (新一次运行写出后)
+    """
+
+    def __init__(self, base_dir: str = None):
+        """
+        :param base_dir: 计算结果目录
+        """
+        self.base_dir = base_dir or settings.CSV_WRITE_DIR
+        # {表名: QueryTable}，重新加载时整体替换，查询中途不会看到加载了一半的表
+        self.tables = {}
+        # {文件名: (修改时间, 文件大小)}
+        self.signatures = {}
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self.refresh(True)
+
+    def refresh(self, force: bool = False, wait: bool = True) -> list:
+        """
+        检查计算结果文件，重新加载有变化的文件 (文件不存在时继续使用已加载的结果)
+        :param force: 是否忽略 settings.QUERY_RELOAD_SETTLE_SECONDS 立即加载刚修改的文件
+        :param wait: 其他线程正在加载时是否等待，不等待时直接返回 (查询继续使用已加载的结果)
+        :return: 重新加载的表名
+        """
+        reloaded = []
+        if not self.lock.acquire(blocking=wait):
+            return reloaded
+        try:
+            self.checked_at = time.time()
+            for file_name, table_names in RESULT_FILES.items():
+                path = self.base_dir + "/" + file_name
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if signature == self.signatures.get(file_name):
+                    continue
+                # 刚修改的文件可能还在写出，等待下次检查
+                if (
+                    not force
+                    and time.time() - stat.st_mtime
+                    < settings.QUERY_RELOAD_SETTLE_SECONDS
+                ):
+                    continue
+                try:
+                    frames = load_result_file(path)
+                except Exception as e:
+                    logger.warning("加载计算结果失败，继续使用已加载的结果，文件：" + path + "，错误：" + str(e))
+                    continue
+                tables = {
+                    name: QueryTable(name, df, QUERY_TABLES[name])
+                    for name, df in frames.items()
+                }
+                self.tables = {**self.tables, **tables}
+                self.signatures[file_name] = signature
+                reloaded.extend(table_names)
+                logger.info(
+                    "加载计算结果："
+                    + path
+                    + "，"
+                    + "，".join(
+                        name + "：" + str(len(table.df)) + "行"
+                        for name, table in tables.items()
+                    )
+                )
+        finally:
+            self.lock.release()
+        return reloaded
+
+    def get_table(self, table: str) -> QueryTable:
+        """
+        获取查询表 (距上次检查超过 settings.QUERY_RELOAD_INTERVAL 秒时先检查结果文件)
+        :param table: 表名 (QUERY_TABLES)
+        :return: 查询表
+        """
+        if table not in QUERY_TABLES:
+            raise Exception("不存在的查询表：" + str(table))
+        interval = settings.QUERY_RELOAD_INTERVAL
+        if interval is not None and time.time() - self.checked_at >= interval:
+            self.refresh(wait=False)
+        query_table = self.tables.get(table)
+        if query_table is None:
+            raise Exception("查询表" + table + "的计算结果文件不存在")
+        return query_table
+
+    def query(
+        self,
+        table: str,
+        fund_codes: list = None,
+        year: int = None,
+        month: int = None,
+        filters: list = None,
+        sort: str = None,
+        ascending: bool = False,
+        limit: int = None,
+        columns: list = None,
+    ) -> pd.DataFrame:
+        """
+        查询计算结果
+        :param table: 表名 (total 整个区间 / year 每年 / month 每月收益 / rolling 近期区间)
+        :param fund_codes: 基金代码，None 表示全部基金
+        :param year: 年份
+        :param month: 月份
+        :param filters: 筛选条件 [(列名, 比较运算, 值)]，如 [("sharpe", ">", 1)]
+        :param sort: 排序列
+        :param ascending: 是否升序
+        :param limit: 只取前 N 个
+        :param columns: 返回的列，None 表示全部
+        :return: 查询结果
+        """
+        query_table = self.get_table(table)
+        keys = {"year": year, "month": month}
+        for col, value in keys.items():
+            if value is not None:
+                query_table.get_array(col)
+        rows = query_table.select(fund_codes, keys)
+        for column, op, value in filters or []:
+            rows = query_table.filter(rows, column, op, value)
+        if sort is not None:
+            rows = query_table.sort(rows, sort, ascending, limit)
+        elif limit is not None:
+            rows = rows[:limit]
+        df = query_table.df.take(rows)
+        if columns is not None:
+            for column in columns:
+                query_table.get_array(column)
+            df = df[columns]
+        return df.reset_index(drop=True)
+
+    def top(
+        self,
+        metric: str,
+        n: int = 10,
+        year: int = None,
+        month: int = None,
+        table: str = None,
+        ascending: bool = None,
+        fund_codes: list = None,
+    ) -> pd.DataFrame:
+        """
+        查询指标最好的前 N 个基金 (如 2022 年夏普比率最高的 10 个基金)
+        :param metric: 指标列名
+        :param n: 基金数量
+        :param year: 年份
+        :param month: 月份 (按月收益排名)
+        :param table: 表名，None 表示按年份、月份自动选择 (month / year / total)
+        :param ascending: 是否升序，None 表示按指标决定 (波动率、最大回撤越小越好)
+        :param fund_codes: 只在这些基金中排名，None 表示全部基金
+        :return: 查询结果
+        """
+        if table is None:
+            table = (
+                "month"
+                if month is not None
+                else "year"
+                if year is not None
+                else "total"
+            )
+        if ascending is None:
+            ascending = any(metric.endswith(name) for name in RANK_ASCENDING_METRICS)
+        return self.query(
+            table,
+            fund_codes=fund_codes,
+            year=year,
+            month=month,
+            sort=metric,
+            ascending=ascending,
+            limit=n,
+        )
+
+    def get_fund(self, fund_code: str) -> dict:
+        """
+        查询单个基金的全部计算结果
+        :param fund_code: 基金代码
+        :return: {表名: 查询结果}，只包含已加载的表
+        """
+        return {
+            table: self.query(table, fund_codes=[fund_code])
+            for table in QUERY_TABLES
+            if table in self.tables
+        }
+
+    def get_tables(self) -> dict:
+        """
+        获取已加载的查询表信息
+        :return: {表名: {"rows": 行数, "columns": 列名}}
+        """
+        return {
+            name: {"rows": len(table.df), "columns": list(table.df.columns)}
+            for name, table in self.tables.items()
+        }
+
+
+# 进程内共享的计算结果查询实例
+_result_query = None
+
+
+def get_result_query() -> ResultQuery:
+    """
+    获取进程内共享的计算结果查询 (第一次调用时加载计算结果)
+    :return: 计算结果查询
+    """
+    global _result_query
+    if _result_query is None:
+        _result_query = ResultQuery()
+    return _result_query
+
+
+def parse_query_params(params: dict) -> dict:
+    """
+    解析 HTTP 查询参数
+    :param params: parse_qs 解析的查询参数 {参数名: [值]}
+    :return: ResultQuery.query 的参数
+    """
+    kwargs = {}
+    for name, values in params.items():
+        value = values[-1]
+        if name == "table":
+            kwargs["table"] = value
+        elif name in ("fund_code", "fund_codes"):
+            kwargs["fund_codes"] = [
+                fund_code for value in values for fund_code in value.split(",")
+            ]
+        elif name in ("year", "month", "limit", "n"):
+            kwargs[name] = int(value)
+        elif name in ("sort", "metric"):
+            kwargs[name] = value
+        elif name == "ascending":
+            kwargs["ascending"] = value.lower() in ("1", "true", "yes")
+        elif name == "columns":
+            kwargs["columns"] = value.split(",")
+        elif name == "filter":
+            filters = []
+            for condition in values:
+                match = FILTER_PATTERN.match(condition)
+                if match is None:
+                    raise Exception("无法解析的筛选条件：" + condition)
+                filters.append(match.groups())
+            kwargs["filters"] = filters
+        else:
+            raise Exception("不支持的查询参数：" + name)
+    return kwargs
+
+
+def frame_to_json(df: pd.DataFrame) -> str:
+    """
+    查询结果转换为 JSON (空值为 null)
+    :param df: 查询结果
+    :return: {"count": 行数, "rows": [每行的字典]}
+    """
+    return (
+        '{"count": '
+        + str(len(df))
+        + ', "rows": '
+        + df.to_json(orient="records", force_ascii=False)
+        + "}"
+    )
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    计算结果查询的 HTTP 接口 (GET，返回 JSON)：
+    /query?table=year&year=2022&filter=sharpe>1&sort=sharpe&limit=10&columns=fund_code,sharpe
+    /top?metric=sharpe&year=2022&n=10
+    /fund?fund_code=000001
+    /tables
+    """
+
+    result_query: Optional[ResultQuery] = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            kwargs = parse_query_params(parse_qs(url.query))
+            if url.path == "/query":
+                body = frame_to_json(self.result_query.query(**kwargs))
+            elif url.path == "/top":
+                if "sort" in kwargs:
+                    kwargs["metric"] = kwargs.pop("sort")
+                if "limit" in kwargs:
+                    kwargs["n"] = kwargs.pop("limit")
+                body = frame_to_json(self.result_query.top(**kwargs))
+            elif url.path == "/fund":
+                fund_codes = kwargs.get("fund_codes") or [""]
+                body = (
+                    "{"
+                    + ", ".join(
+                        json.dumps(table) + ": " + frame_to_json(df)
+                        for table, df in self.result_query.get_fund(
+                            fund_codes[0]
+                        ).items()
+                    )
+                    + "}"
+                )
+            elif url.path == "/tables":
+                body = json.dumps(self.result_query.get_tables(), ensure_ascii=False)
+            else:
+                self.send_json(404, json.dumps({"error": "不存在的接口：" + url.path}))
+                return
+        except TypeError as e:
+            self.send_json(400, json.dumps({"error": "查询参数错误：" + str(e)}))
+            return
+        except Exception as e:
+            self.send_json(400, json.dumps({"error": str(e)}, ensure_ascii=False))
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status: int, body: str):
+        """
+        返回 JSON 响应
+        :param status: HTTP 状态码
+        :param body: JSON 字符串
+        :return:
+        """
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("查询请求：" + self.address_string() + " " + (format % args))
+
+
+def serve(host: str = None, port: int = None):
+    """
+    启动计算结果查询的 HTTP 服务 (阻塞运行，Ctrl+C 停止)
+    :param host: 监听地址，None 表示 settings.QUERY_HOST
+    :param port: 监听端口，None 表示 settings.QUERY_PORT
+    :return:
+    """
+    init_logger()
+    QueryRequestHandler.result_query = get_result_query()
+    host = host or settings.QUERY_HOST
+    port = port or settings.QUERY_PORT
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    logger.info("计算结果查询服务已启动：http://" + host + ":" + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,474 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlparse
+import asyncio
+import random
+import time
+
+from requests.adapters import HTTPAdapter
+
+import settings
+from logger import logger
+from fetcher import HttpNetValueFetcher, year_windows
+from telemetry import get_telemetry
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    带随机抖动的指数退避时间 (一半固定、一半随机，避免重试同时到达)
+    :param attempt: 已失败次数 (从0开始)
+    :return: 等待时间 (秒)
+    """
+    delay = min(settings.ASYNC_BACKOFF_MAX, settings.ASYNC_BACKOFF_BASE * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class TokenBucket(object):
+    """
+    令牌桶限速器 (每个域名一个)
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: 每秒生成的令牌数 (每秒请求数)
+        :param capacity: 桶容量 (允许的突发请求数)，默认与 rate 相同
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        获取一个令牌，令牌不足时等待 (等待者按先后顺序获取)
+        :return:
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    自适应并发限制 (AIMD)：
+    请求成功时加性增加并发上限 (首次降低前每次成功加1，即每轮翻倍)，
+    出错或延迟突增时乘性减半，且在一个冷却期内最多减半一次
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_spike_ratio: float,
+        decrease_cooldown: float,
+    ):
+        """
+        :param initial: 初始并发上限
+        :param minimum: 最小并发上限
+        :param maximum: 最大并发上限
+        :param latency_spike_ratio: 延迟超过基线的倍数视为延迟突增
+        :param decrease_cooldown: 两次减半之间的最小间隔 (秒)
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_spike_ratio = latency_spike_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self.slow_start = True
+        self.short_latency = None
+        self.long_latency = None
+        self.last_decrease_at = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        """
+        等待直到在途请求数低于当前并发上限
+        :return:
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float = None, error: bool = False):
+        """
+        请求结束，按结果调整并发上限
+        :param latency: 请求耗时 (秒)
+        :param error: 请求是否出错
+        :return:
+        """
+        async with self.condition:
+            self.in_flight -= 1
+            if error or self.is_latency_spike(latency):
+                self.decrease()
+            else:
+                self.increase()
+            self.condition.notify_all()
+
+    def is_latency_spike(self, latency: Optional[float]) -> bool:
+        """
+        判断是否延迟突增：短期延迟均值超过长期延迟均值的 latency_spike_ratio 倍
+        (均为指数移动平均；长期均值随持续的高延迟缓慢上升，不会因此一直减半)
+        :param latency: 请求耗时 (秒)
+        :return:
+        """
+        if latency is None:
+            return False
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+            return False
+        self.short_latency = self.short_latency * 0.8 + latency * 0.2
+        self.long_latency = self.long_latency * 0.98 + latency * 0.02
+        return self.short_latency > self.long_latency * self.latency_spike_ratio
+
+    def increase(self):
+        if self.slow_start:
+            self.limit = min(self.maximum, self.limit + 1)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease_at < self.decrease_cooldown:
+            return
+        self.slow_start = False
+        self.last_decrease_at = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class AsyncCrawlScheduler(object):
+    """
+    基于 asyncio 的爬取调度器：
+    单进程内并发请求净值分页 (请求在线程池中执行)，按域名令牌桶限速、失败指数退避重试、自适应调整并发；
+    格式化、存储与指标计算交给进程池执行
+    """
+
+    def __init__(
+        self,
+        process_executor: Executor,
+        process_func: Callable,
+        executor_factory: Callable = None,
+    ):
+        """
+        :param process_executor: 处理净值数据的进程池
+        :param process_func: 处理函数，参数为 (基金代码, 基金名称, 净值原始字典列表, 已存储的最新交易日, 已存储的净值数据)
+        :param executor_factory: 进程池损坏 (工作进程异常退出) 后创建新进程池的函数，None 表示不重建
+        """
+        self.process_executor = process_executor
+        self.process_func = process_func
+        self.executor_factory = executor_factory
+        self.fetcher = HttpNetValueFetcher()
+        # 连接池大小与最大并发一致，避免请求排队等待连接
+        adapter = HTTPAdapter(
+            pool_connections=len(settings.HOST_RATE_LIMITS) + 1,
+            pool_maxsize=settings.ASYNC_MAX_CONCURRENCY,
+        )
+        self.fetcher.session.mount("http://", adapter)
+        self.fetcher.session.mount("https://", adapter)
+        self.io_executor = None
+        self.limiter = None
+        self.buckets = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "retries": 0, "failed_funds": 0}
+        self.telemetry = get_telemetry()
+
+    def get_bucket(self, url: str) -> Optional[TokenBucket]:
+        """
+        获取域名对应的令牌桶 (未配置的域名使用 settings.DEFAULT_HOST_RATE_LIMIT，None 表示不限速)
+        :param url: 请求地址
+        :return: 令牌桶
+        """
+        host = urlparse(url).hostname
+        if host not in self.buckets:
+            rate = settings.HOST_RATE_LIMITS.get(host, settings.DEFAULT_HOST_RATE_LIMIT)
+            self.buckets[host] = TokenBucket(rate) if rate else None
+        return self.buckets[host]
+
+    async def request_json(
+        self, url: str, params: dict, parse: Callable = None, immutable: bool = False
+    ):
+        """
+        发送请求 (限速、限制并发、失败退避重试；开启响应缓存时经过缓存，可直接使用的缓存不限速也不计入请求数)
+        :param url: 请求地址
+        :param params: 请求参数
+        :param parse: 解析返回 JSON 的函数 (解析出错同样重试，接口限流时可能返回错误信息)
+        :param immutable: 响应是否不可变
+        :return: 返回的 JSON，提供 parse 时为解析结果
+        """
+        loop = asyncio.get_running_loop()
+        if self.fetcher.cache is not None:
+            response = await loop.run_in_executor(
+                self.io_executor, lambda: self.fetcher.cache.lookup(url, params)
+            )
+            if response is not None:
+                try:
+                    data = response.json()
+                    if parse is not None:
+                        data = parse(data)
+                    self.stats["cache_hits"] += 1
+                    self.telemetry.inc("http_cache_hits_total")
+                    return data
+                except Exception:
+                    # 缓存的响应无法解析时删除，重新请求
+                    self.fetcher.cache.delete(url, params)
+        bucket = self.get_bucket(url)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+            await self.limiter.acquire()
+            self.telemetry.set_gauge("in_flight_requests", self.limiter.in_flight)
+            started_at = time.monotonic()
+            try:
+                self.stats["requests"] += 1
+                self.telemetry.inc("http_requests_total")
+                response = await loop.run_in_executor(
+                    self.io_executor,
+                    lambda: self.fetcher.request(url, params, immutable),
+                )
+                self.telemetry.observe(
+                    "stage_seconds", time.monotonic() - started_at, stage="page_load"
+                )
+                response.raise_for_status()
+                data = response.json()
+                if parse is not None:
+                    data = parse(data)
+            except Exception as e:
+                if self.fetcher.cache is not None:
+                    self.fetcher.cache.delete(url, params)
+                await self.limiter.release(error=True)
+                self.telemetry.inc("http_errors_total")
+                self.telemetry.set_gauge("concurrency_limit", int(self.limiter.limit))
+                if attempt >= settings.ASYNC_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    "请求失败，"
+                    + str(round(delay, 2))
+                    + "秒后重试，地址："
+                    + url
+                    + "，参数："
+                    + str(params)
+                    + "，错误信息："
+                    + str(e)
+                )
+                attempt += 1
+                self.stats["retries"] += 1
+                self.telemetry.inc("http_retries_total")
+                await asyncio.sleep(delay)
+                continue
+            await self.limiter.release(latency=time.monotonic() - started_at)
+            self.telemetry.set_gauge("in_flight_requests", self.limiter.in_flight)
+            self.telemetry.set_gauge("concurrency_limit", int(self.limiter.limit))
+            return data
+
+    async def fetch_page(self, fund_code: str, page_index: int, window: tuple = None):
+        """
+        获取单页净值数据
+        :param fund_code: 基金代码
+        :param page_index: 页码 (从1开始)
+        :param window: 交易日区间 (起始日, 结束日, 是否不可变)，None 表示不限
+        :return: (净值原始字典列表, 总页数)
+        """
+
+        def parse(data: dict):
+            with self.telemetry.timer("parse"):
+                net_value_obj_list, total_pages = self.fetcher.parse_page(
+                    fund_code, data
+                )
+            self.telemetry.inc("rows_total", len(net_value_obj_list), stage="parse")
+            return net_value_obj_list, total_pages
+
+        return await self.request_json(
+            self.fetcher.base_url,
+            self.fetcher.page_params(fund_code, page_index, window),
+            parse,
+            window is not None and window[2],
+        )
+
+    async def fetch_window(self, fund_code: str, window: tuple = None) -> list:
+        """
+        获取区间内的全部净值数据 (首页获取总页数后其余页并发获取)
+        :param fund_code: 基金代码
+        :param window: 交易日区间 (起始日, 结束日, 是否不可变)，None 表示不限
+        :return: 净值原始字典列表 (按交易日倒序)
+        """
+        net_value_obj_list, total_pages = await self.fetch_page(fund_code, 1, window)
+        page_results = await asyncio.gather(
+            *[
+                self.fetch_page(fund_code, page_index, window)
+                for page_index in range(2, total_pages + 1)
+            ]
+        )
+        for page_net_value_obj_list, _ in page_results:
+            net_value_obj_list.extend(page_net_value_obj_list)
+        return net_value_obj_list
+
+    async def fetch_fund(self, fund_code: str, since: str = None) -> list:
+        """
+        获取单个基金的净值数据：
+        全量时并发获取全部分页 (开启响应缓存时按自然年区间获取，已结束年份的区间命中缓存)，
+        增量时逐页获取直到已存储的交易日
+        :param fund_code: 基金代码
+        :param since: 已存储的最新交易日，None 表示全量
+        :return: 净值原始字典列表 (按交易日倒序)
+        """
+        if since is None and self.fetcher.cache is None:
+            return await self.fetch_window(fund_code)
+
+        net_value_obj_list, total_pages = await self.fetch_page(fund_code, 1)
+        if since is None:
+            if total_pages <= 1:
+                return net_value_obj_list
+            first_net_value_obj_list, _ = await self.fetch_page(fund_code, total_pages)
+            if not net_value_obj_list or not first_net_value_obj_list:
+                # 首页或末页的净值全部为空时无法确定起止交易日，按页码获取
+                return await self.fetch_window(fund_code)
+            window_results = await asyncio.gather(
+                *[
+                    self.fetch_window(fund_code, window)
+                    for window in year_windows(
+                        first_net_value_obj_list[-1]["trading_day"],
+                        net_value_obj_list[0]["trading_day"],
+                    )
+                ]
+            )
+            return [
+                net_value_obj
+                for window_net_value_obj_list in window_results
+                for net_value_obj in window_net_value_obj_list
+            ]
+
+        page_index = 1
+        new_net_value_obj_list = []
+        while True:
+            for net_value_obj in net_value_obj_list:
+                if net_value_obj["trading_day"] <= since:
+                    return new_net_value_obj_list
+                new_net_value_obj_list.append(net_value_obj)
+            page_index += 1
+            if page_index > total_pages:
+                return new_net_value_obj_list
+            net_value_obj_list, total_pages = await self.fetch_page(
+                fund_code, page_index
+            )
+
+    async def crawl_fund(
+        self, fund_code: str, fund_name: str, since: str = None, history_df=None
+    ) -> Optional[dict]:
+        """
+        爬取单个基金并交给进程池处理
+        :param fund_code: 基金代码
+        :param fund_name: 基金名称
+        :param since: 已存储的最新交易日
+        :param history_df: 已存储的净值数据
+        :return: 处理结果，失败时只包含基金代码与错误信息，没有新数据时只包含基金代码与最新交易日
+        """
+        logger.info("开始爬取基金产品净值，基金代码：" + fund_code)
+        try:
+            with self.telemetry.timer("fetch"):
+                net_value_obj_list = await self.fetch_fund(fund_code, since)
+        except Exception as e:
+            self.stats["failed_funds"] += 1
+            logger.error("爬取基金产品净值失败，基金代码：" + fund_code + "，错误信息：" + str(e))
+            return {"fund_code": fund_code, "error": str(e)}
+        if since is not None and not net_value_obj_list:
+            logger.info("没有新的净值数据，基金代码：" + fund_code)
+            return {"fund_code": fund_code, "last_trading_day": since}
+        self.telemetry.add_gauge("process_queue_depth", 1)
+        process_executor = self.process_executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                process_executor,
+                self.process_func,
+                fund_code,
+                fund_name,
+                net_value_obj_list,
+                since,
+                history_df,
+            )
+        except Exception as e:
+            # 进程池损坏、参数或结果无法序列化等，与获取失败一样只让该基金失败，由任务账本重试
+            self.stats["failed_funds"] += 1
+            logger.error("处理基金产品净值失败，基金代码：" + fund_code + "，错误信息：" + repr(e))
+            if isinstance(e, BrokenProcessPool):
+                self.replace_process_executor(process_executor)
+            return {"fund_code": fund_code, "error": repr(e)}
+        finally:
+            self.telemetry.add_gauge("process_queue_depth", -1)
+
+    def replace_process_executor(self, broken_executor: Executor):
+        """
+        重建损坏的进程池 (损坏时在途的基金均已返回失败；多个基金同时发现损坏时只重建一次)
+        :param broken_executor: 损坏的进程池
+        :return:
+        """
+        if (
+            broken_executor is not self.process_executor
+            or self.executor_factory is None
+        ):
+            return
+        logger.warning("处理净值数据的进程池已损坏，重建进程池")
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self.process_executor = self.executor_factory()
+
+    async def run(self, tasks: Iterable[tuple], write_result: Callable):
+        """
+        调度全部基金 (同时处理 settings.ASYNC_MAX_FUNDS 个基金，结果 (包括失败) 逐个交给 write_result)
+        :param tasks: (基金代码, 基金名称, 已存储的最新交易日, 已存储的净值数据) 迭代器
+        :param write_result: 结果写出函数
+        :return:
+        """
+        self.limiter = AdaptiveConcurrencyLimiter(
+            settings.ASYNC_INITIAL_CONCURRENCY,
+            settings.ASYNC_MIN_CONCURRENCY,
+            settings.ASYNC_MAX_CONCURRENCY,
+            settings.ASYNC_LATENCY_SPIKE_RATIO,
+            settings.ASYNC_DECREASE_COOLDOWN,
+        )
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_MAX_CONCURRENCY
+        )
+        tasks = iter(tasks)
+
+        async def worker():
+            # 各协程共享同一个任务迭代器，取任务时不会切换协程
+            for task in tasks:
+                result = await self.crawl_fund(*task)
+                try:
+                    write_result(result)
+                except Exception as e:
+                    # 写出失败时记为该基金失败，不中断其他基金
+                    logger.error(
+                        "写出基金结果失败，基金代码：" + result["fund_code"] + "，错误信息：" + repr(e)
+                    )
+                    self.stats["failed_funds"] += 1
+                    write_result({"fund_code": result["fund_code"], "error": repr(e)})
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(settings.ASYNC_MAX_FUNDS)])
+        finally:
+            self.io_executor.shutdown(wait=True)
+            self.fetcher.close()
+        logger.info(
+            "调度完成，请求数："
+            + str(self.stats["requests"])
+            + "，缓存命中数："
+            + str(self.stats["cache_hits"])
+            + "，重试数："
+            + str(self.stats["retries"])
+            + "，失败基金数："
+            + str(self.stats["failed_funds"])
+            + "，最终并发上限："
+            + str(int(self.limiter.limit))
+        )
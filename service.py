@@ -1,29 +1,55 @@
-from typing import List, Tuple, Any
-
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromiumService
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.utils import ChromeType
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from datetime import datetime
-from multiprocessing import Process, Manager, Pool
+from typing import List, Tuple, Any, Optional
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool, Process, get_context
+from multiprocessing.util import Finalize
+import asyncio
+import os
+import shutil
+import time
 import traceback
 import pandas as pd
 import numpy as np
 from decimal import Decimal
 
 import settings
-from logger import logger
-from format import net_value_formatter, net_value_to_dict, get_calc_year_cols_sequence
-from model import Database, bulk_add, NetValue
-
-
-pd.set_option("display.max_columns", None)
-pd.set_option("display.max_rows", None)
-pd.set_option("max_colwidth", None)
-pd.set_option("display.width", 1000)
+from logger import logger, init_logger
+from fetcher import create_chrome, create_fetcher
+from discovery import discover_fund_codes
+from scheduler import AsyncCrawlScheduler
+from ledger import JobLedger
+from telemetry import get_telemetry, measure, reset_telemetry
+from workqueue import LeaseHeartbeat, create_work_queue, make_worker_id
+from format import (
+    net_values_to_array,
+    net_values_to_frame,
+    net_values_to_rows,
+    frame_to_net_values,
+    get_calc_year_cols_sequence,
+)
+from calcstate import get_calc_state_store
+from navstore import get_nav_store
+from metrics import (
+    add_adjusted_nav,
+    build_calc_state,
+    update_calc_state,
+    calc_state_results,
+    calc_batch,
+    calc_trailing,
+    calc_rolling_series,
+    update_drawdown_state,
+    YEAR_DATA_COLS,
+)
+from store import (
+    NET_VALUE_COLS,
+    load_net_value_csv,
+    load_net_value_history,
+    append_pickle,
+    iter_pickles,
+    load_latest_trading_days,
+    merge_net_value,
+    ResultSink,
+)
 
 
 class Crawler(object):
@@ -33,6 +59,7 @@ class Crawler(object):
 
     def __init__(self):
         self.chrome = None
+        self.fetcher = None
         self.db = None
         self.config()
 
@@ -42,177 +69,372 @@ class Crawler(object):
         :return:
         """
 
-        # 初始化浏览器驱动器
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-gpu")
-        self.chrome = webdriver.Chrome(
-            options=options,
-            service=ChromiumService(
-                ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
-            ),
-        )
+        # 初始化净值数据获取器 (SELENIUM 类型需要浏览器驱动器)
+        if settings.FETCHER_TYPE == "SELENIUM":
+            self.chrome = create_chrome()
+        self.fetcher = create_fetcher(self.chrome)
 
         if settings.STORE_TYPE == "MYSQL":
+            from model import Database
+
             # 初始化数据库连接
             self.db = Database(settings.MYSQL_URL)
-            self.db.connect()
+            self.db.connect(settings.MYSQL_POOL_SIZE, settings.MYSQL_POOL_RECYCLE)
             self.db.create_tables()
-        elif settings.STORE_TYPE != "CSV":
-            raise Exception("STORE_TYPE must be MYSQL or CSV")
+        elif settings.STORE_TYPE not in ("CSV", "PARQUET"):
+            raise Exception("STORE_TYPE must be MYSQL, CSV or PARQUET")
 
     def get_fund_codes(self) -> list[tuple[Any, Any]]:
         """
-        获取产品代码列表
+        获取产品代码列表 (并发翻页获取完整基金列表，按配置过滤，结果带有效期缓存)
         :return: 产品列表
         """
-        self.chrome.get("http://fund.eastmoney.com/fund.html#os_0;isall_0;ft_;pt_1")
-        fund_tr_list = self.chrome.find_elements(
-            By.CSS_SELECTOR, "#oTable > tbody > tr"
-        )
-        fund_code_list = []
-        for fund_tr in fund_tr_list:
-            fund_code = fund_tr.find_element(By.CSS_SELECTOR, "td.bzdm").text
-            fund_name = fund_tr.find_element(
-                By.CSS_SELECTOR, "td.tol > nobr > a:nth-child(1)"
-            ).text
-            fund_code_list.append((fund_code, fund_name))
-        return fund_code_list[: settings.MAX_FUND_NUM]
+        return discover_fund_codes()
 
-    def get_net_value(self, fund_code: str) -> list[NetValue]:
+    def get_net_value(
+        self, fund_code: str, since: str = None, timings: dict = None
+    ) -> np.ndarray:
         """
         获取净值数据
         :param fund_code: 基金代码
-        :return: 净值字典列表
+        :param since: 已存储的最新交易日，只获取更新的净值 (None 表示全量)
+        :param timings: 各阶段耗时 (获取、格式化)，None 表示不记录
+        :return: 净值结构化数组 (format.NET_VALUE_DTYPE)
         """
-        self.chrome.get("http://fundf10.eastmoney.com/jjjz_" + fund_code + ".html")
+        with measure(timings, "fetch"):
+            net_value_obj_list = list(self.fetcher.fetch(fund_code, since))
+        with measure(timings, "format"):
+            return net_values_to_array(net_value_obj_list)
 
-        net_value_obj_list = []
-        is_last_page = False
+    def save_net_value(self, fund_code: str, net_values: np.ndarray) -> Any:
+        """
+        存储净值数据
+        :param fund_code: 基金代码
+        :param net_values: 净值结构化数组
+        :return: CSV / PARQUET 类型返回待主进程写出的净值数据
+        """
+        if settings.STORE_TYPE == "MYSQL":
+            from model import bulk_upsert
 
-        while not is_last_page:
-            try:
-                WebDriverWait(self.chrome, 10).until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "#jztable > table > tbody > tr")
-                    )
-                )
-            except Exception as e:
-                logger.warning("获取净值数据失败，基金代码：" + fund_code)
-                logger.error(e)
-                logger.error(traceback.format_exc())
-                return []
-            net_value_tr_list = self.chrome.find_elements(
-                By.CSS_SELECTOR, "#jztable > table > tbody > tr"
+            bulk_upsert(
+                self.db.engine,
+                net_values_to_rows(fund_code, net_values),
+                settings.MYSQL_BATCH_SIZE,
             )
+        elif settings.STORE_TYPE in ("CSV", "PARQUET"):
+            return net_values_to_frame(fund_code, net_values)
+        else:
+            raise Exception("不支持的存储类型")
 
-            for net_value_tr in net_value_tr_list:
-                net_value_obj = {"fund_code": fund_code}
-                trading_day_str = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(1)"
-                ).text
-                net_value_obj["trading_day"] = datetime.strptime(
-                    trading_day_str, "%Y-%m-%d"
-                ).strftime("%Y%m%d")
-                net_value_obj["unit_net_value"] = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(2)"
-                ).text
-                net_value_obj["cumulative_net_value"] = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(3)"
-                ).text
-                if (
-                    net_value_obj["unit_net_value"] == ""
-                    or net_value_obj["cumulative_net_value"] == ""
-                ):
-                    continue
-                daily_growth_rate = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(4)"
-                ).text
-                net_value_obj["daily_growth_rate"] = (
-                    daily_growth_rate if daily_growth_rate != "--" else "0"
-                )
-                purchase_status = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(5)"
-                ).text
-                purchase_status = purchase_status.strip()
+    def close(self):
+        """
+        释放浏览器、获取器与数据库连接
+        :return:
+        """
+        if self.fetcher is not None:
+            self.fetcher.close()
+        if self.chrome is not None:
+            self.chrome.quit()
+        if self.db is not None:
+            self.db.disconnect()
 
-                net_value_obj["purchase_status"] = purchase_status
 
-                redeem_status = net_value_tr.find_element(
-                    By.CSS_SELECTOR, "td:nth-child(6)"
-                ).text
-                redeem_status = redeem_status.strip()
+# 工作进程内常驻的爬虫实例 (浏览器、数据库连接在进程内只初始化一次)
+_worker_crawler = None
+# 常驻爬虫实例已处理的基金数量
+_worker_crawler_tasks = 0
 
-                net_value_obj["redeem_status"] = redeem_status
-                net_value_obj_list.append(net_value_formatter(net_value_obj))
 
-            page_btns = self.chrome.find_elements(
-                By.CSS_SELECTOR, "#pagebar > div.pagebtns > label"
-            )
-            next_page_btn = page_btns[-1]
-            class_attribute = next_page_btn.get_attribute("class")
-            is_last_page = "end" in class_attribute.split()
-            if not is_last_page:
-                next_page_btn.click()
-        return net_value_obj_list
+def init_worker():
+    """
+    进程池工作进程初始化：创建常驻爬虫实例，并在进程退出时释放
+    :return:
+    """
+    get_worker_crawler()
+    Finalize(None, recycle_worker_crawler, exitpriority=10)
 
-    def save_net_value(self, net_value_obj_list) -> Any:
-        """
-        存储净值数据
-        :param net_value_obj_list: 净值字典列表
-        :return: Any
-        """
-        if settings.STORE_TYPE == "MYSQL":
-            bulk_add(self.db.Session(), net_value_obj_list)
-        elif settings.STORE_TYPE == "CSV":
-            net_value_csv_list = [
-                net_value_to_dict(net_val_obj) for net_val_obj in net_value_obj_list
-            ]
-            df = pd.DataFrame(net_value_csv_list)
-            df.drop("_sa_instance_state", axis=1, inplace=True)
-            return df
-        else:
-            raise Exception("不支持的存储类型")
+
+def get_worker_crawler() -> Crawler:
+    """
+    获取当前进程的常驻爬虫实例，处理基金数量达到 settings.CRAWLER_RECYCLE_NUM 后重建
+    :return: 爬虫实例
+    """
+    global _worker_crawler, _worker_crawler_tasks
+    if (
+        _worker_crawler is not None
+        and _worker_crawler_tasks >= settings.CRAWLER_RECYCLE_NUM
+    ):
+        logger.info("常驻爬虫实例已处理" + str(_worker_crawler_tasks) + "个基金，重建实例")
+        recycle_worker_crawler()
+    if _worker_crawler is None:
+        _worker_crawler = Crawler()
+        _worker_crawler_tasks = 0
+    _worker_crawler_tasks += 1
+    return _worker_crawler
 
 
-def crawl(fund_code: str, fund_name: str, df_dict: dict):
+def recycle_worker_crawler():
+    """
+    释放当前进程的常驻爬虫实例 (出错或达到处理上限时调用，下次使用时重建)
+    :return:
+    """
+    global _worker_crawler, _worker_crawler_tasks
+    if _worker_crawler is None:
+        return
+    try:
+        _worker_crawler.close()
+    except Exception as e:
+        logger.warning("释放爬虫实例失败，错误信息：" + str(e))
+    _worker_crawler = None
+    _worker_crawler_tasks = 0
+
+
+def crawl(
+    fund_code: str,
+    fund_name: str,
+    since: str = None,
+    history_df: pd.DataFrame = None,
+) -> Optional[dict]:
     """
     单个基金产品净值爬虫
-    :param df_dict: 多进程中共享的字典
     :param fund_name: 基金名称
     :param fund_code: 基金代码
-    :return:
+    :param since: 已存储的最新交易日 (增量模式)，None 表示全量爬取
+    :param history_df: 已存储的净值数据 (增量模式，CSV类型由主进程传入)
+    :return: 爬取与计算结果，失败时只包含基金代码与错误信息，没有新数据时只包含基金代码与最新交易日
+    (均带有各阶段耗时 timings)
     """
-    crawler = Crawler()
+    crawler = get_worker_crawler()
+    timings = {}
     try:
-        logger.info("开始爬取基金产品净值，基金代码：" + fund_code)
-        net_value_list = crawler.get_net_value(fund_code)
-        net_value_df = crawler.save_net_value(net_value_list)
-        logger.info(
-            "爬取基金产品净值成功，基金代码：" + fund_code + "，净值数量：" + str(len(net_value_list)) + "条"
+        with measure(timings, "task"):
+            logger.info("开始爬取基金产品净值，基金代码：" + fund_code)
+            net_values = crawler.get_net_value(fund_code, since, timings)
+            result = process_net_value(
+                crawler, fund_code, fund_name, net_values, since, history_df, timings
+            )
+        result["rows"] = len(net_values)
+    except Exception as e:
+        logger.error("爬取基金产品净值失败，基金代码：" + fund_code + "，错误信息：" + str(e))
+        logger.error(traceback.format_exc())
+        # 出错后浏览器/连接可能已损坏，重建常驻爬虫实例
+        recycle_worker_crawler()
+        result = {"fund_code": fund_code, "error": str(e)}
+    timings["page_load"] = crawler.fetcher.pop_page_timings()
+    result["timings"] = timings
+    return result
+
+
+def process_net_value(
+    crawler: Crawler,
+    fund_code: str,
+    fund_name: str,
+    net_values: np.ndarray,
+    since: str = None,
+    history_df: pd.DataFrame = None,
+    timings: dict = None,
+) -> Optional[dict]:
+    """
+    存储已获取的净值数据并计算指标
+    :param crawler: 爬虫实例
+    :param fund_code: 基金代码
+    :param fund_name: 基金名称
+    :param net_values: 净值结构化数组
+    :param since: 已存储的最新交易日 (增量模式)，None 表示全量爬取
+    :param history_df: 已存储的净值数据 (增量模式，CSV类型由主进程传入)
+    :param timings: 各阶段耗时 (存储、读取历史、计算)，None 表示不记录
+    :return: 存储与计算结果，没有新数据时只包含基金代码与最新交易日
+    """
+    if since is not None and len(net_values) == 0:
+        logger.info("没有新的净值数据，基金代码：" + fund_code)
+        return {"fund_code": fund_code, "last_trading_day": since}
+    with measure(timings, "save"):
+        net_value_df = crawler.save_net_value(fund_code, net_values)
+    logger.info("爬取基金产品净值成功，基金代码：" + fund_code + "，净值数量：" + str(len(net_values)) + "条")
+    calc_df = (
+        net_value_df
+        if net_value_df is not None
+        else net_values_to_frame(fund_code, net_values)
+    )
+    new_df = calc_df
+    state_store = get_calc_state_store()
+    calc_state = None
+    nav_store = get_nav_store()
+    # 写入内存映射净值存储的记录 (存储中缺少该基金截至 since 的历史时写入完整历史)
+    nav_values = net_values
+    if since is not None:
+        if state_store is not None:
+            calc_state = state_store.get(fund_code, since)
+        has_nav_history = nav_store is not None and nav_store.has_history(
+            fund_code, since
         )
-        year_df, month_df = CalcService.calc(
-            pd.DataFrame(
-                [net_value_to_dict(net_val_obj) for net_val_obj in net_value_list]
-            ),
-            fund_code,
-            fund_name,
+        # 增量模式下近期区间指标使用完整历史计算
+        if history_df is None:
+            with measure(timings, "load_history"):
+                if has_nav_history:
+                    history_df = nav_store.get_frame(fund_code)
+                else:
+                    history_df = load_net_value_history(fund_code, crawler.db)
+        calc_df = merge_net_value(history_df, calc_df)
+        if not has_nav_history:
+            nav_values = frame_to_net_values(calc_df)
+    with measure(timings, "calc"):
+        if settings.CALC_NAV_TYPE == "ADJUSTED":
+            # 内存映射净值存储中的历史已有复权净值，只接续计算新增交易日
+            calc_df = add_adjusted_nav(calc_df)
+            new_df = calc_df[calc_df["trading_day"].isin(new_df["trading_day"])]
+        if state_store is None:
+            year_df, month_df = CalcService.calc(calc_df, fund_code, fund_name)
+        elif calc_state is not None:
+            # 年、月指标只用新增净值更新累积状态
+            year_df, month_df, calc_state = CalcService.calc_with_state(
+                new_df, fund_code, fund_name, calc_state
+            )
+        else:
+            year_df, month_df, calc_state = CalcService.calc_with_state(
+                calc_df, fund_code, fund_name
+            )
+        rolling_df, rolling_series_df = CalcService.calc_rolling(
+            calc_df, fund_code, fund_name
         )
+    if calc_state is not None:
+        with measure(timings, "save_state"):
+            state_store.put(fund_code, calc_state)
+
+    return {
+        "fund_code": fund_code,
+        "last_trading_day": str(calc_df["trading_day"].max()),
+        "year_df": year_df,
+        "month_df": month_df,
+        "rolling_df": rolling_df,
+        "rolling_series_df": rolling_series_df,
+        "net_value_df": net_value_df,
+        "nav_values": nav_values if nav_store is not None else None,
+    }
 
-        df_dict[fund_code] = {
-            "year_df": year_df,
-            "month_df": month_df,
-            "net_value_df": net_value_df,
-        }
 
+def process_task(
+    fund_code: str,
+    fund_name: str,
+    net_value_obj_list: list,
+    since: str = None,
+    history_df: pd.DataFrame = None,
+) -> Optional[dict]:
+    """
+    进程池任务入口 (asyncio 调度器获取净值后，在工作进程中格式化、存储并计算)
+    :param fund_code: 基金代码
+    :param fund_name: 基金名称
+    :param net_value_obj_list: 净值原始字典列表
+    :param since: 已存储的最新交易日
+    :param history_df: 已存储的净值数据
+    :return: 存储与计算结果，失败时只包含基金代码与错误信息 (均带有各阶段耗时 timings)
+    """
+    crawler = get_worker_crawler()
+    timings = {}
+    try:
+        with measure(timings, "task"):
+            with measure(timings, "format"):
+                net_values = net_values_to_array(net_value_obj_list)
+            result = process_net_value(
+                crawler, fund_code, fund_name, net_values, since, history_df, timings
+            )
+        result["rows"] = len(net_values)
     except Exception as e:
-        logger.error("爬取基金产品净值失败，基金代码：" + fund_code + "，错误信息：" + str(e))
+        logger.error("处理基金产品净值失败，基金代码：" + fund_code + "，错误信息：" + str(e))
         logger.error(traceback.format_exc())
+        recycle_worker_crawler()
+        result = {"fund_code": fund_code, "error": str(e)}
+    result["timings"] = timings
+    return result
+
+
+def crawl_task(args: tuple) -> Optional[dict]:
+    """
+    进程池任务入口 (imap_unordered 只能传递单个参数)
+    :param args: crawl 的参数元组
+    :return: crawl 的返回值
+    """
+    return crawl(*args)
+
+
+def get_part_path(worker_id: str) -> str:
+    """
+    获取工作进程的结果分片文件地址
+    :param worker_id: 工作进程编号
+    :return: 文件地址
+    """
+    return os.path.join(settings.WORK_PART_DIR, worker_id + ".rows")
+
+
+def run_worker(worker_id: str = None):
+    """
+    分布式工作进程：从任务队列租用基金，爬取并计算后把结果追加到自己的结果分片文件，
+    再向队列交回任务；队列中没有待处理、处理中的任务时退出
+    (MYSQL 类型的净值数据直接写入数据库，计算结果由协调进程汇总写出)
+    :param worker_id: 工作进程编号，None 时自动生成
+    :return:
+    """
+    init_logger()
+    worker_id = worker_id or make_worker_id()
+    logger.info("分布式工作进程启动，工作进程编号：" + worker_id)
+    telemetry = reset_telemetry()
+    queue = create_work_queue()
+    heartbeat = LeaseHeartbeat(worker_id, settings.WORK_LEASE_SECONDS)
+    heartbeat.start()
+    part_path = get_part_path(worker_id)
+    os.makedirs(settings.WORK_PART_DIR, exist_ok=True)
+    # CSV 类型增量模式需要的已存储净值数据 (首次用到时读取)
+    history_groups = None
+    fund_count = 0
+    try:
+        while True:
+            jobs = queue.lease(
+                worker_id, settings.WORK_LEASE_SIZE, settings.WORK_LEASE_SECONDS
+            )
+            if not jobs:
+                # 协调进程登记完任务前队列为空，需要等待
+                if queue.get_meta() is not None and queue.is_finished():
+                    break
+                time.sleep(settings.WORK_POLL_INTERVAL)
+                continue
+            heartbeat.fund_codes = [job["fund_code"] for job in jobs]
+            for job in jobs:
+                fund_code = job["fund_code"]
+                history_df = None
+                nav_store = get_nav_store()
+                if (
+                    job["since"] is not None
+                    and settings.STORE_TYPE == "CSV"
+                    and (
+                        nav_store is None
+                        or not nav_store.has_history(fund_code, job["since"])
+                    )
+                ):
+                    if history_groups is None:
+                        history_groups = dict(
+                            tuple(load_net_value_csv().groupby("fund_code"))
+                        )
+                    history_df = history_groups.get(fund_code)
+                result = crawl(fund_code, job["fund_name"], job["since"], history_df)
+                telemetry.record_result(result)
+                fund_count += 1
+                if result.get("error") is not None:
+                    queue.fail(worker_id, fund_code, result["error"])
+                    continue
+                has_result = result.get("year_df") is not None
+                if has_result:
+                    append_pickle(part_path, result)
+                if not queue.complete(
+                    worker_id, fund_code, result.get("last_trading_day"), has_result
+                ):
+                    logger.warning("任务租约已被其他工作进程接管，基金代码：" + fund_code)
+            heartbeat.fund_codes = []
     finally:
-        if settings.STORE_TYPE == "MYSQL":
-            crawler.db.disconnect()
-        crawler.chrome.quit()
+        heartbeat.stop()
+        queue.close()
+        recycle_worker_crawler()
+    logger.info("分布式工作进程退出，工作进程编号：" + worker_id + "，处理基金数量：" + str(fund_count) + "个")
+    logger.info(telemetry.stage_summary_line())
 
 
 class CrawlService(object):
@@ -221,70 +443,400 @@ class CrawlService(object):
 
     @staticmethod
     def run():
+        init_logger()
         logger.info("开始爬取基金产品净值")
+        telemetry = reset_telemetry()
+        telemetry.start_progress()
+        ledger = JobLedger()
+        run = ledger.get_unfinished_run() if settings.RESUME else None
         fund_crawler = Crawler()
 
-        fund_codes = fund_crawler.get_fund_codes()
-        logger.info("获取基金代码列表成功，基金数量：" + str(len(fund_codes)) + "个")
-        fund_crawler.chrome.quit()
+        if run is None:
+            with telemetry.timer("discover"):
+                fund_codes = fund_crawler.get_fund_codes()
+            logger.info("获取基金代码列表成功，基金数量：" + str(len(fund_codes)) + "个")
+            incremental = settings.INCREMENTAL
+            run_id = ledger.start_run(fund_codes, incremental)
+            resume_fund_codes = None
+        else:
+            # 继续上次中断的运行：基金列表与模式沿用台账记录，只处理未完成或失败的基金
+            run_id = run["run_id"]
+            incremental = run["incremental"]
+            resume_fund_codes = ledger.get_written_fund_codes(run_id)
+            logger.info(
+                "继续上次中断的运行，运行编号："
+                + str(run_id)
+                + "，已完成基金数量："
+                + str(len(ledger.get_jobs(run_id, (JobLedger.DONE,))))
+                + "个"
+            )
+
+        # 增量模式：读取每个基金已存储的最新交易日
+        latest_days = {}
+        history_groups = {}
+        if incremental:
+            if settings.STORE_TYPE == "CSV":
+                latest_days = load_latest_trading_days()
+                # 内存映射净值存储中已有完整历史的基金由工作进程直接读取，其余基金由主进程传入
+                nav_store = get_nav_store()
+                nav_days = (
+                    {} if nav_store is None else nav_store.get_latest_trading_days()
+                )
+                missing_codes = [
+                    fund_code
+                    for fund_code, trading_day in latest_days.items()
+                    if nav_days.get(fund_code) != trading_day
+                ]
+                if missing_codes:
+                    history_df = load_net_value_csv()
+                    history_df = history_df[history_df["fund_code"].isin(missing_codes)]
+                    history_groups = dict(tuple(history_df.groupby("fund_code")))
+                    del history_df
+            else:
+                latest_days = load_latest_trading_days(fund_crawler.db)
+            logger.info("增量模式，已存储基金数量：" + str(len(latest_days)) + "个")
+        fund_crawler.close()
 
-        with Manager() as manager:
-            df_dict = manager.dict()
+        def on_written(fund_code: str, last_trading_day: str):
+            # 结果已写出 (PARQUET 类型在攒批写出后)，记录为完成
+            history_groups.pop(fund_code, None)
+            ledger.mark_done(run_id, fund_code, last_trading_day, True)
 
-            pool = Pool(processes=settings.MAX_CONCURRENCY)
+        def write_result(result: dict):
+            telemetry.record_result(result)
+            fund_code = result["fund_code"]
+            if result.get("error") is not None:
+                ledger.mark_failed(run_id, fund_code, result["error"])
+            elif result.get("year_df") is None:
+                # 没有新的净值数据
+                history_groups.pop(fund_code, None)
+                ledger.mark_done(run_id, fund_code, result.get("last_trading_day"))
+            else:
+                with telemetry.timer("store"):
+                    sink.write(result)
 
-            # 执行工作进程函数
-            for fund_code, fund_name in fund_codes:
-                pool.apply_async(
-                    crawl,
-                    args=(
+        sink = ResultSink(incremental, resume_fund_codes, on_written)
+        try:
+            for attempt in range(settings.MAX_ATTEMPTS):
+                jobs = ledger.get_runnable_jobs(run_id, settings.MAX_ATTEMPTS)
+                if not jobs:
+                    break
+                if attempt > 0:
+                    logger.info("重试失败的基金，基金数量：" + str(len(jobs)) + "个")
+                ledger.mark_running(run_id, [fund_code for fund_code, _ in jobs])
+                telemetry.set_gauge("queue_depth", len(jobs))
+                tasks = (
+                    (
                         fund_code,
                         fund_name,
-                        df_dict,
-                    ),
+                        latest_days.get(fund_code),
+                        history_groups.get(fund_code),
+                    )
+                    for fund_code, fund_name in jobs
                 )
-            pool.close()
-            pool.join()
+                with telemetry.timer("crawl"):
+                    if settings.FETCHER_TYPE == "HTTP":
+                        CrawlService.run_async(tasks, write_result)
+                    else:
+                        CrawlService.run_pool(tasks, write_result)
+                # 本轮攒批的 PARQUET 净值写出后才记录为完成
+                with telemetry.timer("store"):
+                    sink.flush_net_value()
+        except BaseException:
+            # 中断时保留已写出与暂存的结果，下次运行继续未完成的基金
+            sink.flush_net_value()
+            ledger.close()
+            telemetry.stop_progress()
+            telemetry.write()
+            raise
+        with telemetry.timer("store_close"):
+            sink.close()
+        ledger.finish_run(run_id)
+        job_counts = ledger.count_jobs(run_id)
+        ledger.close()
+        logger.info(
+            "爬取基金产品净值完成，完成基金数量："
+            + str(job_counts.get(JobLedger.DONE, 0))
+            + "个，有结果的基金数量："
+            + str(len(sink.fund_codes))
+            + "个，失败基金数量："
+            + str(job_counts.get(JobLedger.FAILED, 0))
+            + "个"
+        )
+        if settings.QUALITY_CHECK_AFTER_CRAWL:
+            with telemetry.timer("quality"):
+                CrawlService.run_quality_check()
+        if settings.ANALYTICS_AFTER_CRAWL:
+            with telemetry.timer("analytics"):
+                CrawlService.run_analytics()
+        crawl_seconds = telemetry.get_summary_sum("stage_seconds", stage="crawl")
+        if crawl_seconds > 0:
+            telemetry.set_gauge(
+                "worker_utilization",
+                round(
+                    telemetry.get_summary_sum("stage_seconds", stage="task")
+                    / (settings.MAX_CONCURRENCY * crawl_seconds),
+                    4,
+                ),
+            )
+        telemetry.stop_progress()
+        logger.info(telemetry.stage_summary_line())
+        telemetry.write()
 
-            net_value_df = pd.DataFrame()
-            year_df = pd.DataFrame()
-            month_df = pd.DataFrame()
-            for fund_code, _df_dict in df_dict.items():
-                year_df = pd.concat([year_df, _df_dict["year_df"]], ignore_index=True)
-                month_df = pd.concat(
-                    [month_df, _df_dict["month_df"]], ignore_index=True
-                )
-                if _df_dict["net_value_df"] is not None:
-                    net_value_df = pd.concat(
-                        [net_value_df, _df_dict["net_value_df"]], ignore_index=True
-                    )
+    @staticmethod
+    def run_distributed(local_workers: int = None):
+        """
+        分布式协调进程：把基金登记到任务队列 (settings.WORK_QUEUE_URL)，可同时启动本机工作进程，
+        其他节点使用 run_worker 加入；全部任务完成后汇总各工作进程的结果分片，写出到存储
+        (上次运行未汇总即中断时，settings.RESUME = True 继续沿用队列中的任务与已写出的结果分片)
+        :param local_workers: 本机工作进程数量，None 时使用 settings.MAX_CONCURRENCY，0 表示只协调
+        :return:
+        """
+        init_logger()
+        logger.info("开始分布式爬取基金产品净值")
+        telemetry = reset_telemetry()
+        if local_workers is None:
+            local_workers = settings.MAX_CONCURRENCY
+        queue = create_work_queue()
+        ledger = JobLedger()
+        meta = queue.get_meta() if settings.RESUME else None
 
-            year_df = year_df.reindex(
-                columns=get_calc_year_cols_sequence(list(year_df.columns))
-            )
-            if settings.STORE_TYPE == "CSV":
-                net_value_df.to_csv(
-                    settings.CSV_READ_PATH,
-                    mode="w",
-                    header=True,
-                    index=False,
-                    encoding="utf-8-sig",
-                )
-            year_df.to_csv(
-                settings.CSV_WRITE_DIR + "/calc_year.csv",
-                mode="w",
-                header=True,
-                index=False,
-                encoding="utf-8-sig",
+        if meta is None or meta["merged"]:
+            fund_crawler = Crawler()
+            with telemetry.timer("discover"):
+                fund_codes = fund_crawler.get_fund_codes()
+            logger.info("获取基金代码列表成功，基金数量：" + str(len(fund_codes)) + "个")
+            incremental = settings.INCREMENTAL
+            latest_days = {}
+            if incremental:
+                latest_days = load_latest_trading_days(fund_crawler.db)
+                logger.info("增量模式，已存储基金数量：" + str(len(latest_days)) + "个")
+            fund_crawler.close()
+            run_id = ledger.start_run(fund_codes, incremental)
+            ledger.mark_running(run_id, [fund_code for fund_code, _ in fund_codes])
+            if os.path.exists(settings.WORK_PART_DIR):
+                shutil.rmtree(settings.WORK_PART_DIR)
+            # 先登记任务再写入运行信息，工作进程看到运行信息后才会因队列为空而退出
+            queue.reset()
+            queue.enqueue(
+                [
+                    (fund_code, fund_name, latest_days.get(fund_code))
+                    for fund_code, fund_name in fund_codes
+                ]
             )
-            month_df.to_csv(
-                settings.CSV_WRITE_DIR + "/calc_month.csv",
-                mode="w",
-                header=True,
-                index=False,
-                encoding="utf-8-sig",
+            queue.set_meta(
+                {"run_id": run_id, "incremental": incremental, "merged": False}
             )
-            logger.info("爬取基金产品净值完成")
+        else:
+            run_id = meta["run_id"]
+            incremental = meta["incremental"]
+            logger.info("继续上次未汇总的分布式运行，运行编号：" + str(run_id))
+
+        processes = []
+        try:
+            with telemetry.timer("crawl"):
+                for _ in range(local_workers):
+                    processes.append(Process(target=run_worker))
+                    processes[-1].start()
+                last_report = 0
+                while not queue.is_finished():
+                    time.sleep(settings.WORK_POLL_INTERVAL)
+                    # 异常退出的本机工作进程 (持有的任务租约到期后由其他工作进程接管) 重新启动
+                    for i, process in enumerate(processes):
+                        if not process.is_alive() and process.exitcode != 0:
+                            logger.warning(
+                                "本机工作进程异常退出，重新启动，退出码：" + str(process.exitcode)
+                            )
+                            processes[i] = Process(target=run_worker)
+                            processes[i].start()
+                    if (
+                        settings.PROGRESS_INTERVAL
+                        and time.time() - last_report >= settings.PROGRESS_INTERVAL
+                    ):
+                        last_report = time.time()
+                        counts = queue.count()
+                        telemetry.set_gauge(
+                            "queue_depth",
+                            counts.get(queue.PENDING, 0) + counts.get(queue.LEASED, 0),
+                        )
+                        logger.info(
+                            "分布式爬取进度：待处理"
+                            + str(counts.get(queue.PENDING, 0))
+                            + "个，处理中"
+                            + str(counts.get(queue.LEASED, 0))
+                            + "个，已完成"
+                            + str(counts.get(queue.DONE, 0))
+                            + "个，失败"
+                            + str(counts.get(queue.FAILED, 0))
+                            + "个"
+                        )
+                for process in processes:
+                    process.join()
+        except BaseException:
+            for process in processes:
+                process.terminate()
+            ledger.close()
+            queue.close()
+            raise
+        telemetry.set_gauge("queue_depth", 0)
+
+        with telemetry.timer("store"):
+            fund_codes = CrawlService.merge_parts(queue, ledger, run_id, incremental)
+        ledger.finish_run(run_id)
+        job_counts = ledger.count_jobs(run_id)
+        ledger.close()
+        queue.set_meta({"run_id": run_id, "incremental": incremental, "merged": True})
+        queue.close()
+        shutil.rmtree(settings.WORK_PART_DIR, ignore_errors=True)
+        logger.info(
+            "分布式爬取基金产品净值完成，完成基金数量："
+            + str(job_counts.get(JobLedger.DONE, 0))
+            + "个，有结果的基金数量："
+            + str(len(fund_codes))
+            + "个，失败基金数量："
+            + str(job_counts.get(JobLedger.FAILED, 0))
+            + "个"
+        )
+        if settings.QUALITY_CHECK_AFTER_CRAWL:
+            with telemetry.timer("quality"):
+                CrawlService.run_quality_check()
+        if settings.ANALYTICS_AFTER_CRAWL:
+            with telemetry.timer("analytics"):
+                CrawlService.run_analytics()
+        logger.info(telemetry.stage_summary_line())
+        telemetry.write()
+
+    @staticmethod
+    def run_quality_check():
+        """
+        爬取完成后检查缺失的交易日、补爬并写出数据质量报告，失败时只记录错误，不影响已写出的结果
+        :return:
+        """
+        from tradingcalendar import run_quality_check
+
+        try:
+            run_quality_check()
+        except Exception as e:
+            logger.error("数据质量检查失败，错误信息：" + str(e))
+            logger.error(traceback.format_exc())
+
+    @staticmethod
+    def run_analytics():
+        """
+        爬取完成后计算跨基金分析 (相关系数、协方差矩阵与同类排名)，失败时只记录错误，不影响已写出的结果
+        :return:
+        """
+        from analytics import run_analytics
+
+        try:
+            run_analytics()
+        except Exception as e:
+            logger.error("跨基金分析失败，错误信息：" + str(e))
+            logger.error(traceback.format_exc())
+
+    @staticmethod
+    def merge_parts(queue, ledger: JobLedger, run_id: int, incremental: bool) -> list:
+        """
+        汇总各工作进程的结果分片：只采用队列中记录的完成者写出的结果
+        (租约过期被接管的任务，原工作进程留下的结果不再采用)，并把任务状态同步到台账
+        :param queue: 任务队列
+        :param ledger: 任务台账
+        :param run_id: 运行编号
+        :param incremental: 是否增量模式
+        :return: 写出了结果的基金代码列表
+        """
+        telemetry = get_telemetry()
+        done = queue.get_done()
+        written_fund_codes = set()
+        sink = ResultSink(
+            incremental,
+            None,
+            lambda fund_code, last_trading_day: ledger.mark_done(
+                run_id, fund_code, last_trading_day, True
+            ),
+        )
+        if os.path.exists(settings.WORK_PART_DIR):
+            for file_name in sorted(os.listdir(settings.WORK_PART_DIR)):
+                if not file_name.endswith(".rows"):
+                    continue
+                worker_id = file_name[: -len(".rows")]
+                for result in iter_pickles(
+                    os.path.join(settings.WORK_PART_DIR, file_name)
+                ):
+                    fund_code = result["fund_code"]
+                    if done.get(fund_code, (None,))[0] != worker_id:
+                        continue
+                    if fund_code in written_fund_codes:
+                        continue
+                    written_fund_codes.add(fund_code)
+                    telemetry.record_result(result)
+                    sink.write(result)
+            sink.flush_net_value()
+        for fund_code, (_, last_trading_day, has_result) in done.items():
+            if not has_result:
+                telemetry.record_result({"fund_code": fund_code})
+                ledger.mark_done(run_id, fund_code, last_trading_day)
+            elif fund_code not in written_fund_codes:
+                ledger.mark_failed(run_id, fund_code, "结果分片中没有该基金的结果")
+        for fund_code, error in queue.get_failed().items():
+            telemetry.record_result({"fund_code": fund_code, "error": error})
+            ledger.mark_failed(run_id, fund_code, error)
+        sink.close()
+        return sink.fund_codes
+
+    @staticmethod
+    def run_async(tasks, write_result):
+        """
+        HTTP 类型：asyncio 调度器在主进程中并发请求，工作进程格式化、存储并计算
+        :param tasks: crawl 的参数元组迭代器
+        :param write_result: 结果处理函数
+        :return:
+        """
+        # 在调度器创建请求线程前启动全部工作进程：
+        # fork 时其他线程可能正持有锁 (如缓存的数据库连接)，子进程中会一直处于加锁状态；
+        # 运行中进程池损坏后重建时请求线程已在运行，改由 forkserver 进程创建工作进程
+        scheduler = AsyncCrawlScheduler(
+            CrawlService.create_process_executor(),
+            process_task,
+            lambda: CrawlService.create_process_executor(get_context("forkserver")),
+        )
+        try:
+            asyncio.run(scheduler.run(tasks, write_result))
+        finally:
+            scheduler.process_executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def create_process_executor(mp_context=None) -> ProcessPoolExecutor:
+        """
+        创建处理净值数据的进程池，并启动全部工作进程
+        :param mp_context: 创建工作进程的方式，None 表示默认
+        :return: 进程池
+        """
+        executor = ProcessPoolExecutor(
+            max_workers=settings.MAX_CONCURRENCY,
+            initializer=init_worker,
+            mp_context=mp_context,
+        )
+        executor.submit(os.getpid).result()
+        return executor
+
+    @staticmethod
+    def run_pool(tasks, write_result):
+        """
+        SELENIUM 类型：每个工作进程常驻一个浏览器，逐个基金爬取并计算
+        :param tasks: crawl 的参数元组迭代器
+        :param write_result: 结果处理函数
+        :return:
+        """
+        pool = Pool(processes=settings.MAX_CONCURRENCY, initializer=init_worker)
+        try:
+            # 工作进程完成一个基金即交回结果，逐个写出，不在内存中累积
+            for result in pool.imap_unordered(crawl_task, tasks):
+                write_result(result)
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
 
 
 class CalcService(object):
@@ -300,8 +852,90 @@ class CalcService(object):
         :param df: 净值数据
         :return:
         """
-        df = df.drop("_sa_instance_state", axis="columns")
-        df["cumulative_net_value"] = df["cumulative_net_value"].apply(Decimal)
+        if settings.CALC_EXACT_DECIMAL:
+            return CalcService.calc_exact(df, fund_code, fund_name)
+        df = df.assign(fund_code=fund_code)
+        return calc_batch(df, {fund_code: fund_name})
+
+    @staticmethod
+    def calc_with_state(
+        df: pd.DataFrame, fund_code: str, fund_name: str, state: dict = None
+    ):
+        """
+        通过指标累积状态计算年、月指标 (结果与 calc 一致)
+        :param df: 净值数据 (state 为空时为完整历史，否则为新增净值)
+        :param fund_code: 基金代码
+        :param fund_name: 基金名称
+        :param state: 已存储的累积状态，None 表示由完整历史建立
+        :return: (年计算结果, 月计算结果, 更新后的累积状态)
+        """
+        df = df.assign(fund_code=fund_code)
+        if state is None:
+            state = build_calc_state(df)[fund_code]
+        else:
+            state = update_calc_state(state, df)
+        year_df, month_df = calc_state_results(
+            {fund_code: state}, {fund_code: fund_name}
+        )
+        return year_df, month_df, state
+
+    @staticmethod
+    def calc_batch(df: pd.DataFrame, fund_names: dict):
+        """
+        批量计算多个基金的指标
+        :param df: 长表格式的净值数据 (包含 fund_code 列)
+        :param fund_names: {基金代码: 基金名称}
+        :return: (年计算结果, 月计算结果)
+        """
+        if not settings.CALC_EXACT_DECIMAL:
+            return calc_batch(df, fund_names)
+        year_df_list = []
+        month_df_list = []
+        for fund_code, group_df in df.groupby("fund_code"):
+            year_df, month_df = CalcService.calc_exact(
+                group_df, fund_code, fund_names.get(fund_code)
+            )
+            year_df_list.append(year_df)
+            month_df_list.append(month_df)
+        year_df = pd.concat(year_df_list, ignore_index=True)
+        year_df = year_df.reindex(
+            columns=get_calc_year_cols_sequence(list(year_df.columns))
+        )
+        return year_df, pd.concat(month_df_list, ignore_index=True)
+
+    @staticmethod
+    def calc_rolling(df: pd.DataFrame, fund_code: str, fund_name: str):
+        """
+        计算近期区间指标与滚动窗口序列
+        :param fund_name: 基金名称
+        :param fund_code: 基金代码
+        :param df: 净值数据
+        :return: (近期区间指标, 滚动窗口序列)，未开启 settings.ROLLING_SERIES_OUTPUT 时序列为 None
+        """
+        df = df.assign(fund_code=fund_code)
+        rolling_df = calc_trailing(df, {fund_code: fund_name})
+        rolling_series_df = None
+        if settings.ROLLING_SERIES_OUTPUT:
+            rolling_series_df = calc_rolling_series(df, settings.ROLLING_WINDOW)
+        return rolling_df, rolling_series_df
+
+    @staticmethod
+    def calc_exact(df: pd.DataFrame, fund_code: str, fund_name: str):
+        """
+        使用 Decimal 逐个时间段精确计算指标 (用于对账)
+        :param fund_name: 基金名称
+        :param fund_code: 基金代码
+        :param df: 净值数据
+        :return:
+        """
+        df = df.copy()
+        if settings.CALC_NAV_TYPE == "ADJUSTED":
+            # 复权净值口径：以下计算使用复权净值代替累计净值
+            df = add_adjusted_nav(df)
+            df["cumulative_net_value"] = df["adjusted_net_value"]
+        df["cumulative_net_value"] = (
+            df["cumulative_net_value"].astype(str).apply(Decimal)
+        )
         df["trading_day"] = pd.to_datetime(df["trading_day"], format="%Y%m%d")
         df = df.sort_values(by="trading_day", ascending=True)
         df = df.reset_index(drop=True)
@@ -316,13 +950,7 @@ class CalcService(object):
         year_cols = df["year"].unique().tolist()
 
         # 获取年份数据列
-        year_data_cols = [
-            "total_return",
-            "annual_return_ratio",
-            "annual_volatility",
-            "sharpe",
-            "maximum_drawdown",
-        ]
+        year_data_cols = YEAR_DATA_COLS
 
         # 年类型数据列
         year_all_cols = (
@@ -378,7 +1006,7 @@ class CalcService(object):
         # 夏普比率
         sharpe = CalcService.calc_sharpe(annual_return_ratio, annual_volatility)
         # 最大回撤
-        maximum_drawdown = CalcService.calc_maximum_drawdown(df)
+        drawdown_dict = CalcService.calc_drawdown(df)
         # 月收益
         monthly_return = CalcService.calc_monthly_return(df)
 
@@ -387,7 +1015,10 @@ class CalcService(object):
             "annual_return_ratio": annual_return_ratio,
             "annual_volatility": annual_volatility,
             "sharpe": sharpe,
-            "maximum_drawdown": maximum_drawdown,
+            "maximum_drawdown": drawdown_dict["maximum_drawdown"],
+            "maximum_drawdown_peak_day": drawdown_dict["peak_day"],
+            "maximum_drawdown_trough_day": drawdown_dict["trough_day"],
+            "maximum_drawdown_recovery_day": drawdown_dict["recovery_day"],
             "monthly_return": monthly_return if is_year else None,
         }
 
@@ -398,6 +1029,12 @@ class CalcService(object):
         :param df: 净值数据
         :return:
         """
+        if settings.CALC_NAV_TYPE == "ADJUSTED":
+            total_return = (
+                df["cumulative_net_value"].iloc[-1] / df["cumulative_net_value"].iloc[0]
+                - 1
+            )
+            return total_return.quantize(Decimal("0.0000"))
         total_return = (
             df["cumulative_net_value"].iloc[-1] - df["cumulative_net_value"].iloc[0]
         )
@@ -463,11 +1100,33 @@ class CalcService(object):
         :param df: 净值数据
         :return:
         """
+        return CalcService.calc_drawdown(df)["maximum_drawdown"]
 
-        maximum_drawdown = (
-            df["cumulative_net_value"].max() - df["cumulative_net_value"].min()
-        ) / df["cumulative_net_value"].max()
-        return maximum_drawdown.quantize(Decimal("0.0000"))
+    @staticmethod
+    def calc_drawdown(df: pd.DataFrame) -> dict:
+        """
+        按运行峰值计算最大回撤及其峰值日、谷底日、恢复日
+        :param df: 净值数据 (按交易日升序)
+        :return:
+        """
+        trading_days = df["trading_day"].dt.strftime("%Y%m%d").tolist()
+        state = update_drawdown_state(
+            None, trading_days, df["cumulative_net_value"].tolist()
+        )
+        maximum_drawdown = Decimal(0)
+        if state["mdd_peak"] is not None:
+            # 使用 Decimal 重新计算，避免浮点误差
+            mdd_peak = Decimal(str(state["mdd_peak"]))
+            trough = df["cumulative_net_value"].iloc[
+                trading_days.index(state["mdd_trough_day"])
+            ]
+            maximum_drawdown = (mdd_peak - trough) / mdd_peak
+        return {
+            "maximum_drawdown": maximum_drawdown.quantize(Decimal("0.0000")),
+            "peak_day": state["mdd_peak_day"],
+            "trough_day": state["mdd_trough_day"],
+            "recovery_day": state["mdd_recovery_day"],
+        }
 
     @staticmethod
     def calc_annual_return(df: pd.DataFrame) -> Decimal:
@@ -495,9 +1154,16 @@ class CalcService(object):
         for month, group_df in df.groupby("month"):
             group_df.drop("month", axis=1, inplace=True)
             group_df.sort_values(by="trading_day", ascending=True, inplace=True)
-            month_dict[month] = (
-                group_df["cumulative_net_value"].iloc[-1]
-                - group_df["cumulative_net_value"].iloc[0]
-            )
+            if settings.CALC_NAV_TYPE == "ADJUSTED":
+                month_dict[month] = (
+                    group_df["cumulative_net_value"].iloc[-1]
+                    / group_df["cumulative_net_value"].iloc[0]
+                    - 1
+                )
+            else:
+                month_dict[month] = (
+                    group_df["cumulative_net_value"].iloc[-1]
+                    - group_df["cumulative_net_value"].iloc[0]
+                )
             month_dict[month] = month_dict[month].quantize(Decimal("0.0000"))
         return month_dict
@@ -0,0 +1,606 @@
+from typing import TYPE_CHECKING, Any, Iterator
+import os
+import pickle
+import shutil
+import uuid
+
+import pandas as pd
+
+import settings
+from format import get_calc_year_cols_sequence, parse_trading_days
+from metrics import TRAILING_COLS, ROLLING_SERIES_COLS
+from navstore import get_nav_store
+
+if TYPE_CHECKING:
+    # 数据库模型只在 MYSQL 存储类型下导入 (SQLAlchemy 导入较慢)
+    from model import Database
+
+
+# 净值数据列
+NET_VALUE_COLS = [
+    "fund_code",
+    "trading_day",
+    "unit_net_value",
+    "cumulative_net_value",
+    "daily_growth_rate",
+    "purchase_status",
+    "redeem_status",
+]
+
+# 计算结果的浮点数格式 (指标保留四位小数)
+CALC_FLOAT_FORMAT = "%.4f"
+
+# 净值数据的浮点数格式 (与数据库中净值、日增长率的精度一致)
+NET_VALUE_FLOAT_FORMAT = "%.4f"
+
+# 月计算结果列
+CALC_MONTH_COLS = ["fund_code", "fund_name", "year", "month", "return"]
+
+
+def load_net_value_csv() -> pd.DataFrame:
+    """
+    读取 CSV 中已存储的净值数据 (全部按字符串读取，保留基金代码前导零)
+    :return: 净值数据，文件不存在时返回空表
+    """
+    if not os.path.exists(settings.CSV_READ_PATH):
+        return pd.DataFrame(columns=NET_VALUE_COLS)
+    return pd.read_csv(settings.CSV_READ_PATH, dtype=str, encoding="utf-8-sig")
+
+
+def load_net_value_mysql(db: "Database", fund_code: str) -> pd.DataFrame:
+    """
+    读取 MYSQL 中单个基金已存储的净值数据
+    :param db: 数据库连接
+    :param fund_code: 基金代码
+    :return: 净值数据
+    """
+    from model import NetValue
+
+    session = db.Session()
+    try:
+        rows = (
+            session.query(*[getattr(NetValue, col) for col in NET_VALUE_COLS])
+            .filter(NetValue.fund_code == fund_code)
+            .all()
+        )
+    finally:
+        session.close()
+    return pd.DataFrame([tuple(row) for row in rows], columns=NET_VALUE_COLS)
+
+
+def import_pyarrow():
+    """
+    按需导入 pyarrow (仅 PARQUET 存储类型需要)
+    :return: (pyarrow, pyarrow.compute, pyarrow.dataset)
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+    except ImportError:
+        raise Exception("PARQUET 存储类型需要安装 pyarrow")
+    return pyarrow, pyarrow.compute, pyarrow.dataset
+
+
+def net_value_schema():
+    """
+    PARQUET 净值数据的列类型 (交易日为日期，净值为 float64，状态为 int8)
+    :return: pyarrow.Schema
+    """
+    pa, _, _ = import_pyarrow()
+    return pa.schema(
+        [
+            ("fund_code", pa.string()),
+            ("trading_day", pa.date32()),
+            ("unit_net_value", pa.float64()),
+            ("cumulative_net_value", pa.float64()),
+            ("daily_growth_rate", pa.float64()),
+            ("purchase_status", pa.int8()),
+            ("redeem_status", pa.int8()),
+            ("year", pa.int16()),
+        ]
+    )
+
+
+def append_net_value_parquet(df: pd.DataFrame, base_dir: str = None):
+    """
+    以追加方式写入 PARQUET 净值数据集
+    (按年分区，分区内按基金代码、交易日排序，读取单个基金时可按行组统计信息跳过无关数据)
+    :param df: 新增净值数据
+    :param base_dir: 数据集目录，默认 settings.PARQUET_DIR
+    :return:
+    """
+    pa, _, ds = import_pyarrow()
+    trading_day = parse_trading_days(df["trading_day"])
+    typed_df = pd.DataFrame(
+        {
+            "fund_code": df["fund_code"].astype(str).to_numpy(),
+            "trading_day": trading_day,
+            "unit_net_value": pd.to_numeric(df["unit_net_value"]).astype("float64"),
+            "cumulative_net_value": pd.to_numeric(df["cumulative_net_value"]).astype(
+                "float64"
+            ),
+            "daily_growth_rate": pd.to_numeric(df["daily_growth_rate"]).astype(
+                "float64"
+            ),
+            "purchase_status": pd.to_numeric(df["purchase_status"]).astype("int8"),
+            "redeem_status": pd.to_numeric(df["redeem_status"]).astype("int8"),
+            "year": (trading_day.astype("datetime64[Y]").astype("int64") + 1970).astype(
+                "int16"
+            ),
+        }
+    )
+    table = pa.Table.from_pandas(
+        typed_df, schema=net_value_schema(), preserve_index=False
+    ).sort_by(
+        [
+            ("year", "ascending"),
+            ("fund_code", "ascending"),
+            ("trading_day", "ascending"),
+        ]
+    )
+    ds.write_dataset(
+        table,
+        base_dir or settings.PARQUET_DIR,
+        format="parquet",
+        partitioning=["year"],
+        partitioning_flavor="hive",
+        basename_template="part-" + uuid.uuid4().hex + "-{i}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=settings.PARQUET_ROW_GROUP_SIZE,
+        min_rows_per_group=min(settings.PARQUET_ROW_GROUP_SIZE, len(typed_df)),
+    )
+
+
+def load_net_value_parquet(
+    fund_codes: list = None, years: list = None, columns: list = None, typed=False
+) -> pd.DataFrame:
+    """
+    读取 PARQUET 净值数据，基金代码与年份条件下推到数据集扫描
+    :param fund_codes: 基金代码列表，None 表示全部
+    :param years: 年份列表，None 表示全部
+    :param columns: 读取的列，None 表示全部净值列
+    :param typed: 交易日保留为 datetime64 (直接用于计算，省去字符串转换)
+    :return: 净值数据 (交易日默认为 YYYYMMDD 字符串)
+    """
+    pa, pc, ds = import_pyarrow()
+    columns = columns or NET_VALUE_COLS
+    if not os.path.exists(settings.PARQUET_DIR):
+        return pd.DataFrame(columns=columns)
+    dataset = ds.dataset(
+        settings.PARQUET_DIR,
+        format="parquet",
+        schema=net_value_schema(),
+        partitioning="hive",
+    )
+    condition = None
+    if fund_codes is not None:
+        condition = ds.field("fund_code").isin(fund_codes)
+    if years is not None:
+        year_condition = ds.field("year").isin(years)
+        condition = year_condition if condition is None else condition & year_condition
+    table = dataset.to_table(columns=columns, filter=condition)
+    if "trading_day" in columns and not typed:
+        # 按 年*10000+月*100+日 拼出 YYYYMMDD，比 strftime 快得多
+        trading_day = table.column("trading_day")
+        trading_day = pc.add(
+            pc.add(
+                pc.multiply(pc.year(trading_day), 10000),
+                pc.multiply(pc.month(trading_day), 100),
+            ),
+            pc.day(trading_day),
+        )
+        table = table.set_column(
+            table.schema.get_field_index("trading_day"),
+            "trading_day",
+            pc.cast(trading_day, pa.string()),
+        )
+    return table.to_pandas(date_as_object=False)
+
+
+def load_net_value_history(fund_code: str, db: "Database" = None) -> pd.DataFrame:
+    """
+    读取单个基金已存储的净值数据 (MYSQL / PARQUET 类型)
+    :param fund_code: 基金代码
+    :param db: 数据库连接 (MYSQL类型使用)
+    :return: 净值数据
+    """
+    if settings.STORE_TYPE == "MYSQL":
+        return load_net_value_mysql(db, fund_code)
+    elif settings.STORE_TYPE == "PARQUET":
+        return load_net_value_parquet([fund_code])
+    else:
+        raise Exception("不支持的存储类型")
+
+
+def load_latest_trading_days(db: "Database" = None, df: pd.DataFrame = None) -> dict:
+    """
+    获取每个基金已存储的最新交易日
+    :param db: 数据库连接 (MYSQL类型使用)
+    :param df: 已读取的净值数据 (CSV类型使用，为空时读取 settings.CSV_READ_PATH)
+    :return: {基金代码: 最新交易日 (YYYYMMDD)}
+    """
+    if settings.STORE_TYPE == "MYSQL":
+        from sqlalchemy import func
+        from model import NetValue
+
+        session = db.Session()
+        try:
+            rows = (
+                session.query(NetValue.fund_code, func.max(NetValue.trading_day))
+                .group_by(NetValue.fund_code)
+                .all()
+            )
+        finally:
+            session.close()
+        return {fund_code: trading_day for fund_code, trading_day in rows}
+    elif settings.STORE_TYPE == "CSV":
+        if df is None:
+            if not os.path.exists(settings.CSV_READ_PATH):
+                return {}
+            # 只读取基金代码与交易日两列
+            df = pd.read_csv(
+                settings.CSV_READ_PATH,
+                usecols=["fund_code", "trading_day"],
+                dtype=str,
+                encoding="utf-8-sig",
+            )
+        if df.empty:
+            return {}
+        return df.groupby("fund_code")["trading_day"].max().to_dict()
+    elif settings.STORE_TYPE == "PARQUET":
+        df = load_net_value_parquet(columns=["fund_code", "trading_day"])
+        if df.empty:
+            return {}
+        return df.groupby("fund_code")["trading_day"].max().to_dict()
+    else:
+        raise Exception("不支持的存储类型")
+
+
+def merge_net_value(history_df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    合并已存储净值与新爬取净值 (同一交易日以新数据为准)
+    :param history_df: 已存储的净值数据
+    :param new_df: 新爬取的净值数据
+    :return: 合并后的净值数据 (各列类型与新爬取的净值数据一致；已存储数据包含复权净值时保留该列，新数据为空)
+    """
+    # 已存储数据为字符串 (CSV) 或 Decimal (MYSQL)，统一转换为新数据的紧凑类型后合并
+    columns = NET_VALUE_COLS
+    if "adjusted_net_value" in history_df:
+        columns = NET_VALUE_COLS + ["adjusted_net_value"]
+    history_df = history_df[columns].astype(new_df[NET_VALUE_COLS].dtypes.to_dict())
+    df = pd.concat([history_df, new_df[NET_VALUE_COLS]], ignore_index=True)
+    df = df.drop_duplicates(subset=["trading_day"], keep="last")
+    return df.reset_index(drop=True)
+
+
+def append_csv(path: str, df: pd.DataFrame, columns: list, float_format=None):
+    """
+    追加数据到 CSV (文件不存在时写入表头)
+    :param path: 文件路径
+    :param df: 新增数据
+    :param columns: 列顺序
+    :param float_format: 浮点数格式
+    :return:
+    """
+    is_new_file = not os.path.exists(path)
+    df.reindex(columns=columns).to_csv(
+        path,
+        mode="a",
+        header=is_new_file,
+        index=False,
+        encoding="utf-8-sig",
+        float_format=float_format,
+    )
+
+
+def append_net_value_csv(df: pd.DataFrame):
+    """
+    追加净值数据到 CSV
+    :param df: 新增净值数据
+    :return:
+    """
+    append_csv(
+        settings.CSV_READ_PATH, df, NET_VALUE_COLS, float_format=NET_VALUE_FLOAT_FORMAT
+    )
+
+
+def merge_calc_csv(path: str, df: pd.DataFrame, fund_codes: list, cols_sequence=None):
+    """
+    用受影响基金的新计算结果替换 CSV 中的旧结果，其他基金保持不变
+    :param path: 计算结果文件路径
+    :param df: 受影响基金的新计算结果
+    :param fund_codes: 受影响的基金代码
+    :param cols_sequence: 列顺序函数 (传入合并后的列，返回排列后的列)，None 表示不调整
+    :return:
+    """
+    if os.path.exists(path):
+        old_df = read_calc_csv(path)
+        old_df = old_df[~old_df["fund_code"].isin(fund_codes)]
+        df = pd.concat([old_df, df], ignore_index=True)
+    if cols_sequence is not None:
+        df = df.reindex(columns=cols_sequence(list(df.columns)))
+    write_calc_csv(path, df)
+
+
+def read_calc_csv(path: str) -> pd.DataFrame:
+    """
+    读取计算结果 CSV
+    :param path: 计算结果文件路径
+    :return: 计算结果 (代码、名称、日期列按字符串读取，指标列按浮点数读取以便统一格式写出)
+    """
+    cols = pd.read_csv(path, nrows=0, encoding="utf-8-sig").columns
+    return pd.read_csv(
+        path,
+        dtype={
+            col: str
+            for col in cols
+            if col in ("fund_code", "fund_name") or col.endswith("_day")
+        },
+        encoding="utf-8-sig",
+    )
+
+
+def write_calc_csv(path: str, df: pd.DataFrame):
+    """
+    写出计算结果 CSV (先写入临时文件再替换，读取方不会读到写了一半的文件)
+    :param path: 计算结果文件路径
+    :param df: 计算结果
+    :return:
+    """
+    df.to_csv(
+        path + ".tmp",
+        mode="w",
+        header=True,
+        index=False,
+        encoding="utf-8-sig",
+        float_format=CALC_FLOAT_FORMAT,
+    )
+    os.replace(path + ".tmp", path)
+
+
+def repair_csv_tail(path: str):
+    """
+    截掉 CSV 末尾不完整的一行 (进程在写出过程中被终止时留下)，以便继续追加
+    :param path: 文件路径
+    :return:
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b"\n") + 1)
+
+
+def append_pickle(path: str, obj):
+    """
+    追加对象到暂存文件
+    :param path: 文件路径
+    :param obj: 对象
+    :return:
+    """
+    with open(path, "ab") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def iter_pickles(path: str) -> Iterator[Any]:
+    """
+    逐个读取暂存文件中的对象 (忽略末尾写出不完整的对象)
+    :param path: 文件路径
+    :return: 对象迭代器
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break
+
+
+def load_pickles(path: str) -> list:
+    """
+    读取暂存文件中的全部对象 (忽略末尾写出不完整的对象)
+    :param path: 文件路径
+    :return: 对象列表
+    """
+    return list(iter_pickles(path))
+
+
+class ResultSink(object):
+    """
+    爬取结果流式写入器
+    (净值、月计算结果等多行结果逐个基金追加写出；年计算结果等每个基金只有一行的结果先逐个暂存，结束时统一写出)
+    """
+
+    def __init__(
+        self, incremental=False, resume_fund_codes: list = None, on_written=None
+    ):
+        """
+        :param incremental: 是否增量模式 (保留已存储数据，仅替换受影响基金的计算结果)
+        :param resume_fund_codes: 继续中断的运行时，中断前已写出结果的基金代码 (保留已写出与暂存的结果)，None 表示新的运行
+        :param on_written: 基金结果写出后的回调，参数为 (基金代码, 最新交易日)
+        """
+        self.incremental = incremental
+        self.on_written = on_written
+        self.resume = resume_fund_codes is not None
+        # 每个基金一行的结果 {结果名: (文件路径, 列顺序函数)}
+        self.row_outputs = {
+            "year_df": (
+                settings.CSV_WRITE_DIR + "/calc_year.csv",
+                get_calc_year_cols_sequence,
+            ),
+            "rolling_df": (
+                settings.CSV_WRITE_DIR + "/calc_rolling.csv",
+                lambda cols: TRAILING_COLS,
+            ),
+        }
+        # 逐个基金追加写出的结果 {结果名: (文件路径, 列)}
+        self.stream_outputs = {
+            "month_df": (settings.CSV_WRITE_DIR + "/calc_month.csv", CALC_MONTH_COLS),
+        }
+        if settings.ROLLING_SERIES_OUTPUT:
+            self.stream_outputs["rolling_series_df"] = (
+                settings.CSV_WRITE_DIR + "/calc_rolling_series.csv",
+                ROLLING_SERIES_COLS,
+            )
+        self.fund_codes = list(resume_fund_codes or [])
+        # PARQUET 净值数据攒批写出，减少小文件
+        self.net_value_df_list = []
+        self.net_value_rows = 0
+        # 净值数据尚未写出的基金 [(基金代码, 最新交易日)]
+        self.unwritten_funds = []
+        self.nav_store = get_nav_store()
+        self.open()
+
+    def get_write_path(self, path: str) -> str:
+        """
+        获取流式结果的写入路径 (先写入临时文件，结束时替换正式文件，增量模式下合并未受影响基金的旧结果；
+        运行期间正式文件保持上次运行的完整结果)
+        :param path: 结果文件路径
+        :return: 写入路径
+        """
+        return path + ".tmp"
+
+    @staticmethod
+    def get_stage_path(path: str) -> str:
+        """
+        获取每个基金一行的结果的暂存路径
+        :param path: 结果文件路径
+        :return: 暂存路径
+        """
+        return path + ".rows"
+
+    def open(self):
+        """
+        初始化输出文件 (继续中断的运行时保留已写出的文件，只修复末尾不完整的行)
+        :return:
+        """
+        if self.resume:
+            if settings.STORE_TYPE == "CSV":
+                repair_csv_tail(settings.CSV_READ_PATH)
+            for path, _ in self.stream_outputs.values():
+                repair_csv_tail(self.get_write_path(path))
+            return
+        if not self.incremental and settings.STORE_TYPE == "CSV":
+            if os.path.exists(settings.CSV_READ_PATH):
+                os.remove(settings.CSV_READ_PATH)
+        if not self.incremental and settings.STORE_TYPE == "PARQUET":
+            if os.path.exists(settings.PARQUET_DIR):
+                shutil.rmtree(settings.PARQUET_DIR)
+        if not self.incremental and self.nav_store is not None:
+            self.nav_store.reset()
+        for path, _ in self.stream_outputs.values():
+            if os.path.exists(self.get_write_path(path)):
+                os.remove(self.get_write_path(path))
+        for path, _ in self.row_outputs.values():
+            if os.path.exists(self.get_stage_path(path)):
+                os.remove(self.get_stage_path(path))
+
+    def write(self, result: dict):
+        """
+        写出单个基金的结果
+        :param result: crawl 返回的结果 (离线重新计算时为带 fund_codes 的多个基金的批量结果)
+        :return:
+        """
+        fund_codes = result.get("fund_codes") or [result["fund_code"]]
+        self.fund_codes.extend(fund_codes)
+        net_value_df = result.get("net_value_df")
+        if net_value_df is not None and not net_value_df.empty:
+            if settings.STORE_TYPE == "PARQUET":
+                self.net_value_df_list.append(net_value_df)
+                self.net_value_rows += len(net_value_df)
+                if self.net_value_rows >= settings.PARQUET_FLUSH_ROWS:
+                    self.flush_net_value()
+            else:
+                append_net_value_csv(net_value_df)
+        if self.nav_store is not None and result.get("nav_values") is not None:
+            self.nav_store.append(result["fund_code"], result["nav_values"])
+        for name, (path, columns) in self.stream_outputs.items():
+            if result.get(name) is not None:
+                append_csv(
+                    self.get_write_path(path),
+                    result[name],
+                    columns,
+                    float_format=CALC_FLOAT_FORMAT,
+                )
+        for name, (path, _) in self.row_outputs.items():
+            if result.get(name) is not None:
+                append_pickle(self.get_stage_path(path), result[name])
+        self.unwritten_funds.extend(
+            (fund_code, result.get("last_trading_day")) for fund_code in fund_codes
+        )
+        if not self.net_value_df_list:
+            self.notify_written()
+
+    def flush_net_value(self):
+        """
+        写出攒批的 PARQUET 净值数据
+        :return:
+        """
+        if self.net_value_df_list:
+            append_net_value_parquet(pd.concat(self.net_value_df_list))
+        self.net_value_df_list = []
+        self.net_value_rows = 0
+        self.notify_written()
+
+    def notify_written(self):
+        """
+        通知结果已全部写出的基金
+        :return:
+        """
+        if self.on_written is not None:
+            for fund_code, last_trading_day in self.unwritten_funds:
+                self.on_written(fund_code, last_trading_day)
+        self.unwritten_funds = []
+
+    def close(self):
+        """
+        写出每个基金一行的结果，增量模式下合并旧的计算结果，并删除暂存文件
+        :return:
+        """
+        self.flush_net_value()
+        if self.nav_store is not None:
+            self.nav_store.close()
+            self.nav_store.compact()
+        for name, (path, cols_sequence) in self.row_outputs.items():
+            row_df_list = load_pickles(self.get_stage_path(path))
+            if row_df_list:
+                df = pd.concat(row_df_list, ignore_index=True)
+                # 中断前已暂存、继续运行时重新处理的基金以最新结果为准
+                df = df.drop_duplicates(subset=["fund_code"], keep="last")
+            else:
+                df = pd.DataFrame(columns=cols_sequence([]))
+            if self.incremental:
+                merge_calc_csv(path, df, self.fund_codes, cols_sequence)
+            else:
+                df = df.reindex(columns=cols_sequence(list(df.columns)))
+                write_calc_csv(path, df)
+            if os.path.exists(self.get_stage_path(path)):
+                os.remove(self.get_stage_path(path))
+
+        for path, columns in self.stream_outputs.values():
+            write_path = self.get_write_path(path)
+            if not os.path.exists(write_path):
+                pd.DataFrame(columns=columns).to_csv(
+                    write_path, index=False, encoding="utf-8-sig"
+                )
+            if self.incremental and os.path.exists(path):
+                for old_df in pd.read_csv(
+                    path,
+                    dtype=str,
+                    encoding="utf-8-sig",
+                    chunksize=settings.CSV_CHUNK_SIZE,
+                ):
+                    old_df = old_df[~old_df["fund_code"].isin(self.fund_codes)]
+                    append_csv(write_path, old_df, columns)
+            os.replace(write_path, path)
@@ -0,0 +1,435 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+import json
+import os
+import threading
+import time
+
+import settings
+from logger import logger
+
+
+# 指标名称前缀 (PROMETHEUS 格式)
+METRIC_PREFIX = "fund_"
+
+# 指标说明
+METRIC_HELP = {
+    "stage_seconds": "各阶段耗时 (秒)",
+    "rows_total": "各阶段处理的净值行数",
+    "funds_total": "处理完成的基金数量 (按结果状态)",
+    "http_requests_total": "HTTP 请求数 (不含直接使用缓存的请求)",
+    "http_cache_hits_total": "直接使用缓存响应 (未发送请求) 的 HTTP 请求数",
+    "http_retries_total": "HTTP 请求重试数",
+    "http_errors_total": "HTTP 请求失败数 (含重试前的失败)",
+    "queue_depth": "本轮尚未返回结果的基金数量",
+    "process_queue_depth": "已获取净值、等待或正在工作进程中处理的基金数量",
+    "in_flight_requests": "在途 HTTP 请求数",
+    "concurrency_limit": "自适应并发上限",
+    "worker_utilization": "工作进程利用率 (工作进程处理耗时 / (进程数 * 爬取耗时))",
+    "rows_per_second": "各阶段每秒处理的净值行数 (按运行总耗时)",
+    "elapsed_seconds": "运行总耗时 (秒)",
+}
+
+# 同时输出运行中最大值的瞬时值指标
+MAX_TRACKED_GAUGES = {
+    "queue_depth",
+    "process_queue_depth",
+    "in_flight_requests",
+    "concurrency_limit",
+}
+
+
+@contextmanager
+def measure(timings: Optional[dict], stage: str):
+    """
+    记录代码块耗时到 timings (工作进程中使用，随结果带回主进程)
+    :param timings: {阶段: [耗时]}，None 表示不记录
+    :param stage: 阶段名称
+    :return:
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.setdefault(stage, []).append(time.perf_counter() - started_at)
+
+
+class Telemetry(object):
+    """
+    运行指标登记 (计数、瞬时值、耗时汇总)：只在主进程中使用，
+    工作进程中的各阶段耗时随结果带回 (result["timings"])；
+    运行结束时写出 PROMETHEUS 文本或 JSON 格式的指标文件，运行中可定期输出进度日志
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        # {(指标名, 标签): 值}
+        self.counters = {}
+        # {(指标名, 标签): [当前值, 最大值]}
+        self.gauges = {}
+        # {(指标名, 标签): [次数, 总和, 最小值, 最大值]}
+        self.summaries = {}
+        self.progress_stop = None
+        self.progress_thread = None
+
+    @staticmethod
+    def make_key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        计数加 value
+        :param name: 指标名
+        :param value: 增量
+        :param labels: 标签
+        :return:
+        """
+        key = self.make_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        设置瞬时值 (同时记录最大值)
+        :param name: 指标名
+        :param value: 值
+        :param labels: 标签
+        :return:
+        """
+        key = self.make_key(name, labels)
+        with self.lock:
+            gauge = self.gauges.get(key)
+            if gauge is None:
+                self.gauges[key] = [value, value]
+            else:
+                gauge[0] = value
+                gauge[1] = max(gauge[1], value)
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        """
+        瞬时值加 delta
+        :param name: 指标名
+        :param delta: 增量
+        :param labels: 标签
+        :return:
+        """
+        key = self.make_key(name, labels)
+        with self.lock:
+            value = self.gauges.get(key, [0, 0])[0] + delta
+        self.set_gauge(name, value, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        记录一次观测值 (汇总次数、总和、最小值、最大值)
+        :param name: 指标名
+        :param value: 观测值
+        :param labels: 标签
+        :return:
+        """
+        key = self.make_key(name, labels)
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = min(summary[2], value)
+                summary[3] = max(summary[3], value)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        记录代码块耗时到 stage_seconds{stage}
+        :param stage: 阶段名称
+        :return:
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started_at, stage=stage)
+
+    def get_counter(self, name: str, **labels) -> float:
+        return self.counters.get(self.make_key(name, labels), 0)
+
+    def get_gauge(self, name: str, **labels) -> float:
+        return self.gauges.get(self.make_key(name, labels), [0, 0])[0]
+
+    def get_summary_sum(self, name: str, **labels) -> float:
+        summary = self.summaries.get(self.make_key(name, labels))
+        return summary[1] if summary is not None else 0.0
+
+    def record_result(self, result: dict):
+        """
+        登记单个基金的处理结果 (工作进程带回的各阶段耗时、净值行数与结果状态)
+        :param result: crawl / process_task 的返回值
+        :return:
+        """
+        for stage, seconds_list in (result.get("timings") or {}).items():
+            for seconds in seconds_list:
+                self.observe("stage_seconds", seconds, stage=stage)
+        if result.get("rows"):
+            self.inc("rows_total", result["rows"], stage="format")
+        if result.get("error") is not None:
+            status = "failed"
+        elif result.get("year_df") is None:
+            status = "no_data"
+        else:
+            status = "done"
+        self.inc("funds_total", status=status)
+        self.add_gauge("queue_depth", -1)
+
+    def derive(self):
+        """
+        计算派生指标 (总耗时、每秒行数)
+        :return:
+        """
+        elapsed = time.time() - self.started_at
+        self.set_gauge("elapsed_seconds", round(elapsed, 3))
+        for (name, labels), value in list(self.counters.items()):
+            if name == "rows_total" and elapsed > 0:
+                self.set_gauge(
+                    "rows_per_second", round(value / elapsed, 1), **dict(labels)
+                )
+
+    def to_prometheus(self) -> str:
+        """
+        PROMETHEUS 文本格式 (瞬时值与耗时的最大值输出为单独的 _max 指标)
+        :return: 指标文本
+        """
+
+        def format_labels(labels: tuple) -> str:
+            if not labels:
+                return ""
+            return (
+                "{"
+                + ",".join(
+                    key + '="' + str(value).replace('"', '\\"') + '"'
+                    for key, value in labels
+                )
+                + "}"
+            )
+
+        with self.lock:
+            # {指标名: (类型, 说明, [(样本名, 标签, 值)])}
+            families = {}
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, ("counter", METRIC_HELP.get(name), []))[
+                    2
+                ].append((name, labels, value))
+            for (name, labels), (value, max_value) in self.gauges.items():
+                families.setdefault(name, ("gauge", METRIC_HELP.get(name), []))[
+                    2
+                ].append((name, labels, value))
+                if name in MAX_TRACKED_GAUGES:
+                    families.setdefault(
+                        name + "_max",
+                        ("gauge", "最大值：" + METRIC_HELP.get(name, name), []),
+                    )[2].append((name + "_max", labels, max_value))
+            for (name, labels), (count, total, _, max_value) in self.summaries.items():
+                samples = families.setdefault(
+                    name, ("summary", METRIC_HELP.get(name), [])
+                )[2]
+                samples.append((name + "_count", labels, count))
+                samples.append((name + "_sum", labels, round(total, 6)))
+                families.setdefault(
+                    name + "_max", ("gauge", "最大值：" + METRIC_HELP.get(name, name), [])
+                )[2].append((name + "_max", labels, round(max_value, 6)))
+
+        lines = []
+        for name, (metric_type, help_text, samples) in sorted(families.items()):
+            lines.append("# HELP " + METRIC_PREFIX + name + " " + (help_text or name))
+            lines.append("# TYPE " + METRIC_PREFIX + name + " " + metric_type)
+            for sample_name, labels, value in sorted(samples):
+                lines.append(
+                    METRIC_PREFIX
+                    + sample_name
+                    + format_labels(labels)
+                    + " "
+                    + str(value)
+                )
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        """
+        JSON 格式
+        :return: 指标字典
+        """
+        with self.lock:
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(
+                    timespec="seconds"
+                ),
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "gauges": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "value": value,
+                        "max": max_value if name in MAX_TRACKED_GAUGES else None,
+                    }
+                    for (name, labels), (value, max_value) in sorted(
+                        self.gauges.items()
+                    )
+                ],
+                "summaries": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": count,
+                        "sum": round(total, 6),
+                        "mean": round(total / count, 6),
+                        "min": round(min_value, 6),
+                        "max": round(max_value, 6),
+                    }
+                    for (name, labels), (count, total, min_value, max_value) in sorted(
+                        self.summaries.items()
+                    )
+                ],
+            }
+
+    def write(self, path: str = None, metrics_format: str = None):
+        """
+        写出指标文件 (先写临时文件再替换，采集程序不会读到写了一半的文件)
+        :param path: 文件地址，默认 settings.METRICS_PATH，None 表示不写出
+        :param metrics_format: PROMETHEUS / JSON，默认 settings.METRICS_FORMAT
+        :return:
+        """
+        path = path or settings.METRICS_PATH
+        if not path:
+            return
+        metrics_format = metrics_format or settings.METRICS_FORMAT
+        self.derive()
+        if metrics_format == "PROMETHEUS":
+            content = self.to_prometheus()
+        elif metrics_format == "JSON":
+            content = json.dumps(self.to_json(), ensure_ascii=False, indent=2)
+        else:
+            raise Exception("METRICS_FORMAT must be PROMETHEUS or JSON")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logger.info("运行指标已写入：" + path)
+
+    def progress_line(self) -> str:
+        """
+        进度日志
+        :return: 进度信息
+        """
+        elapsed = time.time() - self.started_at
+        parsed_rows = self.get_counter("rows_total", stage="parse") or self.get_counter(
+            "rows_total", stage="format"
+        )
+        finished = sum(
+            self.get_counter("funds_total", status=status)
+            for status in ("done", "no_data", "failed")
+        )
+        return (
+            "进度：已处理基金"
+            + str(finished)
+            + "个 (失败"
+            + str(self.get_counter("funds_total", status="failed"))
+            + "个)，本轮待返回"
+            + str(self.get_gauge("queue_depth"))
+            + "个，待处理"
+            + str(self.get_gauge("process_queue_depth"))
+            + "个，请求"
+            + str(self.get_counter("http_requests_total"))
+            + "次 (重试"
+            + str(self.get_counter("http_retries_total"))
+            + "次)，在途请求"
+            + str(self.get_gauge("in_flight_requests"))
+            + "个，净值"
+            + str(int(parsed_rows))
+            + "条 (每秒"
+            + str(round(parsed_rows / elapsed, 1) if elapsed > 0 else 0)
+            + "条)，已用时"
+            + str(round(elapsed, 1))
+            + "秒"
+        )
+
+    def stage_summary_line(self) -> str:
+        """
+        各阶段耗时汇总 (工作进程中的阶段为各进程耗时之和，按总耗时从大到小排列)
+        :return: 汇总信息
+        """
+        with self.lock:
+            stages = [
+                (dict(labels)["stage"], count, total)
+                for (name, labels), (count, total, _, _) in self.summaries.items()
+                if name == "stage_seconds"
+            ]
+        stages.sort(key=lambda stage: stage[2], reverse=True)
+        return "各阶段耗时：" + "，".join(
+            stage
+            + " "
+            + str(round(total, 2))
+            + "秒/"
+            + str(count)
+            + "次 (平均"
+            + str(round(total / count * 1000, 1))
+            + "毫秒)"
+            for stage, count, total in stages
+        )
+
+    def start_progress(self, interval: float = None):
+        """
+        启动进度日志线程
+        :param interval: 输出间隔 (秒)，默认 settings.PROGRESS_INTERVAL，None 表示不输出
+        :return:
+        """
+        interval = interval or settings.PROGRESS_INTERVAL
+        if not interval or self.progress_thread is not None:
+            return
+        self.progress_stop = threading.Event()
+
+        def report():
+            while not self.progress_stop.wait(interval):
+                logger.info(self.progress_line())
+
+        self.progress_thread = threading.Thread(target=report, daemon=True)
+        self.progress_thread.start()
+
+    def stop_progress(self):
+        """
+        停止进度日志线程
+        :return:
+        """
+        if self.progress_thread is None:
+            return
+        self.progress_stop.set()
+        self.progress_thread.join()
+        self.progress_thread = None
+
+
+# 进程内共享的指标登记
+_telemetry = Telemetry()
+
+
+def get_telemetry() -> Telemetry:
+    """
+    获取进程内共享的指标登记
+    :return: 指标登记
+    """
+    return _telemetry
+
+
+def reset_telemetry() -> Telemetry:
+    """
+    重新开始登记指标 (每次运行开始时调用)
+    :return: 指标登记
+    """
+    global _telemetry
+    _telemetry.stop_progress()
+    _telemetry = Telemetry()
+    return _telemetry
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 进程内共享的实例 (模块名.变量名)，切换存储目录后需要重新创建
+SHARED_INSTANCES = [
+    "cache._response_cache",
+    "calcstate._calc_state_store",
+    "navstore._nav_store",
+    "query._result_query",
+    "service._worker_crawler",
+]
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    """
+    每个测试在独立的临时目录中运行 (配置中的存储地址均为 ./store 下的相对路径)
+    :return: 存储目录
+    """
+    monkeypatch.chdir(tmp_path)
+    for target in SHARED_INSTANCES:
+        monkeypatch.setattr(target, None)
+    os.makedirs("store")
+    return tmp_path / "store"
+
+
+@pytest.fixture
+def lsjz_server(monkeypatch):
+    """
+    净值接口桩服务 (settings.NET_VALUE_API_URL 指向该服务)
+    :return: LsjzStubServer
+    """
+    from lsjz_stub import LsjzStubServer
+    import settings
+
+    server = LsjzStubServer()
+    monkeypatch.setattr(settings, "NET_VALUE_API_URL", server.url)
+    yield server
+    server.close()
@@ -0,0 +1,121 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import glob
+import json
+import os
+import threading
+
+import pandas as pd
+
+from fetcher import HttpNetValueFetcher
+from format import net_values_to_array, net_values_to_frame
+
+# 净值接口夹具目录 (lsjz_{基金代码}.json，与接口返回格式相同，LSJZList 为该基金的全部净值行，按交易日倒序)
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(fund_code: str) -> dict:
+    """
+    读取基金的净值接口夹具
+    :param fund_code: 基金代码
+    :return: 接口返回的 JSON
+    """
+    with open(
+        os.path.join(FIXTURE_DIR, "lsjz_" + fund_code + ".json"), encoding="utf-8"
+    ) as f:
+        return json.load(f)
+
+
+def load_fixture_frame(fund_code: str) -> pd.DataFrame:
+    """
+    把基金的净值接口夹具解析成净值数据表 (与爬取结果中的 net_value_df 相同)
+    :param fund_code: 基金代码
+    :return: 净值数据
+    """
+    rows, _ = HttpNetValueFetcher.parse_page(fund_code, load_fixture(fund_code))
+    return net_values_to_frame(fund_code, net_values_to_array(rows))
+
+
+class LsjzStubServer(object):
+    """
+    净值接口桩服务：按夹具中的净值行分页返回，与真实接口一样支持 startDate / endDate 区间
+    (TotalCount 为区间内的条数)；记录收到的每个请求的参数
+    """
+
+    def __init__(self):
+        # {基金代码: 净值行}，测试中可修改
+        self.rows = {}
+        self.envelope = None
+        for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "lsjz_*.json"))):
+            fund_code = os.path.basename(path)[len("lsjz_") : -len(".json")]
+            fixture = load_fixture(fund_code)
+            self.rows[fund_code] = fixture["Data"].pop("LSJZList")
+            self.envelope = fixture
+        # {基金代码: 错误信息}，请求这些基金时返回 ErrCode != 0
+        self.errors = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                params = {
+                    name: values[-1]
+                    for name, values in parse_qs(urlparse(self.path).query).items()
+                }
+                with stub.lock:
+                    stub.requests.append(params)
+                body = json.dumps(stub.make_page(params), ensure_ascii=False).encode(
+                    "utf-8"
+                )
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:" + str(self.server.server_port) + "/f10/lsjz"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def make_page(self, params: dict) -> dict:
+        """
+        生成单页接口返回
+        :param params: 请求参数
+        :return: 接口返回的 JSON
+        """
+        fund_code = params.get("fundCode", "")
+        if fund_code in self.errors:
+            return {
+                "Data": None,
+                "ErrCode": -999,
+                "ErrMsg": self.errors[fund_code],
+                "TotalCount": 0,
+                "Expansion": None,
+                "PageSize": 0,
+                "PageIndex": 0,
+            }
+        rows = [
+            row
+            for row in self.rows.get(fund_code, [])
+            if row["FSRQ"] >= (params.get("startDate") or "")
+            and row["FSRQ"] <= (params.get("endDate") or "9999")
+        ]
+        page_index = int(params.get("pageIndex", 1))
+        page_size = int(params.get("pageSize", 20))
+        page = json.loads(json.dumps(self.envelope))
+        page["Data"]["LSJZList"] = rows[
+            (page_index - 1) * page_size : page_index * page_size
+        ]
+        page["TotalCount"] = len(rows)
+        page["PageSize"] = page_size
+        page["PageIndex"] = page_index
+        return page
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
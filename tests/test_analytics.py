@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+import settings
+
+
+def make_net_value_df(navs: dict) -> pd.DataFrame:
+    """
+    构造长表格式的净值数据
+    :param navs: {基金代码: 累计净值列表}，交易日从 2024-01-02 起连续编号
+    :return: 净值数据
+    """
+    rows = []
+    for fund_code, nav_list in navs.items():
+        for i, nav in enumerate(nav_list):
+            rows.append(
+                {
+                    "fund_code": fund_code,
+                    "trading_day": str(20240102 + i),
+                    "cumulative_net_value": nav,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def net_value_batches(monkeypatch):
+    def set_batches(*batches):
+        monkeypatch.setattr(
+            analytics, "iter_net_value_batches", lambda: iter(list(batches))
+        )
+
+    monkeypatch.setattr(settings, "CALC_NAV_TYPE", "CUMULATIVE")
+    os.makedirs(settings.ANALYTICS_DIR)
+    return set_batches
+
+
+def test_build_return_matrix(net_value_batches):
+    net_value_batches(
+        make_net_value_df({"000001": [1.0, 1.1, 1.21], "000002": [2.0, 2.0, 1.0]}),
+        make_net_value_df({"000003": [1.0, None, 1.5]}),
+    )
+    fund_codes, trading_days, returns = analytics.build_return_matrix(
+        settings.ANALYTICS_DIR + "/tmp"
+    )
+    assert list(fund_codes) == ["000001", "000002", "000003"]
+    assert len(trading_days) == 3
+    np.testing.assert_allclose(
+        returns,
+        [
+            [np.nan, np.log(1.1), np.log(1.1)],
+            [np.nan, 0, np.log(0.5)],
+            [np.nan, np.nan, np.log(1.5)],
+        ],
+        rtol=1e-6,
+    )
+
+
+def test_build_return_matrix_all_nan_fund(net_value_batches):
+    # 净值全部为空的基金在整理后没有行 (不出现在矩阵中)，之后基金的序号不连续
+    net_value_batches(
+        make_net_value_df(
+            {
+                "000001": [1.0, 1.1, 1.21],
+                "000002": [None, None, None],
+                "000003": [1.0, 1.2, 1.5],
+            }
+        )
+    )
+    fund_codes, trading_days, returns = analytics.build_return_matrix(
+        settings.ANALYTICS_DIR + "/tmp"
+    )
+    assert list(fund_codes) == ["000001", "000003"]
+    np.testing.assert_allclose(
+        returns,
+        [
+            [np.nan, np.log(1.1), np.log(1.1)],
+            [np.nan, np.log(1.2), np.log(1.25)],
+        ],
+        rtol=1e-6,
+    )
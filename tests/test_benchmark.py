@@ -0,0 +1,38 @@
+import os
+
+import benchmark
+import navstore
+import settings
+
+
+def snapshot(path) -> dict:
+    """
+    目录下全部文件的大小与修改时间
+    :param path: 目录
+    :return: {相对路径: (大小, 修改时间)}
+    """
+    files = {}
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            stat = os.stat(file_path)
+            files[os.path.relpath(file_path, path)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def test_run_benchmark_keeps_store(store_dir):
+    # 正式的净值存储与已有数据文件，基准测试只能读写自己创建的临时目录
+    os.makedirs(settings.NAV_STORE_DIR)
+    navstore.get_nav_store()
+    with open(os.path.join(settings.NAV_STORE_DIR, "marker"), "w") as f:
+        f.write("keep")
+    with open(settings.CSV_READ_PATH, "w") as f:
+        f.write("fund_code,trading_day\n")
+    before = snapshot(store_dir)
+
+    result = benchmark.run_benchmark(2, 1, 1)
+
+    assert snapshot(store_dir) == before
+    assert os.path.exists(os.path.join(settings.NAV_STORE_DIR, "marker"))
+    assert settings.NAV_STORE_DIR == "./store/nav_store"
+    assert "store_csv" in result["stages"] and "db_upsert" in result["stages"]
@@ -0,0 +1,149 @@
+import time
+
+import pytest
+
+import discovery
+import settings
+from discovery import (
+    FundListDiscovery,
+    discover_fund_codes,
+    filter_fund_list,
+    load_fund_code_file,
+    load_fund_list_cache,
+    save_fund_list_cache,
+)
+
+
+def make_rank_data(rows: list, total_pages: int = 1) -> str:
+    """
+    构造基金列表接口返回
+    :param rows: 每行 "代码,名称,..." 字符串
+    :param total_pages: 总页数
+    :return: 接口返回文本
+    """
+    return (
+        "var rankData = {datas:["
+        + ",".join('"' + row + '"' for row in rows)
+        + "],allRecords:"
+        + str(len(rows))
+        + ",pageIndex:1,pageNum:500,allPages:"
+        + str(total_pages)
+        + "};"
+    )
+
+
+# 基金列表接口返回 (每种基金类型一页)
+RANK_DATA = {
+    "gp": make_rank_data(["000001,股票一,GPY,2024-01-02", "000003,股票三,GPS,2024-01-02"]),
+    "zq": make_rank_data(["000002,债券二,ZQE,2024-01-02", "000003,股票三,GPS,2024-01-02"]),
+}
+
+
+@pytest.fixture
+def fund_list_api(monkeypatch):
+    """
+    用 RANK_DATA 代替基金列表接口，记录请求的基金类型
+    """
+    requested = []
+
+    def fetch_page(self, fund_type, page_index):
+        requested.append(fund_type)
+        return FundListDiscovery.parse_page(RANK_DATA[fund_type])
+
+    monkeypatch.setattr(FundListDiscovery, "fetch_page", fetch_page)
+    monkeypatch.setattr(settings, "FUND_CODE_RANGES", [])
+    monkeypatch.setattr(settings, "FUND_CODE_FILE", None)
+    monkeypatch.setattr(settings, "MAX_FUND_NUM", None)
+    return requested
+
+
+def test_parse_page():
+    fund_list, total_pages = FundListDiscovery.parse_page(
+        make_rank_data(["000001,基金一,JJY,2024-01-02", ",空代码", ""], 3)
+    )
+    assert fund_list == [("000001", "基金一")]
+    assert total_pages == 3
+
+    # 没有总页数时视为一页
+    assert FundListDiscovery.parse_page("{datas:[]}") == ([], 1)
+    with pytest.raises(Exception):
+        FundListDiscovery.parse_page("<html>系统繁忙</html>")
+
+
+def test_discover_fund_types(fund_list_api):
+    # 多个基金类型按基金代码去重并排序
+    fund_list = FundListDiscovery().discover(["gp", "zq"])
+    assert fund_list == [("000001", "股票一"), ("000002", "债券二"), ("000003", "股票三")]
+    assert fund_list_api == ["gp", "zq"]
+
+
+def test_filter_fund_code_ranges():
+    fund_list = [("000001", "一"), ("000010", "十"), ("100001", "甲")]
+    assert filter_fund_list(fund_list, [("000001", "000009")]) == [("000001", "一")]
+    assert filter_fund_list(
+        fund_list, [("000010", "000010"), ("100000", "199999")]
+    ) == [
+        ("000010", "十"),
+        ("100001", "甲"),
+    ]
+    assert filter_fund_list(fund_list, []) == fund_list
+
+
+def test_filter_fund_code_file(tmp_path):
+    path = tmp_path / "codes.txt"
+    path.write_text("# 自选基金\n000002\n000009, 文件名称\n\n000002\n", encoding="utf-8")
+    code_file_list = load_fund_code_file(str(path))
+    assert code_file_list == [("000002", ""), ("000009", "文件名称"), ("000002", "")]
+
+    # 文件中的代码全部保留 (去重)，未提供名称时使用基金列表中的名称
+    fund_list = [("000001", "一"), ("000002", "二")]
+    assert filter_fund_list(fund_list, None, code_file_list) == [
+        ("000002", "二"),
+        ("000009", "文件名称"),
+    ]
+    assert filter_fund_list(fund_list, [("000005", "000009")], code_file_list) == [
+        ("000009", "文件名称")
+    ]
+
+
+def test_fund_list_cache_ttl(monkeypatch):
+    path = settings.FUND_LIST_CACHE_PATH
+    save_fund_list_cache(path, ["gp"], [("000001", "股票一")])
+    assert load_fund_list_cache(path, 60, ["gp"]) == [("000001", "股票一")]
+    # 基金类型变化时缓存失效
+    assert load_fund_list_cache(path, 60, ["zq"]) is None
+
+    now = time.time()
+    monkeypatch.setattr(discovery.time, "time", lambda: now + 61)
+    assert load_fund_list_cache(path, 60, ["gp"]) is None
+    assert load_fund_list_cache(path, 120, ["gp"]) == [("000001", "股票一")]
+
+
+def test_discover_fund_codes_cache_expiry(monkeypatch, fund_list_api):
+    monkeypatch.setattr(settings, "FUND_TYPES", ["gp"])
+    monkeypatch.setattr(settings, "FUND_LIST_CACHE_TTL", 60)
+    assert discover_fund_codes() == [("000001", "股票一"), ("000003", "股票三")]
+    assert discover_fund_codes() == [("000001", "股票一"), ("000003", "股票三")]
+    assert fund_list_api == ["gp"]
+
+    # 缓存过期后重新获取
+    now = time.time()
+    monkeypatch.setattr(discovery.time, "time", lambda: now + 61)
+    discover_fund_codes()
+    assert fund_list_api == ["gp", "gp"]
+
+
+def test_discover_fund_codes_code_file(monkeypatch, tmp_path, fund_list_api):
+    path = tmp_path / "codes.txt"
+    path.write_text("000003\n000009\n", encoding="utf-8")
+    monkeypatch.setattr(settings, "FUND_TYPES", ["gp"])
+    monkeypatch.setattr(settings, "FUND_CODE_FILE", str(path))
+
+    # 没有缓存时直接使用文件中的代码，不获取基金列表
+    assert discover_fund_codes() == [("000003", ""), ("000009", "")]
+    assert fund_list_api == []
+
+    # 有未失效的缓存时补充名称
+    save_fund_list_cache(settings.FUND_LIST_CACHE_PATH, ["gp"], [("000003", "股票三")])
+    assert discover_fund_codes() == [("000003", "股票三"), ("000009", "")]
+    assert fund_list_api == []
@@ -0,0 +1,115 @@
+import pytest
+
+import settings
+from fetcher import HttpNetValueFetcher
+from lsjz_stub import load_fixture
+
+
+def fixture_trading_days(fund_code: str, since: str = None) -> list:
+    """
+    夹具中有净值的交易日 (按交易日倒序，净值为空的行不写入)
+    :param fund_code: 基金代码
+    :param since: 只保留该日之后的交易日
+    :return: YYYYMMDD 列表
+    """
+    return [
+        row["FSRQ"].replace("-", "")
+        for row in load_fixture(fund_code)["Data"]["LSJZList"]
+        if row["DWJZ"] and row["LJJZ"] and row["FSRQ"].replace("-", "") > (since or "")
+    ]
+
+
+@pytest.fixture
+def make_fetcher(lsjz_server):
+    fetchers = []
+
+    def make():
+        fetchers.append(HttpNetValueFetcher(page_size=20))
+        return fetchers[-1]
+
+    yield make
+    for fetcher in fetchers:
+        fetcher.close()
+
+
+def test_fetch_pages(lsjz_server, make_fetcher, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_CACHE_ENABLED", False)
+    net_value_obj_list = list(make_fetcher().fetch("000001"))
+
+    assert [obj["trading_day"] for obj in net_value_obj_list] == fixture_trading_days(
+        "000001"
+    )
+    assert "20231009" not in {obj["trading_day"] for obj in net_value_obj_list}
+    by_day = {obj["trading_day"]: obj for obj in net_value_obj_list}
+    assert by_day["20230615"]["unit_net_value"] == "1.0865"
+    assert by_day["20230928"]["purchase_status"] == "暂停申购"
+    # 第一天没有日增长率
+    assert by_day["20221201"]["daily_growth_rate"] == "0"
+    assert len(lsjz_server.requests) == 16
+    assert all("startDate" not in params for params in lsjz_server.requests)
+
+
+def test_fetch_pages_since(lsjz_server, make_fetcher, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_CACHE_ENABLED", False)
+    net_value_obj_list = list(make_fetcher().fetch_pages("000001", "20231229"))
+
+    assert [obj["trading_day"] for obj in net_value_obj_list] == fixture_trading_days(
+        "000001", "20231229"
+    )
+    # 到达已存储的交易日即停止翻页
+    assert [params["pageIndex"] for params in lsjz_server.requests] == ["1", "2"]
+
+
+def test_fetch_windows(lsjz_server, make_fetcher):
+    assert settings.HTTP_CACHE_ENABLED
+    net_value_obj_list = list(make_fetcher().fetch("000001"))
+
+    assert [obj["trading_day"] for obj in net_value_obj_list] == fixture_trading_days(
+        "000001"
+    )
+    windows = sorted(
+        {
+            (params["startDate"], params["endDate"])
+            for params in lsjz_server.requests
+            if "startDate" in params
+        }
+    )
+    assert windows == [
+        ("2022-01-01", "2022-12-31"),
+        ("2023-01-01", "2023-12-31"),
+        ("2024-01-01", "2024-12-31"),
+    ]
+
+    # 再次获取时各区间与首末页都命中缓存
+    lsjz_server.requests.clear()
+    assert list(make_fetcher().fetch("000001")) == net_value_obj_list
+    assert lsjz_server.requests == []
+
+
+def test_fetch_single_page(lsjz_server, make_fetcher):
+    net_value_obj_list = list(make_fetcher().fetch("000002"))
+
+    assert [obj["trading_day"] for obj in net_value_obj_list] == fixture_trading_days(
+        "000002"
+    )
+    assert len(lsjz_server.requests) == 1
+
+
+def test_fetch_error(lsjz_server, make_fetcher):
+    lsjz_server.errors["000001"] = "访问过于频繁"
+    with pytest.raises(Exception, match="净值接口返回错误"):
+        list(make_fetcher().fetch("000001"))
+
+
+@pytest.mark.parametrize("blank", ["oldest", "newest"])
+def test_fetch_windows_blank_edge_page(lsjz_server, make_fetcher, blank):
+    # 末页 (最早的交易日) 或首页的净值全部为空时按页码获取
+    rows = lsjz_server.rows["000001"]
+    for row in rows[-5:] if blank == "oldest" else rows[:20]:
+        row["DWJZ"] = ""
+        row["LJJZ"] = ""
+    net_value_obj_list = list(make_fetcher().fetch("000001"))
+
+    assert [obj["trading_day"] for obj in net_value_obj_list] == [
+        row["FSRQ"].replace("-", "") for row in rows if row["DWJZ"]
+    ]
@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import settings
+from lsjz_stub import load_fixture_frame
+from metrics import (
+    add_adjusted_nav,
+    build_calc_state,
+    calc_adjusted_nav,
+    calc_batch,
+    calc_drawdown,
+    calc_rolling_series,
+    calc_state_results,
+    calc_trailing,
+    update_calc_state,
+    update_drawdown_state,
+)
+from service import CalcService
+
+FUND_NAMES = {"000001": "基金一", "000002": "基金二"}
+
+
+def to_list(series: pd.Series) -> list:
+    """
+    转成列表，空值统一为 None
+    :param series: 列数据
+    :return: 列表
+    """
+    return [None if pd.isna(value) else value for value in series]
+
+
+def assert_frame_close(actual: pd.DataFrame, expected: pd.DataFrame):
+    """
+    逐列比较两个结果表，数值列允许四舍五入误差，其余列要求完全一致
+    :param actual: 实际结果
+    :param expected: 期望结果
+    """
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for column in expected.columns:
+        left = actual[column].reset_index(drop=True)
+        right = expected[column].reset_index(drop=True)
+        if column.endswith("_day") or column in ("fund_code", "fund_name"):
+            assert to_list(left) == to_list(right), column
+            continue
+        pd.testing.assert_series_equal(
+            pd.to_numeric(left).astype(float),
+            pd.to_numeric(right).astype(float),
+            check_names=False,
+            rtol=0,
+            atol=2e-4,
+            obj=column,
+        )
+
+
+@pytest.mark.parametrize("nav_type", ["CUMULATIVE", "ADJUSTED"])
+def test_calc_batch_matches_exact(monkeypatch, nav_type):
+    monkeypatch.setattr(settings, "CALC_NAV_TYPE", nav_type)
+    df = pd.concat([load_fixture_frame(code) for code in FUND_NAMES], ignore_index=True)
+
+    monkeypatch.setattr(settings, "CALC_EXACT_DECIMAL", False)
+    year_df, month_df = calc_batch(df, FUND_NAMES)
+    monkeypatch.setattr(settings, "CALC_EXACT_DECIMAL", True)
+    exact_year_df, exact_month_df = CalcService.calc_batch(df, FUND_NAMES)
+
+    assert list(year_df["fund_code"]) == list(FUND_NAMES)
+    assert_frame_close(year_df, exact_year_df)
+    assert_frame_close(month_df, exact_month_df)
+
+
+def make_days(n: int) -> np.ndarray:
+    """
+    构造从 2024-01-01 起连续的交易日
+    :param n: 天数
+    :return: 交易日 (datetime64[ns])
+    """
+    return pd.date_range("2024-01-01", periods=n).to_numpy()
+
+
+def day_list(n: int) -> list:
+    """
+    构造从 2024-01-01 起连续的 YYYYMMDD 交易日
+    :param n: 天数
+    :return: 交易日列表
+    """
+    return list(pd.date_range("2024-01-01", periods=n).strftime("%Y%m%d"))
+
+
+def calc_single_drawdown(nav_list: list) -> dict:
+    """
+    计算单只基金的最大回撤，并取出标量结果
+    :param nav_list: 净值列表
+    :return: {maximum_drawdown, peak_nav, peak_day, trough_day, recovery_day}
+    """
+    nav = np.array(nav_list, dtype=np.float64)
+    drawdown = calc_drawdown(nav, make_days(len(nav)), np.array([0]))
+    return {key: value[0] for key, value in drawdown.items()}
+
+
+@pytest.mark.parametrize(
+    "nav_list, expected",
+    [
+        # 全局最低点在全局峰值之前，回撤只能从运行峰值算起
+        ([0.5, 1.0, 0.9], (0.1, "20240102", "20240103", None)),
+        # 回到峰值当天记为恢复日
+        (
+            [1.0, 1.2, 0.9, 1.1, 1.2, 1.3],
+            (0.25, "20240102", "20240103", "20240105"),
+        ),
+        # 之后一直没有回到峰值
+        ([1.0, 0.9, 0.95], (0.1, "20240101", "20240102", None)),
+        # 单调上涨没有回撤
+        ([1.0, 1.1, 1.2], (0.0, None, None, None)),
+    ],
+)
+def test_calc_drawdown_known_answers(nav_list, expected):
+    maximum_drawdown, peak_day, trough_day, recovery_day = expected
+    drawdown = calc_single_drawdown(nav_list)
+    assert drawdown["maximum_drawdown"] == pytest.approx(maximum_drawdown)
+    assert drawdown["peak_day"] == peak_day
+    assert drawdown["trough_day"] == trough_day
+    assert drawdown["recovery_day"] == recovery_day
+
+
+def test_calc_drawdown_fund_boundary():
+    # 第二只基金的净值整体低于第一只，运行峰值必须在分组边界处重置
+    first = [1.0, 1.2, 0.9, 1.2]
+    second = [0.5, 0.6, 0.3]
+    nav = np.array(first + second)
+    day = np.concatenate([make_days(len(first)), make_days(len(second))])
+    drawdown = calc_drawdown(nav, day, np.array([0, len(first)]))
+    np.testing.assert_allclose(drawdown["maximum_drawdown"], [0.25, 0.5])
+    np.testing.assert_allclose(drawdown["peak_nav"], [1.2, 0.6])
+    assert list(drawdown["peak_day"]) == ["20240102", "20240102"]
+    assert list(drawdown["trough_day"]) == ["20240103", "20240103"]
+    assert list(drawdown["recovery_day"]) == ["20240104", None]
+
+
+# 种子 6 的最大回撤区间之后恢复，种子 1 没有恢复
+@pytest.mark.parametrize("seed", [6, 1])
+@pytest.mark.parametrize("chunk_size", [1, 3, 7])
+def test_update_drawdown_state_matches_recompute(seed, chunk_size):
+    rng = np.random.default_rng(seed)
+    nav_list = list(np.cumprod(1 + rng.normal(0, 0.02, 60)))
+    days = day_list(len(nav_list))
+
+    state = None
+    for start in range(0, len(nav_list), chunk_size):
+        state = update_drawdown_state(
+            state,
+            days[start : start + chunk_size],
+            nav_list[start : start + chunk_size],
+        )
+
+    expected = calc_single_drawdown(nav_list)
+    assert state["maximum_drawdown"] == pytest.approx(expected["maximum_drawdown"])
+    assert state["mdd_peak"] == pytest.approx(expected["peak_nav"])
+    assert state["mdd_peak_day"] == expected["peak_day"]
+    assert state["mdd_trough_day"] == expected["trough_day"]
+    assert state["mdd_recovery_day"] == expected["recovery_day"]
+
+
+@pytest.mark.parametrize("nav_type", ["CUMULATIVE", "ADJUSTED"])
+def test_window_return_matches_total_return(monkeypatch, nav_type):
+    # 恰好 21 个日收益的基金：1m 区间收益、滚动窗口收益与整个区间的总收益口径一致
+    monkeypatch.setattr(settings, "CALC_NAV_TYPE", nav_type)
+    df = pd.DataFrame(
+        {
+            "fund_code": "000001",
+            "trading_day": day_list(22),
+            "cumulative_net_value": np.linspace(2.0, 2.6, 22),
+        }
+    )
+    year_df, _ = calc_batch(df, {})
+    trailing_df = calc_trailing(df)
+    rolling_df = calc_rolling_series(df, 21)
+
+    expected = 0.6 if nav_type == "CUMULATIVE" else 0.3
+    assert year_df["total_return"].iloc[0] == pytest.approx(expected)
+    assert trailing_df["1m_return"].iloc[0] == pytest.approx(expected)
+    assert list(rolling_df["return"]) == pytest.approx([expected])
+
+
+# 新增净值的切分点：第一个在月中 (新增部分跨月、跨年)，第二个在年末最后一个交易日之后
+@pytest.mark.parametrize("split_days", [["20231215"], ["20231120", "20231229"]])
+@pytest.mark.parametrize("nav_type", ["CUMULATIVE", "ADJUSTED"])
+def test_calc_state_update_matches_batch(monkeypatch, nav_type, split_days):
+    monkeypatch.setattr(settings, "CALC_NAV_TYPE", nav_type)
+    df = load_fixture_frame("000001")
+    # 新增净值的复权净值由已存储的历史接续计算 (与 NavStore 一致)
+    df = add_adjusted_nav(df)
+    trading_day = df["trading_day"].astype(str)
+
+    state = build_calc_state(df[trading_day <= split_days[0]])["000001"]
+    for start, end in zip(split_days, split_days[1:] + ["99999999"]):
+        state = update_calc_state(
+            state, df[(trading_day > start) & (trading_day <= end)]
+        )
+    assert state["last_trading_day"] == "20240131"
+
+    year_df, month_df = calc_state_results({"000001": state}, FUND_NAMES)
+    expected_year_df, expected_month_df = calc_batch(df, FUND_NAMES)
+    assert "2024_total_return" in year_df.columns
+    assert_frame_close(year_df, expected_year_df)
+    assert_frame_close(month_df, expected_month_df)
+
+
+def test_calc_adjusted_nav_known_answers():
+    # 基金一：现金分红日 (单位净值扣除分红，累计净值包含分红) 与拆分日 (单位净值、累计净值骤降，日增长率为 0)；
+    # 基金二：第一天从累计净值开始
+    fund_idx = np.array([0, 0, 0, 0, 1, 1])
+    unit = np.array([1.10, 1.011, 1.02111, 0.510555, 3.0, 3.03])
+    cumulative = np.array([1.50, 1.511, 1.52111, 0.910555, 3.2, 3.23])
+    rate = np.array([np.nan, 0.01, np.nan, 0.0, np.nan, np.nan])
+    adjusted = calc_adjusted_nav(fund_idx, unit, cumulative, rate)
+    np.testing.assert_allclose(
+        adjusted,
+        [
+            1.50,
+            # 日收益 = 累计净值变化 / 前一日单位净值 = 0.011 / 1.10
+            1.50 * 1.01,
+            1.50 * 1.01 * 1.01,
+            # 拆分日按日增长率计算，复权净值不变
+            1.50 * 1.01 * 1.01,
+            3.2,
+            3.2 * 1.01,
+        ],
+    )
+
+    # 已计算的复权净值作为锚点，之后的交易日由锚点接续计算
+    known = np.full(len(adjusted), np.nan)
+    known[:2] = adjusted[:2] * 2
+    np.testing.assert_allclose(
+        calc_adjusted_nav(fund_idx, unit, cumulative, rate, known)[:4],
+        adjusted[:4] * 2,
+    )
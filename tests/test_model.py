@@ -0,0 +1,87 @@
+from sqlalchemy import MetaData, inspect, select
+
+from model import UNIQUE_INDEX_NAME, Database, NetValue, bulk_upsert
+
+
+def make_row(trading_day: str, nav: float) -> dict:
+    """
+    构造一行净值数据
+    :param trading_day: 交易日
+    :param nav: 单位净值与累计净值
+    :return: 净值字典
+    """
+    return {
+        "fund_code": "000001",
+        "trading_day": trading_day,
+        "unit_net_value": nav,
+        "cumulative_net_value": nav,
+        "daily_growth_rate": 0,
+        "purchase_status": 0,
+        "redeem_status": 0,
+    }
+
+
+def connect_memory_db() -> Database:
+    """
+    连接内存 SQLite 数据库
+    :return: 数据库
+    """
+    db = Database("sqlite://")
+    db.connect()
+    return db
+
+
+def read_rows(db: Database) -> list:
+    """
+    按交易日读取净值表
+    :param db: 数据库
+    :return: [(交易日, 累计净值)]
+    """
+    table = NetValue.__table__
+    with db.engine.connect() as connection:
+        return [
+            (row.trading_day, float(row.cumulative_net_value))
+            for row in connection.execute(
+                select(table).order_by(table.c.trading_day, table.c.id)
+            )
+        ]
+
+
+def test_bulk_upsert_updates_existing_row():
+    db = connect_memory_db()
+    db.create_tables()
+    bulk_upsert(db.engine, [make_row("20240102", 1.0)])
+    bulk_upsert(db.engine, [make_row("20240102", 1.5), make_row("20240103", 1.6)])
+    assert read_rows(db) == [("20240102", 1.5), ("20240103", 1.6)]
+    db.disconnect()
+
+
+def test_create_tables_migrates_existing_table():
+    db = connect_memory_db()
+    # 旧版本建的表没有唯一索引，且已有重复行
+    table = NetValue.__table__.to_metadata(MetaData())
+    table.indexes.clear()
+    table.create(db.engine)
+    with db.engine.begin() as connection:
+        connection.execute(
+            table.insert(),
+            [
+                make_row("20240102", 1.0),
+                make_row("20240103", 1.1),
+                make_row("20240102", 1.2),
+            ],
+        )
+
+    db.create_tables()
+    index_names = [
+        index["name"] for index in inspect(db.engine).get_indexes("net_value")
+    ]
+    assert index_names == [UNIQUE_INDEX_NAME]
+    # 保留最后写入的一行
+    assert read_rows(db) == [("20240102", 1.2), ("20240103", 1.1)]
+
+    # 已有唯一索引时不再迁移，upsert 可以正常更新
+    db.create_tables()
+    bulk_upsert(db.engine, [make_row("20240103", 1.3)])
+    assert read_rows(db) == [("20240102", 1.2), ("20240103", 1.3)]
+    db.disconnect()
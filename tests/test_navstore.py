@@ -0,0 +1,42 @@
+import numpy as np
+
+import settings
+from format import frame_to_net_values
+from lsjz_stub import load_fixture_frame
+from metrics import add_adjusted_nav
+from navstore import NavStore
+
+
+def test_append_keeps_persisted_adjusted_nav():
+    # 夹具按交易日倒序，先排成升序再按交易日先后分批写入
+    df = add_adjusted_nav(load_fixture_frame("000001"))
+    net_values = frame_to_net_values(df)
+    # 从头计算的复权净值
+    expected = df["adjusted_net_value"].to_numpy()
+
+    store = NavStore(settings.NAV_STORE_DIR)
+    store.append("000001", net_values[:200])
+    stored = np.array(store.get_adjusted("000001"))
+    np.testing.assert_allclose(stored, expected[:200], rtol=1e-12)
+
+    # 追加新交易日：已存储的复权净值不重新计算，新交易日由最后一条接续计算
+    store.append("000001", net_values[200:250])
+    store.append("000001", net_values[250:])
+    adjusted = np.array(store.get_adjusted("000001"))
+    np.testing.assert_array_equal(adjusted[:200], stored)
+    np.testing.assert_allclose(adjusted, expected, rtol=1e-12)
+    np.testing.assert_allclose(
+        adjusted, NavStore.calc_adjusted(np.array(store.get("000001"))), rtol=1e-12
+    )
+
+    # 改写已存储的交易日时重新计算该基金的全部复权净值
+    changed = net_values[100:101].copy()
+    changed["cumulative_net_value"] += 0.01
+    changed["unit_net_value"] += 0.01
+    store.append("000001", changed)
+    merged = np.array(store.get("000001"))
+    assert len(merged) == len(net_values)
+    np.testing.assert_allclose(
+        store.get_adjusted("000001"), NavStore.calc_adjusted(merged), rtol=1e-12
+    )
+    store.close()
@@ -0,0 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import os
+import time
+
+import pytest
+
+import settings
+from lsjz_stub import load_fixture
+from scheduler import AsyncCrawlScheduler
+
+
+def crawl_raw(tasks: list, stats: dict = None) -> dict:
+    """
+    用调度器获取净值原始数据 (不经过进程池处理)
+    :param tasks: [(基金代码, 已存储的最新交易日)]
+    :param stats: 传入时写入调度器的统计信息
+    :return: {基金代码: 净值原始字典列表}
+    """
+    results = []
+    scheduler = AsyncCrawlScheduler(
+        None,
+        lambda fund_code, fund_name, raw_list, since, history_df: {
+            "fund_code": fund_code,
+            "raw_list": raw_list,
+        },
+    )
+    asyncio.run(
+        scheduler.run(
+            [(fund_code, "", since, None) for fund_code, since in tasks],
+            results.append,
+        )
+    )
+    scheduler.fetcher.close()
+    if stats is not None:
+        stats.update(scheduler.stats)
+    return {result["fund_code"]: result.get("raw_list") for result in results}
+
+
+def fixture_trading_days(rows: list, since: str = None) -> list:
+    return [
+        row["FSRQ"].replace("-", "")
+        for row in rows
+        if row["DWJZ"] and row["LJJZ"] and row["FSRQ"].replace("-", "") > (since or "")
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(settings, "DEFAULT_HOST_RATE_LIMIT", None)
+    monkeypatch.setattr(settings, "NET_VALUE_PAGE_SIZE", 20)
+
+
+@pytest.mark.parametrize("cache_enabled", [False, True])
+def test_fetch_fund(lsjz_server, monkeypatch, cache_enabled):
+    monkeypatch.setattr(settings, "HTTP_CACHE_ENABLED", cache_enabled)
+    raw_lists = crawl_raw([("000001", None), ("000002", None), ("000003", None)])
+    assert [obj["trading_day"] for obj in raw_lists["000001"]] == fixture_trading_days(
+        load_fixture("000001")["Data"]["LSJZList"]
+    )
+    assert len(raw_lists["000002"]) == 13
+    assert raw_lists["000003"] == []
+
+
+def test_fetch_fund_since(lsjz_server):
+    raw_lists = crawl_raw([("000001", "20231229")])
+    assert [obj["trading_day"] for obj in raw_lists["000001"]] == fixture_trading_days(
+        load_fixture("000001")["Data"]["LSJZList"], "20231229"
+    )
+
+
+@pytest.mark.parametrize("blank", ["oldest", "newest"])
+def test_fetch_fund_blank_edge_page(lsjz_server, blank):
+    # 末页 (最早的交易日) 或首页的净值全部为空时按页码获取
+    rows = lsjz_server.rows["000001"]
+    for row in rows[-5:] if blank == "oldest" else rows[:20]:
+        row["DWJZ"] = ""
+        row["LJJZ"] = ""
+    raw_lists = crawl_raw([("000001", None)])
+    assert [obj["trading_day"] for obj in raw_lists["000001"]] == fixture_trading_days(
+        rows
+    )
+
+
+def test_cache_hits_skip_rate_limit(lsjz_server, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_CACHE_ENABLED", True)
+    tasks = [("000001", None), ("000002", None)]
+    stats = {}
+    expected = crawl_raw(tasks, stats)
+    assert stats["requests"] > 3 and stats["cache_hits"] == 0
+
+    # 缓存命中时不经过限速和并发限制，也不计入请求数
+    monkeypatch.setattr(settings, "DEFAULT_HOST_RATE_LIMIT", 1)
+    request_count = len(lsjz_server.requests)
+    started_at = time.monotonic()
+    assert crawl_raw(tasks, stats) == expected
+    assert time.monotonic() - started_at < 2
+    assert stats["requests"] == 0 and stats["cache_hits"] > 3
+    assert len(lsjz_server.requests) == request_count
+
+
+def process_or_crash(fund_code, fund_name, raw_list, since, history_df):
+    """
+    进程池处理函数：000002 使工作进程异常退出，000003 返回无法序列化的结果
+    """
+    if fund_code == "000002":
+        os._exit(1)
+    if fund_code == "000003":
+        return {"fund_code": fund_code, "parse": lambda: None}
+    return {"fund_code": fund_code, "rows": len(raw_list)}
+
+
+def test_process_failures_fail_only_affected_funds(lsjz_server, monkeypatch):
+    # 逐个基金处理，保证崩溃时只有一个基金在途
+    monkeypatch.setattr(settings, "ASYNC_MAX_FUNDS", 1)
+    executors = []
+
+    def create_executor():
+        executors.append(ProcessPoolExecutor(max_workers=1))
+        return executors[-1]
+
+    results = []
+    scheduler = AsyncCrawlScheduler(
+        create_executor(), process_or_crash, create_executor
+    )
+    try:
+        asyncio.run(
+            scheduler.run(
+                [
+                    (fund_code, "", None, None)
+                    for fund_code in ["000002", "000001", "000003", "000001"]
+                ],
+                results.append,
+            )
+        )
+    finally:
+        scheduler.process_executor.shutdown(wait=True)
+
+    assert [result["fund_code"] for result in results] == [
+        "000002",
+        "000001",
+        "000003",
+        "000001",
+    ]
+    assert "BrokenProcessPool" in results[0]["error"]
+    assert results[1] == results[3] == {"fund_code": "000001", "rows": 304}
+    assert "error" in results[2]
+    # 进程池损坏后只重建一次
+    assert len(executors) == 2
+    assert scheduler.process_executor is executors[1]
+    assert scheduler.stats["failed_funds"] == 2
+
+
+def test_write_failure_fails_only_affected_fund(lsjz_server):
+    results = []
+
+    def write_result(result):
+        if result["fund_code"] == "000002" and "error" not in result:
+            raise OSError("磁盘已满")
+        results.append(result)
+
+    scheduler = AsyncCrawlScheduler(
+        None,
+        lambda fund_code, fund_name, raw_list, since, history_df: {
+            "fund_code": fund_code
+        },
+    )
+    asyncio.run(
+        scheduler.run(
+            [
+                (fund_code, "", None, None)
+                for fund_code in ["000001", "000002", "000003"]
+            ],
+            write_result,
+        )
+    )
+    assert sorted(results, key=lambda result: result["fund_code"]) == [
+        {"fund_code": "000001"},
+        {"fund_code": "000002", "error": "OSError('磁盘已满')"},
+        {"fund_code": "000003"},
+    ]
+    assert scheduler.stats["failed_funds"] == 1
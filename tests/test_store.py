@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import settings
+from lsjz_stub import load_fixture_frame
+from store import ResultSink, load_net_value_parquet
+
+pytest.importorskip("pyarrow")
+
+
+def make_result(fund_code: str) -> dict:
+    """
+    构造单个基金的爬取结果 (只含净值数据)
+    :param fund_code: 基金代码
+    :return: 爬取结果
+    """
+    net_value_df = load_fixture_frame(fund_code)
+    return {
+        "fund_code": fund_code,
+        "net_value_df": net_value_df,
+        "last_trading_day": str(net_value_df["trading_day"].max()),
+    }
+
+
+def test_parquet_sink_resume(monkeypatch):
+    monkeypatch.setattr(settings, "STORE_TYPE", "PARQUET")
+    # 000001 超过攒批行数立即写出，000002 只有 13 行会留在缓冲中
+    monkeypatch.setattr(settings, "PARQUET_FLUSH_ROWS", 100)
+    first = make_result("000001")
+    second = make_result("000002")
+
+    written = []
+    sink = ResultSink(on_written=lambda *args: written.append(args))
+    sink.write(first)
+    assert written == [("000001", first["last_trading_day"])]
+    # 缓冲中的基金尚未落盘，不能通知已写出 (中断后需要重新处理)
+    sink.write(second)
+    assert written == [("000001", first["last_trading_day"])]
+    assert set(load_net_value_parquet()["fund_code"]) == {"000001"}
+
+    # 模拟中断后继续运行：只重新处理未通知写出的基金
+    resumed = []
+    sink = ResultSink(
+        resume_fund_codes=[fund_code for fund_code, _ in written],
+        on_written=lambda *args: resumed.append(args),
+    )
+    sink.write(second)
+    sink.close()
+    assert resumed == [("000002", second["last_trading_day"])]
+
+    df = load_net_value_parquet()
+    assert not df.duplicated(subset=["fund_code", "trading_day"]).any()
+    assert df.groupby("fund_code").size().to_dict() == {
+        "000001": len(first["net_value_df"]),
+        "000002": len(second["net_value_df"]),
+    }
+    assert df["trading_day"].dtype == object
+    assert df["unit_net_value"].dtype == np.float64
+    assert df["cumulative_net_value"].dtype == np.float64
+    assert df["daily_growth_rate"].dtype == np.float64
+    assert df["purchase_status"].dtype == np.int8
+    assert df["redeem_status"].dtype == np.int8
+
+    # 读回的数据与写入的一致
+    for result in (first, second):
+        expected = result["net_value_df"]
+        actual = load_net_value_parquet([result["fund_code"]]).sort_values(
+            "trading_day", ignore_index=True
+        )
+        assert list(actual["trading_day"]) == sorted(
+            expected["trading_day"].astype(str)
+        )
+        expected = expected.sort_values("trading_day", ignore_index=True)
+        for column in ["unit_net_value", "cumulative_net_value", "daily_growth_rate"]:
+            np.testing.assert_allclose(actual[column], expected[column], rtol=1e-6)
+        pd.testing.assert_series_equal(
+            actual["purchase_status"],
+            expected["purchase_status"].astype("int8"),
+        )
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+import pytest
+
+import settings
+from ledger import JobLedger
+from service import CrawlService, get_part_path, run_worker
+from store import append_pickle
+from workqueue import create_work_queue
+
+JOBS = [("000001", "f1", None), ("000002", "f2", None), ("000003", "f3", None)]
+
+
+@pytest.fixture(autouse=True)
+def worker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "NET_VALUE_PAGE_SIZE", 20)
+    monkeypatch.setattr(settings, "WORK_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(settings, "MAX_ATTEMPTS", 2)
+
+
+def test_takeover_and_merge_parts(lsjz_server):
+    lsjz_server.errors["000003"] = "接口错误"
+    queue = create_work_queue()
+    queue.enqueue(JOBS)
+    queue.set_meta({"run_id": 1, "incremental": False, "merged": False})
+
+    # w1 租用 000001 后租约过期 (未续租)，留下的结果不应被采用
+    assert queue.lease("w1", 1, -1)[0]["fund_code"] == "000001"
+    os.makedirs(settings.WORK_PART_DIR)
+    append_pickle(
+        get_part_path("w1"),
+        {
+            "fund_code": "000001",
+            "last_trading_day": "20991231",
+            "year_df": pd.DataFrame({"fund_code": ["000001"], "fund_name": ["stale"]}),
+        },
+    )
+
+    # w2 接管过期的任务并处理全部基金 (000003 失败后重新排队，达到尝试次数上限后失败)
+    run_worker("w2")
+    assert queue.is_finished()
+    assert not queue.complete("w1", "000001", "20991231", True)
+    assert {
+        fund_code: worker_id
+        for fund_code, (worker_id, _, _) in queue.get_done().items()
+    } == {"000001": "w2", "000002": "w2"}
+    assert list(queue.get_failed()) == ["000003"]
+    assert queue.lease("w1", 1, 60) == []
+
+    ledger = JobLedger()
+    run_id = ledger.start_run([(code, name) for code, name, _ in JOBS], False)
+    written = CrawlService.merge_parts(queue, ledger, run_id, False)
+    assert sorted(written) == ["000001", "000002"]
+    assert sorted(ledger.get_jobs(run_id, (JobLedger.DONE,))) == [
+        ("000001", "f1"),
+        ("000002", "f2"),
+    ]
+    assert ledger.get_jobs(run_id, (JobLedger.FAILED,)) == [("000003", "f3")]
+    ledger.close()
+    queue.close()
+
+    year_df = pd.read_csv(settings.CSV_WRITE_DIR + "/calc_year.csv", dtype=str)
+    assert sorted(year_df["fund_code"].unique()) == ["000001", "000002"]
+    assert "stale" not in year_df.to_string()
+    net_value_df = pd.read_csv(settings.CSV_READ_PATH, dtype=str)
+    assert net_value_df.groupby("fund_code")["trading_day"].max().to_dict() == {
+        "000001": "20240131",
+        "000002": "20240131",
+    }
@@ -0,0 +1,122 @@
+import pytest
+
+from workqueue import RedisWorkQueue, SqliteWorkQueue
+
+JOBS = [("000001", "f1", None), ("000002", "f2", "20230101"), ("000003", "f3", None)]
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_queue(request, monkeypatch):
+    """
+    创建任务队列的函数 (同一测试中创建的队列共享数据，相当于不同工作进程的连接)
+    Redis 队列使用 fakeredis (需要 lupa 执行 Lua 脚本)，未安装时跳过
+    """
+    queues = []
+    if request.param == "sqlite":
+
+        def make(max_attempts=3):
+            queues.append(SqliteWorkQueue("store/work_queue.db", max_attempts))
+            return queues[-1]
+
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        import redis
+
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(
+            redis.Redis,
+            "from_url",
+            lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+        )
+
+        def make(max_attempts=3):
+            queues.append(
+                RedisWorkQueue("redis://localhost:6379/0", "test", max_attempts)
+            )
+            return queues[-1]
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_lease_and_complete(make_queue):
+    queue = make_queue()
+    queue.enqueue(JOBS)
+    queue.set_meta({"run_id": 1, "incremental": False, "merged": False})
+    assert queue.get_meta()["run_id"] == 1
+
+    jobs = queue.lease("w1", 2, 60)
+    assert [job["fund_code"] for job in jobs] == ["000001", "000002"]
+    assert jobs[1]["since"] == "20230101"
+    assert all(job["attempts"] == 1 for job in jobs)
+    assert queue.count() == {queue.LEASED: 2, queue.PENDING: 1}
+
+    assert queue.complete("w1", "000001", "20231229", True)
+    assert queue.complete("w1", "000002", None, False)
+    assert queue.lease("w2", 5, 60)[0]["fund_code"] == "000003"
+    assert not queue.is_finished()
+    assert queue.complete("w2", "000003", "20231229", True)
+    assert queue.is_finished()
+    assert queue.get_done() == {
+        "000001": ("w1", "20231229", True),
+        "000002": ("w1", None, False),
+        "000003": ("w2", "20231229", True),
+    }
+
+    queue.reset()
+    assert queue.get_meta() is None
+    assert queue.count() == {}
+
+
+def test_renew_keeps_lease(make_queue):
+    queue = make_queue()
+    other = make_queue()
+    queue.enqueue(JOBS[:1])
+    # 租约时长为负数：租用后立即过期，续租成功才不会被其他工作进程接管
+    queue.lease("w1", 1, -1)
+    other.renew("w2", ["000001"], 60)
+    queue.renew("w1", ["000001"], 60)
+    assert other.lease("w2", 1, 60) == []
+    assert queue.complete("w1", "000001", "20231229", True)
+
+
+def test_expired_lease_reassigned(make_queue):
+    queue = make_queue()
+    other = make_queue()
+    queue.enqueue(JOBS[:1])
+    queue.lease("w1", 1, -1)
+
+    jobs = other.lease("w2", 1, 60)
+    assert [(job["fund_code"], job["attempts"]) for job in jobs] == [("000001", 2)]
+    # 原工作进程的租约已被接管，交回的结果不再采用
+    assert not queue.complete("w1", "000001", "20231229", True)
+    assert not queue.fail("w1", "000001", "error")
+    assert other.complete("w2", "000001", "20231229", True)
+    assert queue.get_done() == {"000001": ("w2", "20231229", True)}
+
+
+def test_expired_lease_at_max_attempts_fails(make_queue):
+    queue = make_queue(max_attempts=1)
+    queue.enqueue(JOBS[:1])
+    queue.lease("w1", 1, -1)
+    assert queue.lease("w2", 1, 60) == []
+    assert list(queue.get_failed()) == ["000001"]
+    assert queue.is_finished()
+
+
+def test_fail_requeues_until_max_attempts(make_queue):
+    queue = make_queue(max_attempts=2)
+    queue.enqueue(JOBS[:1])
+
+    queue.lease("w1", 1, 60)
+    assert queue.fail("w1", "000001", "first error")
+    assert queue.count() == {queue.PENDING: 1}
+
+    jobs = queue.lease("w2", 1, 60)
+    assert jobs[0]["attempts"] == 2
+    assert queue.fail("w2", "000001", "second error")
+    assert queue.get_failed() == {"000001": "second error"}
+    assert queue.lease("w3", 1, 60) == []
+    assert queue.is_finished()
@@ -0,0 +1,481 @@
+from typing import List
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import settings
+from logger import logger, init_logger
+from format import net_values_to_array, net_values_to_frame, net_values_to_rows
+from metrics import segment_starts
+from navstore import get_nav_store
+from offline import iter_net_value_batches, recalc
+from store import append_net_value_csv, append_net_value_parquet
+
+
+# 数据质量报告列
+QUALITY_COLS = [
+    "fund_code",
+    "status",
+    "first_trading_day",
+    "last_trading_day",
+    "expected_days",
+    "observed_days",
+    "missing_days",
+    "unavailable_days",
+    "missing_ranges",
+]
+
+# 数据质量状态：complete 完整 / backfill 需要补爬 / unavailable 缺失的交易日接口也没有净值
+QUALITY_STATUS = ["complete", "backfill", "unavailable"]
+
+
+def to_day_numbers(trading_days) -> np.ndarray:
+    """
+    交易日 (YYYYMMDD 字符串或整数) 转换为 1970-01-01 起的天数
+    :param trading_days: 交易日数组
+    :return: 天数数组 (int64)
+    """
+    days = pd.to_numeric(pd.Series(trading_days), errors="coerce").to_numpy()
+    days = days[~np.isnan(days)].astype("int64")
+    months = (days // 10000 - 1970) * 12 + days // 100 % 100 - 1
+    return (
+        months.astype("datetime64[M]").astype("datetime64[D]").astype("int64")
+        + days % 100
+        - 1
+    )
+
+
+def from_day_numbers(numbers: np.ndarray) -> np.ndarray:
+    """
+    1970-01-01 起的天数转换为交易日整数 (YYYYMMDD)
+    :param numbers: 天数数组
+    :return: 交易日数组 (int64)
+    """
+    day = np.asarray(numbers, dtype="int64").astype("datetime64[D]")
+    year = day.astype("datetime64[Y]").astype("int64") + 1970
+    month = day.astype("datetime64[M]").astype("int64") % 12 + 1
+    return (
+        year * 10000
+        + month * 100
+        + (day - day.astype("datetime64[M]")).astype("int64")
+        + 1
+    )
+
+
+class TradingCalendar(object):
+    """
+    本地交易日历：由全部基金已存储净值的交易日并集建立 (某日有净值的基金数量不低于当日存续基金数量的
+    settings.CALENDAR_MIN_COVERAGE 时视为交易日)；每个基金以自首个交易日起的日期位图记录有净值的日期，
+    缺失交易日为日历位图与基金位图之差，只与日期数量有关
+    """
+
+    def __init__(self):
+        # 每个日期有净值的基金数量 (下标为 1970-01-01 起的天数)
+        self.observed = np.zeros(0, dtype=np.int64)
+        # 存续基金数量的差分 (首个交易日 +1，最新交易日次日 -1)
+        self.active = np.zeros(0, dtype=np.int64)
+        # {基金代码: (首个交易日天数, 位图长度, 压缩位图)}
+        self.bitmaps = {}
+        # 交易日标记 (按需计算，基金变化后失效)
+        self.trading = None
+
+    def grow(self, size: int):
+        """
+        扩展按日期计数的数组
+        :param size: 需要的长度
+        :return:
+        """
+        if size > len(self.observed):
+            size = max(size, len(self.observed) * 2)
+            self.observed = np.pad(self.observed, (0, size - len(self.observed)))
+            self.active = np.pad(self.active, (0, size - len(self.active)))
+
+    def add(self, fund_code: str, trading_days):
+        """
+        加入 (或替换) 单个基金已存储的交易日
+        :param fund_code: 基金代码
+        :param trading_days: 交易日数组 (YYYYMMDD)
+        :return:
+        """
+        self.remove(fund_code)
+        numbers = np.unique(to_day_numbers(trading_days))
+        if len(numbers) == 0:
+            return
+        first, last = int(numbers[0]), int(numbers[-1])
+        self.grow(last + 2)
+        bits = np.zeros(last - first + 1, dtype=bool)
+        bits[numbers - first] = True
+        self.bitmaps[fund_code] = (first, len(bits), np.packbits(bits))
+        self.observed[numbers] += 1
+        self.active[first] += 1
+        self.active[last + 1] -= 1
+        self.trading = None
+
+    def remove(self, fund_code: str):
+        """
+        移除单个基金
+        :param fund_code: 基金代码
+        :return:
+        """
+        if fund_code not in self.bitmaps:
+            return
+        first, length, _ = self.bitmaps[fund_code]
+        self.observed[first : first + length] -= self.get_bits(fund_code)
+        self.active[first] -= 1
+        self.active[first + length] += 1
+        del self.bitmaps[fund_code]
+        self.trading = None
+
+    def get_bits(self, fund_code: str) -> np.ndarray:
+        """
+        获取基金自首个交易日起的日期位图
+        :param fund_code: 基金代码
+        :return: bool 数组
+        """
+        _, length, packed = self.bitmaps[fund_code]
+        return np.unpackbits(packed, count=length).astype(bool)
+
+    def get_trading(self) -> np.ndarray:
+        """
+        获取每个日期是否为交易日
+        :return: bool 数组 (下标为 1970-01-01 起的天数)
+        """
+        if self.trading is None:
+            active = np.cumsum(self.active)
+            self.trading = (self.observed > 0) & (
+                self.observed >= settings.CALENDAR_MIN_COVERAGE * active
+            )
+        return self.trading
+
+    def get_trading_days(self) -> np.ndarray:
+        """
+        获取交易日历
+        :return: 交易日数组 (YYYYMMDD 整数，升序)
+        """
+        return from_day_numbers(np.flatnonzero(self.get_trading()))
+
+    def get_fund_days(self, fund_code: str) -> np.ndarray:
+        """
+        获取基金已存储的交易日
+        :param fund_code: 基金代码
+        :return: 交易日数组 (YYYYMMDD 整数，升序)
+        """
+        return from_day_numbers(
+            np.flatnonzero(self.get_bits(fund_code)) + self.bitmaps[fund_code][0]
+        )
+
+    def get_missing(self, fund_code: str) -> np.ndarray:
+        """
+        获取基金首个交易日与最新交易日之间缺失净值的交易日
+        :param fund_code: 基金代码
+        :return: 缺失的交易日数组 (YYYYMMDD 整数，升序)
+        """
+        first, length, _ = self.bitmaps[fund_code]
+        missing = self.get_trading()[first : first + length] & ~self.get_bits(fund_code)
+        return from_day_numbers(np.flatnonzero(missing) + first)
+
+    def get_expected_count(self, fund_code: str) -> int:
+        """
+        获取基金首个交易日与最新交易日之间的交易日数量
+        :param fund_code: 基金代码
+        :return: 交易日数量
+        """
+        first, length, _ = self.bitmaps[fund_code]
+        return int(np.count_nonzero(self.get_trading()[first : first + length]))
+
+    def get_gap_windows(self, missing_days: np.ndarray) -> List[tuple]:
+        """
+        把缺失交易日合并为请求区间 (相隔不超过 settings.BACKFILL_MERGE_DAYS 个交易日的合并为一个区间)
+        :param missing_days: 缺失的交易日数组 (YYYYMMDD 整数，升序)
+        :return: [(起始日, 结束日, 是否不可变)]，日期格式为 YYYY-MM-DD，与 fetcher.year_windows 相同
+        """
+        if len(missing_days) == 0:
+            return []
+        numbers = to_day_numbers(missing_days)
+        # 交易日序号 (当日之前的交易日数量)
+        positions = np.cumsum(self.get_trading())[numbers]
+        starts = np.flatnonzero(
+            np.append(True, np.diff(positions) > settings.BACKFILL_MERGE_DAYS)
+        )
+        ends = np.append(starts[1:], len(numbers)) - 1
+        dates = pd.to_datetime(missing_days.astype(str), format="%Y%m%d").strftime(
+            "%Y-%m-%d"
+        )
+        return [(dates[start], dates[end], False) for start, end in zip(starts, ends)]
+
+
+def build_trading_calendar() -> TradingCalendar:
+    """
+    由已存储的净值数据建立交易日历 (按基金分批读取)
+    :return: 交易日历
+    """
+    calendar = TradingCalendar()
+    for df in iter_net_value_batches():
+        if df.empty:
+            continue
+        df = df.sort_values(["fund_code", "trading_day"], kind="stable")
+        fund_code = df["fund_code"].astype(str).to_numpy()
+        trading_day = df["trading_day"].to_numpy()
+        starts = segment_starts(fund_code)
+        ends = np.append(starts[1:], len(fund_code))
+        for start, end in zip(starts, ends):
+            calendar.add(fund_code[start], trading_day[start:end])
+    return calendar
+
+
+class CalendarGapStore(object):
+    """
+    补爬后接口仍没有净值的交易日记录 (SQLite)：之后的检查中不再补爬，报告中记为无数据
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: 记录文件地址
+        """
+        self.path = path or settings.CALENDAR_GAP_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS calendar_gap (
+                    fund_code TEXT NOT NULL,
+                    trading_day INTEGER NOT NULL,
+                    PRIMARY KEY (fund_code, trading_day)
+                )
+                """
+            )
+
+    def load(self) -> dict:
+        """
+        读取全部无数据的交易日
+        :return: {基金代码: 交易日数组 (YYYYMMDD 整数)}
+        """
+        rows = self.conn.execute(
+            "SELECT fund_code, trading_day FROM calendar_gap ORDER BY fund_code, trading_day"
+        ).fetchall()
+        unavailable = {}
+        for fund_code, trading_day in rows:
+            unavailable.setdefault(fund_code, []).append(trading_day)
+        return {
+            fund_code: np.array(trading_days, dtype="int64")
+            for fund_code, trading_days in unavailable.items()
+        }
+
+    def put(self, fund_code: str, trading_days):
+        """
+        记录无数据的交易日
+        :param fund_code: 基金代码
+        :param trading_days: 交易日数组 (YYYYMMDD 整数)
+        :return:
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO calendar_gap (fund_code, trading_day) VALUES (?, ?)",
+                [(fund_code, int(trading_day)) for trading_day in trading_days],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def format_ranges(windows: List[tuple]) -> str:
+    """
+    缺失区间转换为报告中的文本
+    :param windows: get_gap_windows 返回的区间
+    :return: 起始日~结束日，多个区间以分号分隔
+    """
+    return ";".join(
+        start.replace("-", "") + ("" if end == start else "~" + end.replace("-", ""))
+        for start, end, _ in windows
+    )
+
+
+def build_quality_report(calendar: TradingCalendar, unavailable: dict) -> pd.DataFrame:
+    """
+    生成数据质量报告：每个基金首个交易日与最新交易日之间应有、已有与缺失的交易日数量
+    :param calendar: 交易日历
+    :param unavailable: {基金代码: 接口没有净值的交易日数组}
+    :return: 数据质量报告 (QUALITY_COLS)
+    """
+    rows = []
+    for fund_code in sorted(calendar.bitmaps):
+        missing = calendar.get_missing(fund_code)
+        is_unavailable = np.isin(missing, unavailable.get(fund_code, []))
+        to_backfill = missing[~is_unavailable]
+        if len(to_backfill) > 0:
+            status = "backfill"
+        elif len(missing) > 0:
+            status = "unavailable"
+        else:
+            status = "complete"
+        first, length, _ = calendar.bitmaps[fund_code]
+        first_day, last_day = from_day_numbers([first, first + length - 1])
+        rows.append(
+            (
+                fund_code,
+                status,
+                str(first_day),
+                str(last_day),
+                calendar.get_expected_count(fund_code),
+                int(np.count_nonzero(calendar.get_bits(fund_code))),
+                len(to_backfill),
+                int(np.count_nonzero(is_unavailable)),
+                format_ranges(calendar.get_gap_windows(missing)),
+            )
+        )
+    return pd.DataFrame(rows, columns=QUALITY_COLS)
+
+
+def fetch_gaps(fetcher, fund_code: str, windows: List[tuple]) -> np.ndarray:
+    """
+    获取缺失区间内的净值 (每个区间从第一页起翻页，通常只有一页)
+    :param fetcher: HTTP 净值数据获取器
+    :param fund_code: 基金代码
+    :param windows: 请求区间
+    :return: 净值结构化数组
+    """
+    net_value_obj_list = []
+    for window in windows:
+        page_index = 1
+        total_pages = 1
+        while page_index <= total_pages:
+            page_net_value_obj_list, total_pages = fetcher.fetch_page(
+                fund_code, page_index, window
+            )
+            net_value_obj_list.extend(page_net_value_obj_list)
+            page_index += 1
+    return net_values_to_array(net_value_obj_list)
+
+
+def save_backfill(fund_code: str, net_values: np.ndarray, db=None):
+    """
+    写入补爬的净值 (只包含原来缺失的交易日，追加到主存储与内存映射净值存储)
+    :param fund_code: 基金代码
+    :param net_values: 净值结构化数组
+    :param db: 数据库连接 (MYSQL类型使用)
+    :return:
+    """
+    if settings.STORE_TYPE == "MYSQL":
+        from model import bulk_upsert
+
+        bulk_upsert(
+            db.engine,
+            net_values_to_rows(fund_code, net_values),
+            settings.MYSQL_BATCH_SIZE,
+        )
+    elif settings.STORE_TYPE == "CSV":
+        append_net_value_csv(net_values_to_frame(fund_code, net_values))
+    elif settings.STORE_TYPE == "PARQUET":
+        append_net_value_parquet(net_values_to_frame(fund_code, net_values))
+    else:
+        raise Exception("不支持的存储类型")
+    nav_store = get_nav_store()
+    # 内存映射净值存储中没有该基金时不写入 (增量爬取时由主存储重建)
+    if nav_store is not None and len(nav_store.get(fund_code)) > 0:
+        nav_store.append(fund_code, net_values)
+
+
+def backfill(calendar: TradingCalendar, report_df: pd.DataFrame, gap_store) -> list:
+    """
+    补爬报告中需要补爬的基金：只请求缺失交易日所在的日期区间 (按页码分页的结果随每日新增净值整体后移，
+    因此按日期区间定位缺失的数据)，只写入原来缺失的交易日；补爬后仍没有净值的交易日记录为无数据
+    (补爬使用 HTTP 接口，与 settings.FETCHER_TYPE 无关)
+    :param calendar: 交易日历 (补爬成功的基金更新交易日)
+    :param report_df: 数据质量报告
+    :param gap_store: 无数据交易日记录
+    :return: 补爬到净值的基金代码列表
+    """
+    from fetcher import HttpNetValueFetcher
+
+    unavailable = gap_store.load()
+    fetcher = HttpNetValueFetcher()
+    db = None
+    if settings.STORE_TYPE == "MYSQL":
+        from model import Database
+
+        db = Database(settings.MYSQL_URL)
+        db.connect(settings.MYSQL_POOL_SIZE, settings.MYSQL_POOL_RECYCLE)
+    filled_fund_codes = []
+    try:
+        for fund_code in report_df.loc[report_df["status"] == "backfill", "fund_code"]:
+            missing = calendar.get_missing(fund_code)
+            missing = missing[~np.isin(missing, unavailable.get(fund_code, []))]
+            windows = calendar.get_gap_windows(missing)
+            try:
+                net_values = fetch_gaps(fetcher, fund_code, windows)
+                net_values = net_values[np.isin(net_values["trading_day"], missing)]
+                if len(net_values) > 0:
+                    save_backfill(fund_code, net_values, db)
+                    calendar.add(
+                        fund_code,
+                        np.union1d(
+                            calendar.get_fund_days(fund_code), net_values["trading_day"]
+                        ),
+                    )
+                    filled_fund_codes.append(fund_code)
+                gap_store.put(
+                    fund_code, missing[~np.isin(missing, net_values["trading_day"])]
+                )
+            except Exception as e:
+                logger.error("补爬缺失交易日失败，基金代码：" + fund_code + "，错误信息：" + str(e))
+                continue
+            logger.info(
+                "补爬缺失交易日，基金代码："
+                + fund_code
+                + "，请求区间："
+                + str(len(windows))
+                + "个，缺失交易日："
+                + str(len(missing))
+                + "天，补爬到净值："
+                + str(len(net_values))
+                + "条"
+            )
+    finally:
+        fetcher.close()
+        nav_store = get_nav_store()
+        if nav_store is not None:
+            nav_store.close()
+        if db is not None:
+            db.disconnect()
+    return filled_fund_codes
+
+
+def run_quality_check(do_backfill: bool = None) -> pd.DataFrame:
+    """
+    数据质量检查：由已存储的净值建立交易日历，找出每个基金缺失的交易日，
+    按配置补爬缺失区间并重新计算补爬到净值的基金，写出数据质量报告 (settings.CSV_WRITE_DIR/data_quality.csv)
+    :param do_backfill: 是否补爬，None 表示使用 settings.QUALITY_BACKFILL
+    :return: 数据质量报告
+    """
+    init_logger()
+    if do_backfill is None:
+        do_backfill = settings.QUALITY_BACKFILL
+    logger.info("开始数据质量检查")
+    calendar = build_trading_calendar()
+    gap_store = CalendarGapStore()
+    try:
+        report_df = build_quality_report(calendar, gap_store.load())
+        if do_backfill and (report_df["status"] == "backfill").any():
+            filled_fund_codes = backfill(calendar, report_df, gap_store)
+            if filled_fund_codes:
+                recalc(filled_fund_codes)
+            report_df = build_quality_report(calendar, gap_store.load())
+    finally:
+        gap_store.close()
+    os.makedirs(settings.CSV_WRITE_DIR, exist_ok=True)
+    report_df.to_csv(
+        settings.CSV_WRITE_DIR + "/data_quality.csv", index=False, encoding="utf-8-sig"
+    )
+    counts = report_df["status"].value_counts()
+    logger.info(
+        "数据质量检查完成，交易日数量："
+        + str(len(calendar.get_trading_days()))
+        + "天，"
+        + "，".join(
+            status + "：" + str(counts.get(status, 0)) + "个" for status in QUALITY_STATUS
+        )
+    )
+    return report_df
@@ -0,0 +1,665 @@
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import settings
+from logger import logger
+
+
+def make_worker_id() -> str:
+    """
+    生成工作进程编号 (主机名-进程号-随机串，同时用作结果分片文件名)
+    :return: 工作进程编号
+    """
+    return socket.gethostname() + "-" + str(os.getpid()) + "-" + uuid.uuid4().hex[:6]
+
+
+class WorkQueue(object):
+    """
+    分布式爬取任务队列基类：
+    协调进程登记基金任务，各节点的工作进程租用任务 (租约到期未完成的任务重新分配给其他工作进程)，
+    完成或失败后交回；失败的任务在尝试次数未达上限前重新排队
+    """
+
+    # 任务状态
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, max_attempts: int = None):
+        """
+        :param max_attempts: 每个基金的最大尝试次数
+        """
+        self.max_attempts = max_attempts or settings.MAX_ATTEMPTS
+
+    def reset(self):
+        """
+        清空队列 (包括运行信息)
+        :return:
+        """
+        raise NotImplementedError
+
+    def get_meta(self) -> Optional[dict]:
+        """
+        获取本次运行信息 (由协调进程写入)
+        :return: 运行信息，没有时返回 None
+        """
+        raise NotImplementedError
+
+    def set_meta(self, meta: dict):
+        """
+        写入本次运行信息
+        :param meta: 运行信息
+        :return:
+        """
+        raise NotImplementedError
+
+    def enqueue(self, jobs: List[Tuple[str, str, Optional[str]]]):
+        """
+        登记任务
+        :param jobs: [(基金代码, 基金名称, 已存储的最新交易日)]
+        :return:
+        """
+        raise NotImplementedError
+
+    def lease(self, worker_id: str, size: int, lease_seconds: float) -> List[dict]:
+        """
+        租用任务 (同时回收租约已过期的任务)
+        :param worker_id: 工作进程编号
+        :param size: 最多租用的任务数量
+        :param lease_seconds: 租约时长 (秒)
+        :return: [{fund_code, fund_name, since, attempts}]
+        """
+        raise NotImplementedError
+
+    def renew(self, worker_id: str, fund_codes: List[str], lease_seconds: float):
+        """
+        续租仍由该工作进程持有的任务
+        :param worker_id: 工作进程编号
+        :param fund_codes: 基金代码列表
+        :param lease_seconds: 租约时长 (秒)
+        :return:
+        """
+        raise NotImplementedError
+
+    def complete(
+        self,
+        worker_id: str,
+        fund_code: str,
+        last_trading_day: str = None,
+        has_result: bool = False,
+    ) -> bool:
+        """
+        交回完成的任务
+        :param worker_id: 工作进程编号
+        :param fund_code: 基金代码
+        :param last_trading_day: 已存储的最新交易日
+        :param has_result: 是否写出了结果
+        :return: 是否成功 (租约已被其他工作进程接管时返回 False)
+        """
+        raise NotImplementedError
+
+    def fail(self, worker_id: str, fund_code: str, error: str) -> bool:
+        """
+        交回失败的任务 (尝试次数未达上限时重新排队)
+        :param worker_id: 工作进程编号
+        :param fund_code: 基金代码
+        :param error: 错误信息
+        :return: 是否成功 (租约已被其他工作进程接管时返回 False)
+        """
+        raise NotImplementedError
+
+    def get_done(self) -> Dict[str, Tuple[str, Optional[str], bool]]:
+        """
+        获取已完成的任务
+        :return: {基金代码: (完成的工作进程编号, 最新交易日, 是否写出了结果)}
+        """
+        raise NotImplementedError
+
+    def get_failed(self) -> Dict[str, str]:
+        """
+        获取失败次数达到上限的任务
+        :return: {基金代码: 错误信息}
+        """
+        raise NotImplementedError
+
+    def count(self) -> dict:
+        """
+        统计各状态的任务数量
+        :return: {状态: 数量}
+        """
+        raise NotImplementedError
+
+    def is_finished(self) -> bool:
+        """
+        全部任务是否已完成或失败 (没有待处理、处理中的任务)
+        :return:
+        """
+        counts = self.count()
+        return counts.get(self.PENDING, 0) == 0 and counts.get(self.LEASED, 0) == 0
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    基于 SQLite 的任务队列 (租用任务时加写锁，适用于单机多进程或共享文件系统)
+    """
+
+    def __init__(self, path: str = None, max_attempts: int = None):
+        """
+        :param path: 队列文件地址
+        :param max_attempts: 每个基金的最大尝试次数
+        """
+        super().__init__(max_attempts)
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # 手动管理事务，租用任务时使用 BEGIN IMMEDIATE 加写锁
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS work_job (
+                    fund_code TEXT PRIMARY KEY,
+                    fund_name TEXT,
+                    since TEXT,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    lease_expires_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_trading_day TEXT,
+                    has_result INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_work_job_status "
+                "ON work_job (status, fund_code)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS work_meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务 (提交前持有数据库写锁，其他进程的写事务等待)
+        :return: 数据库连接
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def reset(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM work_job")
+            conn.execute("DELETE FROM work_meta")
+
+    def get_meta(self) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT value FROM work_meta WHERE key = 'meta'"
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_meta(self, meta: dict):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO work_meta (key, value) VALUES ('meta', ?)",
+                (json.dumps(meta),),
+            )
+
+    def enqueue(self, jobs: List[Tuple[str, str, Optional[str]]]):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO work_job "
+                "(fund_code, fund_name, since, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (fund_code, fund_name, since, self.PENDING, now)
+                    for fund_code, fund_name, since in jobs
+                ],
+            )
+
+    def lease(self, worker_id: str, size: int, lease_seconds: float) -> List[dict]:
+        now = time.time()
+        with self.transaction() as conn:
+            # 租约过期且尝试次数已达上限的任务不再分配
+            conn.execute(
+                "UPDATE work_job SET status = ?, error = ?, owner = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (
+                    self.FAILED,
+                    "租约过期，工作进程可能已退出",
+                    now,
+                    self.LEASED,
+                    now,
+                    self.max_attempts,
+                ),
+            )
+            rows = conn.execute(
+                "SELECT fund_code, fund_name, since, attempts, owner FROM work_job "
+                "WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY fund_code LIMIT ?",
+                (self.PENDING, self.LEASED, now, size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE work_job SET status = ?, owner = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE fund_code = ?",
+                [
+                    (self.LEASED, worker_id, now + lease_seconds, now, row[0])
+                    for row in rows
+                ],
+            )
+        for row in rows:
+            if row[4] is not None:
+                logger.warning("任务租约过期，重新分配，基金代码：" + row[0] + "，原工作进程：" + row[4])
+        return [
+            {
+                "fund_code": row[0],
+                "fund_name": row[1],
+                "since": row[2],
+                "attempts": row[3] + 1,
+            }
+            for row in rows
+        ]
+
+    def renew(self, worker_id: str, fund_codes: List[str], lease_seconds: float):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE work_job SET lease_expires_at = ?, updated_at = ? "
+                "WHERE fund_code = ? AND status = ? AND owner = ?",
+                [
+                    (now + lease_seconds, now, fund_code, self.LEASED, worker_id)
+                    for fund_code in fund_codes
+                ],
+            )
+
+    def complete(
+        self,
+        worker_id: str,
+        fund_code: str,
+        last_trading_day: str = None,
+        has_result: bool = False,
+    ) -> bool:
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE work_job SET status = ?, last_trading_day = ?, has_result = ?, "
+                "error = NULL, updated_at = ? WHERE fund_code = ? AND status = ? "
+                "AND owner = ?",
+                (
+                    self.DONE,
+                    last_trading_day,
+                    int(has_result),
+                    time.time(),
+                    fund_code,
+                    self.LEASED,
+                    worker_id,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, worker_id: str, fund_code: str, error: str) -> bool:
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE work_job SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "owner = CASE WHEN attempts >= ? THEN owner ELSE NULL END, "
+                "error = ?, updated_at = ? WHERE fund_code = ? AND status = ? AND owner = ?",
+                (
+                    self.max_attempts,
+                    self.FAILED,
+                    self.PENDING,
+                    self.max_attempts,
+                    error,
+                    time.time(),
+                    fund_code,
+                    self.LEASED,
+                    worker_id,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def get_done(self) -> Dict[str, Tuple[str, Optional[str], bool]]:
+        return {
+            row[0]: (row[1], row[2], bool(row[3]))
+            for row in self.conn.execute(
+                "SELECT fund_code, owner, last_trading_day, has_result FROM work_job "
+                "WHERE status = ?",
+                (self.DONE,),
+            )
+        }
+
+    def get_failed(self) -> Dict[str, str]:
+        return dict(
+            self.conn.execute(
+                "SELECT fund_code, error FROM work_job WHERE status = ?",
+                (self.FAILED,),
+            ).fetchall()
+        )
+
+    def count(self) -> dict:
+        return dict(
+            self.conn.execute(
+                "SELECT status, COUNT(*) FROM work_job GROUP BY status"
+            ).fetchall()
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+# 回收过期租约并租用任务 (KEYS: 待处理列表, 租约有序集合; ARGV: 键前缀, 工作进程编号, 当前时间, 租约到期时间, 租用数量, 最大尝试次数)
+REDIS_LEASE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+for _, code in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], code)
+    local key = ARGV[1] .. ':job:' .. code
+    if tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(ARGV[6]) then
+        redis.call('HSET', key, 'status', 'failed', 'error', '租约过期，工作进程可能已退出')
+    else
+        redis.call('HSET', key, 'status', 'pending')
+        redis.call('RPUSH', KEYS[1], code)
+    end
+end
+local leased = {}
+for i = 1, tonumber(ARGV[5]) do
+    local code = redis.call('LPOP', KEYS[1])
+    if not code then
+        break
+    end
+    local key = ARGV[1] .. ':job:' .. code
+    redis.call('HSET', key, 'status', 'leased', 'owner', ARGV[2])
+    redis.call('HINCRBY', key, 'attempts', 1)
+    redis.call('ZADD', KEYS[2], ARGV[4], code)
+    table.insert(leased, code)
+end
+return leased
+"""
+
+# 续租 (KEYS: 租约有序集合; ARGV: 键前缀, 工作进程编号, 租约到期时间, 基金代码...)
+REDIS_RENEW_SCRIPT = """
+for i = 4, #ARGV do
+    local key = ARGV[1] .. ':job:' .. ARGV[i]
+    if redis.call('HGET', key, 'owner') == ARGV[2]
+        and redis.call('HGET', key, 'status') == 'leased' then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[3], ARGV[i])
+    end
+end
+return 0
+"""
+
+# 交回任务 (KEYS: 待处理列表, 租约有序集合, 任务哈希; ARGV: 工作进程编号, 基金代码, 状态, 最新交易日,
+# 是否写出了结果, 错误信息, 最大尝试次数)
+REDIS_FINISH_SCRIPT = """
+if redis.call('HGET', KEYS[3], 'owner') ~= ARGV[1]
+    or redis.call('HGET', KEYS[3], 'status') ~= 'leased' then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[2])
+local status = ARGV[3]
+if status == 'failed'
+    and tonumber(redis.call('HGET', KEYS[3], 'attempts')) < tonumber(ARGV[7]) then
+    status = 'pending'
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+end
+redis.call('HSET', KEYS[3], 'status', status, 'last_trading_day', ARGV[4],
+    'has_result', ARGV[5], 'error', ARGV[6])
+return 1
+"""
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    基于 Redis 的任务队列 (租用、续租、交回使用 Lua 脚本保证原子性，适用于多台机器；需要安装 redis 包)
+    键：{前缀}:job:{基金代码} 任务哈希，{前缀}:pending 待处理列表，{前缀}:leased 租约到期时间有序集合，
+    {前缀}:codes 全部基金代码集合，{前缀}:meta 运行信息
+    """
+
+    def __init__(self, url: str, prefix: str = None, max_attempts: int = None):
+        """
+        :param url: Redis 地址 (redis://host:port/db)
+        :param prefix: 键前缀
+        :param max_attempts: 每个基金的最大尝试次数
+        """
+        import redis
+
+        super().__init__(max_attempts)
+        self.prefix = prefix or settings.WORK_QUEUE_NAME
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.pending_key = self.prefix + ":pending"
+        self.leased_key = self.prefix + ":leased"
+        self.codes_key = self.prefix + ":codes"
+        self.meta_key = self.prefix + ":meta"
+        self.lease_script = self.client.register_script(REDIS_LEASE_SCRIPT)
+        self.renew_script = self.client.register_script(REDIS_RENEW_SCRIPT)
+        self.finish_script = self.client.register_script(REDIS_FINISH_SCRIPT)
+
+    def job_key(self, fund_code: str) -> str:
+        return self.prefix + ":job:" + fund_code
+
+    def get_jobs(self) -> Dict[str, dict]:
+        """
+        读取全部任务
+        :return: {基金代码: 任务哈希}
+        """
+        fund_codes = sorted(self.client.smembers(self.codes_key))
+        pipeline = self.client.pipeline(transaction=False)
+        for fund_code in fund_codes:
+            pipeline.hgetall(self.job_key(fund_code))
+        return dict(zip(fund_codes, pipeline.execute()))
+
+    def reset(self):
+        fund_codes = self.client.smembers(self.codes_key)
+        pipeline = self.client.pipeline()
+        for fund_code in fund_codes:
+            pipeline.delete(self.job_key(fund_code))
+        pipeline.delete(
+            self.pending_key, self.leased_key, self.codes_key, self.meta_key
+        )
+        pipeline.execute()
+
+    def get_meta(self) -> Optional[dict]:
+        value = self.client.get(self.meta_key)
+        return json.loads(value) if value is not None else None
+
+    def set_meta(self, meta: dict):
+        self.client.set(self.meta_key, json.dumps(meta))
+
+    def enqueue(self, jobs: List[Tuple[str, str, Optional[str]]]):
+        pipeline = self.client.pipeline()
+        for fund_code, fund_name, since in jobs:
+            pipeline.hset(
+                self.job_key(fund_code),
+                mapping={
+                    "fund_name": fund_name or "",
+                    "since": since or "",
+                    "status": self.PENDING,
+                    "owner": "",
+                    "attempts": 0,
+                    "last_trading_day": "",
+                    "has_result": 0,
+                    "error": "",
+                },
+            )
+            pipeline.sadd(self.codes_key, fund_code)
+            pipeline.rpush(self.pending_key, fund_code)
+        pipeline.execute()
+
+    def lease(self, worker_id: str, size: int, lease_seconds: float) -> List[dict]:
+        now = time.time()
+        fund_codes = self.lease_script(
+            keys=[self.pending_key, self.leased_key],
+            args=[
+                self.prefix,
+                worker_id,
+                now,
+                now + lease_seconds,
+                size,
+                self.max_attempts,
+            ],
+        )
+        pipeline = self.client.pipeline(transaction=False)
+        for fund_code in fund_codes:
+            pipeline.hgetall(self.job_key(fund_code))
+        return [
+            {
+                "fund_code": fund_code,
+                "fund_name": job["fund_name"],
+                "since": job["since"] or None,
+                "attempts": int(job["attempts"]),
+            }
+            for fund_code, job in zip(fund_codes, pipeline.execute())
+        ]
+
+    def renew(self, worker_id: str, fund_codes: List[str], lease_seconds: float):
+        if fund_codes:
+            self.renew_script(
+                keys=[self.leased_key],
+                args=[self.prefix, worker_id, time.time() + lease_seconds]
+                + list(fund_codes),
+            )
+
+    def finish(
+        self,
+        worker_id: str,
+        fund_code: str,
+        status: str,
+        last_trading_day: str = None,
+        has_result: bool = False,
+        error: str = None,
+    ) -> bool:
+        return bool(
+            self.finish_script(
+                keys=[self.pending_key, self.leased_key, self.job_key(fund_code)],
+                args=[
+                    worker_id,
+                    fund_code,
+                    status,
+                    last_trading_day or "",
+                    int(has_result),
+                    error or "",
+                    self.max_attempts,
+                ],
+            )
+        )
+
+    def complete(
+        self,
+        worker_id: str,
+        fund_code: str,
+        last_trading_day: str = None,
+        has_result: bool = False,
+    ) -> bool:
+        return self.finish(
+            worker_id, fund_code, self.DONE, last_trading_day, has_result
+        )
+
+    def fail(self, worker_id: str, fund_code: str, error: str) -> bool:
+        return self.finish(worker_id, fund_code, self.FAILED, error=error)
+
+    def get_done(self) -> Dict[str, Tuple[str, Optional[str], bool]]:
+        return {
+            fund_code: (
+                job["owner"],
+                job["last_trading_day"] or None,
+                job["has_result"] == "1",
+            )
+            for fund_code, job in self.get_jobs().items()
+            if job.get("status") == self.DONE
+        }
+
+    def get_failed(self) -> Dict[str, str]:
+        return {
+            fund_code: job["error"]
+            for fund_code, job in self.get_jobs().items()
+            if job.get("status") == self.FAILED
+        }
+
+    def count(self) -> dict:
+        counts = {}
+        for job in self.get_jobs().values():
+            counts[job.get("status")] = counts.get(job.get("status"), 0) + 1
+        return counts
+
+    def is_finished(self) -> bool:
+        return (
+            self.client.llen(self.pending_key) == 0
+            and self.client.zcard(self.leased_key) == 0
+        )
+
+    def close(self):
+        self.client.close()
+
+
+def create_work_queue(url: str = None) -> WorkQueue:
+    """
+    按地址创建任务队列
+    :param url: 队列地址 (sqlite:///文件路径 或 redis://host:port/db)，默认 settings.WORK_QUEUE_URL
+    :return: 任务队列
+    """
+    url = url or settings.WORK_QUEUE_URL
+    if url.startswith("sqlite:///"):
+        return SqliteWorkQueue(url[len("sqlite:///") :])
+    elif url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisWorkQueue(url)
+    else:
+        raise Exception("WORK_QUEUE_URL must start with sqlite:/// or redis://")
+
+
+class LeaseHeartbeat(object):
+    """
+    租约心跳：后台线程按租约时长的三分之一定期续租当前处理中的任务
+    (使用独立的队列连接，sqlite3 连接不能跨线程使用)
+    """
+
+    def __init__(self, worker_id: str, lease_seconds: float, url: str = None):
+        """
+        :param worker_id: 工作进程编号
+        :param lease_seconds: 租约时长 (秒)
+        :param url: 队列地址
+        """
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.url = url
+        self.fund_codes = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        queue = create_work_queue(self.url)
+        try:
+            while not self.stop_event.wait(self.lease_seconds / 3):
+                fund_codes = list(self.fund_codes)
+                if not fund_codes:
+                    continue
+                try:
+                    queue.renew(self.worker_id, fund_codes, self.lease_seconds)
+                except Exception as e:
+                    logger.warning("任务续租失败，错误信息：" + str(e))
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()